@@ -0,0 +1,141 @@
+"""Kiểm tra ngân sách gọi API: chạy một phiên (AppTest) với backend Sheets giả lập qua các thao tác chính,
+đếm số lần đọc/ghi Sheets của từng thao tác và thoát với mã 1 nếu thao tác nào vượt ngân sách.
+
+    python api_budget.py            # in bảng và kiểm tra
+    python api_budget.py --json so_lieu.json
+
+Kịch bản chạy hai vòng (bộ nhớ đệm lạnh rồi ấm); ngân sách áp dụng cho cả hai vòng. Khi một thay đổi làm
+giảm số lần gọi, hạ ngân sách tương ứng trong BUDGETS để giữ mức mới.
+"""
+import argparse
+import json
+import os
+import sys
+from collections import Counter
+
+# Kiểm tra phiên bản theo thời gian không thuộc về thao tác nào: chỉ poll một lần rồi thôi để số liệu ổn định
+os.environ["REVISION_POLL_SECONDS"] = "3600"
+
+import fake_sheets
+import loadtest
+from fake_sheets import WRITE_CALLS
+from loadtest import APP_PATH, EDIT_FLAG, PASSWORD, AppTest, click, fill
+
+# Ngân sách mỗi thao tác: (số request đọc tối đa, số request ghi tối đa); đọc gồm cả drive.files.get
+BUDGETS = {
+    "open_app": (1, 0),
+    "login": (5, 0),             # mở spreadsheet, modifiedTime, ảnh chụp Config/User/tiêu đề, form nhập liệu và cột gợi ý
+    "open_input_form": (1, 0),
+    "submit_form": (3, 1),       # đọc vị trí ghi + modifiedTime sau khi ghi
+    "open_view": (0, 0),
+    "apply_filter": (1, 0),
+    "edit_row": (3, 1),          # xác nhận hàng theo Ma_ban_ghi + modifiedTime sau khi ghi
+    "open_search": (0, 0),
+    "search": (1, 0),
+}
+
+
+class Meter:
+    """Chạy lại script và ghi số request đọc/ghi của backend giả lập cho từng thao tác."""
+
+    def __init__(self, at, backend):
+        self.at = at
+        self.backend = backend
+        self.rows = []
+
+    def step(self, action, round_no):
+        before = Counter(self.backend.calls)
+        self.at.run()
+        diff = Counter(self.backend.calls) - before
+        writes = sum(n for name, n in diff.items() if name in WRITE_CALLS)
+        reads = sum(diff.values()) - writes
+        max_reads, max_writes = BUDGETS[action]
+        errors = [str(e.value)[:200] for e in self.at.exception]
+        self.rows.append({
+            "action": action,
+            "round": round_no,
+            "reads": reads,
+            "writes": writes,
+            "budget_reads": max_reads,
+            "budget_writes": max_writes,
+            "calls": dict(diff),
+            "exceptions": errors,
+            "ok": reads <= max_reads and writes <= max_writes and not errors,
+        })
+
+
+def run_flow(meter, username, rounds):
+    at = meter.at
+    meter.step("open_app", 1)
+    fill(at, "login_username", username)
+    fill(at, "login_password", PASSWORD)
+    click(at, label="Đăng nhập")
+    meter.step("login", 1)
+    if not any(button.key == "nav_Nhập liệu" for button in at.button):
+        raise RuntimeError("Đăng nhập không thành công, không thấy menu chức năng.")
+
+    for round_no in range(1, rounds + 1):
+        click(at, key="nav_Xem và sửa dữ liệu")
+        meter.step("open_view", round_no)
+        click(at, key="apply_filter")
+        meter.step("apply_filter", round_no)
+        at.session_state[EDIT_FLAG] = {"column": "Ghi_chu", "value": f"kiểm tra ngân sách {round_no}"}
+        meter.step("edit_row", round_no)
+        at.session_state[EDIT_FLAG] = None
+
+        click(at, key="nav_Nhập liệu")
+        meter.step("open_input_form", round_no)
+        for widget in at.text_input:
+            if str(widget.key).endswith("Ho_ten_input"):
+                widget.input(f"Kiểm tra ngân sách {round_no}")
+            elif str(widget.key).endswith("So_CMT_input"):
+                widget.input(f"{round_no:012d}")
+        click(at, label="Gửi")
+        meter.step("submit_form", round_no)
+
+        click(at, key="nav_Tìm kiếm")
+        meter.step("open_search", round_no)
+        fill(at, "search_keyword", "khách hàng 1")
+        click(at, key="search_button")
+        meter.step("search", round_no)
+
+
+def measure(username="user1", rounds=2, data_path=None):
+    """Chạy kịch bản trên backend giả lập, trả về số liệu từng thao tác (dùng cả trong tests/)."""
+    loadtest.pin_app_test_config()
+    client = fake_sheets.install(fake_sheets.create_client(data_path=data_path))
+    meter = Meter(AppTest.from_file(APP_PATH, default_timeout=60), client.backend)
+    run_flow(meter, username, rounds)
+    return meter.rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kiểm tra số request Sheets mỗi thao tác so với ngân sách.")
+    parser.add_argument("--user", default="user1", help="Tài khoản dùng cho kịch bản (mật khẩu dữ liệu mẫu)")
+    parser.add_argument("--rounds", type=int, default=2, help="Số vòng thao tác sau khi đăng nhập")
+    parser.add_argument("--data", default=None, help="File JSON dữ liệu giả lập (mặc định dùng dữ liệu mẫu)")
+    parser.add_argument("--json", dest="json_path", default=None, help="Ghi số liệu ra file JSON")
+    args = parser.parse_args()
+
+    rows = measure(args.user, args.rounds, args.data)
+
+    print(f"{'thao tác':<16} {'vòng':>4} {'đọc':>9} {'ghi':>9}  chi tiết")
+    for row in rows:
+        flag = "" if row["ok"] else "  <-- VƯỢT NGÂN SÁCH" if not row["exceptions"] else "  <-- LỖI"
+        print(f"{row['action']:<16} {row['round']:>4} {row['reads']:>4}/{row['budget_reads']:<4} "
+              f"{row['writes']:>4}/{row['budget_writes']:<4} {row['calls']}{flag}")
+        for error in row["exceptions"]:
+            print(f"    {error}")
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"budgets": BUDGETS, "results": rows}, f, ensure_ascii=False, indent=2)
+
+    failed = [row for row in rows if not row["ok"]]
+    if failed:
+        print(f"\n{len(failed)} thao tác vượt ngân sách hoặc lỗi.")
+        sys.exit(1)
+    print("\nMọi thao tác nằm trong ngân sách.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""Đo hiệu năng các hàm xử lý dữ liệu trên sheet giả lập 1k, 10k, 100k, 500k hàng (chữ tiếng Việt,
+thời gian dd/mm/YYYY HH:MM:SS). Kết quả ghi ra JSON để so sánh giữa các lần chạy, ví dụ:
+
+    python benchmarks.py --json truoc.json
+    python benchmarks.py --json sau.json --compare truoc.json
+"""
+import argparse
+import gc
+import json
+import platform
+import random
+import statistics
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pyarrow as pa
+
+from sheet_index import SheetDataset, TIMESTAMP_FORMAT
+from streamlit_app import build_view_dataframe, changed_grid_rows, clean_dataframe, select_user_rows
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 500_000]
+HEADERS = ["Ho_ten*", "So_CMT*", "Dien_thoai", "Dia_chi", "Ghi_chu", "Nguoi_nhap", "Thoi_gian_nhap", "Ma_ban_ghi"]
+SHEET = "KH"
+USERS = [f"gdv{i:02d}" for i in range(20)]
+
+HO = ["Nguyễn", "Trần", "Lê", "Phạm", "Hoàng", "Huỳnh", "Phan", "Vũ", "Võ", "Đặng", "Bùi", "Đỗ", "Hồ", "Ngô", "Dương"]
+DEM = ["Văn", "Thị", "Hữu", "Đức", "Minh", "Ngọc", "Thanh", "Quốc", "Thu", "Xuân"]
+TEN = ["An", "Bình", "Cường", "Dũng", "Đạt", "Giang", "Hà", "Hải", "Hạnh", "Hùng", "Khánh", "Linh", "Long",
+       "Mai", "Nam", "Nga", "Phương", "Quân", "Sơn", "Thảo", "Trang", "Tuấn", "Uyên", "Việt", "Yến"]
+XA = ["Xã Tân Phú", "Phường Bến Nghé", "Xã Đông Hưng", "Thị trấn Chũ", "Phường Hòa Khánh", "Xã Ea Tu"]
+TINH = ["Hà Nội", "TP Hồ Chí Minh", "Đà Nẵng", "Bắc Giang", "Thái Bình", "Đắk Lắk", "Cần Thơ", "Nghệ An"]
+GHI_CHU = ["", "", "", "Khách hàng VIP", "Đã gọi điện xác nhận", "Chờ bổ sung giấy tờ", "Vay tiêu dùng", "Mở thẻ ghi nợ"]
+
+
+# --- Dữ liệu giả lập ---
+def synthetic_values(rows, seed=0):
+    """Kết quả get_all_values giả lập: ~1% thời gian sai định dạng, ~0,5% có ký tự điều khiển."""
+    rng = random.Random(seed)
+    now = datetime(2026, 1, 1)
+    values = [list(HEADERS)]
+    for i in range(rows):
+        entered = now - timedelta(seconds=rng.randrange(0, 2 * 365 * 86400))
+        timestamp = entered.strftime(TIMESTAMP_FORMAT) if rng.random() > 0.01 else entered.strftime("%d/%m/%Y")
+        note = rng.choice(GHI_CHU)
+        if rng.random() < 0.005:
+            note += "\x07"
+        values.append([
+            f"{rng.choice(HO)} {rng.choice(DEM)} {rng.choice(TEN)}",
+            f"{rng.randrange(10 ** 11, 10 ** 12):012d}",
+            f"09{rng.randrange(10 ** 8):08d}" if rng.random() > 0.2 else "",
+            f"{rng.randrange(1, 300)} {rng.choice(XA)}, {rng.choice(TINH)}",
+            note,
+            rng.choice(USERS),
+            timestamp,
+            f"{rng.getrandbits(64):016x}",
+        ])
+    return values
+
+
+def user_data_rows(dataset, positions):
+    """Như kết quả get_user_data cho một sheet."""
+    return [(SHEET, dataset, positions)] if positions else []
+
+
+def measure(fn, setup=None, repeat=3):
+    """Chạy fn(setup()) repeat lần, trả về (các thời gian, kết quả lần cuối); setup không tính giờ."""
+    times, result = [], None
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        gc.collect()
+        start = time.perf_counter()
+        result = fn(arg) if setup else fn()
+        times.append(time.perf_counter() - start)
+    return times, result
+
+
+def dataset_memory(rows):
+    """Số byte thực cấp phát cho dataset đã lập chỉ mục, sau khi bỏ dữ liệu đọc về: đối tượng Python
+    (tracemalloc) cộng bộ nhớ pyarrow (tracemalloc không thấy)."""
+    gc.collect()
+    arrow_before = pa.total_allocated_bytes()
+    tracemalloc.start()
+    try:
+        dataset = SheetDataset.from_values(synthetic_values(rows))
+        gc.collect()
+        return tracemalloc.get_traced_memory()[0] + pa.total_allocated_bytes() - arrow_before, dataset
+    finally:
+        tracemalloc.stop()
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+# --- Các phép đo cho một kích thước ---
+def run_size(rows, repeat, grid_max_rows):
+    results = []
+
+    def record(case, times, matched, note=None):
+        item = {
+            "case": case,
+            "rows": rows,
+            "matched": matched,
+            "runs": len(times),
+            "min_s": round(min(times), 6),
+            "median_s": round(statistics.median(times), 6),
+        }
+        if note:
+            item["note"] = note
+        results.append(item)
+        print(f"{case:<40} {rows:>8} {matched:>8} {item['min_s'] * 1000:>11.2f} {item['median_s'] * 1000:>11.2f}")
+
+    values = synthetic_values(rows)
+    times, dataset = measure(lambda: SheetDataset.from_values(values), repeat=repeat)
+    record("dataset_build", times, len(dataset))
+
+    allocated, measured = dataset_memory(rows)
+    results.append({"case": "dataset_memory", "rows": rows, "bytes": allocated, "approx_nbytes": measured.approx_nbytes()})
+    print(f"{'dataset_memory':<40} {rows:>8} {allocated / 2 ** 20:>17.1f} MB (ước lượng {measured.approx_nbytes() / 2 ** 20:.1f} MB)")
+    del measured
+
+    end_date = datetime(2026, 1, 1).date()
+    start_date = end_date - timedelta(days=90)
+    filters = [
+        ("user_data_filter[user,90d]", "gdv07", start_date, end_date, ""),
+        ("user_data_filter[admin,90d,keyword]", None, start_date, end_date, "nguyễn"),
+        ("user_data_filter[admin,all]", None, None, None, ""),
+    ]
+    for case, owner, start, end, keyword in filters:
+        times, user_data = measure(
+            lambda: user_data_rows(dataset, select_user_rows(dataset, owner, start, end, keyword)), repeat=repeat
+        )
+        record(case, times, sum(len(positions) for _, _, positions in user_data))
+
+    def reset_search_index():
+        dataset.search_rows = None
+        return dataset
+
+    times, _ = measure(lambda ds: ds.ensure_search_index(), setup=reset_search_index, repeat=repeat)
+    record("search_index_build", times, len(dataset.search_rows))
+
+    searches = [
+        ("search_filter[all_columns]", "hà nội", None),
+        ("search_filter[all_columns,no_diacritics]", "ha noi", None),
+        ("search_filter[Ho_ten]", "trần", "Ho_ten"),
+    ]
+    for case, keyword, column in searches:
+        times, found = measure(
+            lambda: dataset.frame(dataset.filter_keyword(range(len(dataset)), keyword, column)),
+            repeat=repeat
+        )
+        record(case, times, len(found))
+
+    # Màn hình xem của admin không lọc: trường hợp nặng nhất cho DataFrame và lưới
+    user_data = user_data_rows(dataset, select_user_rows(dataset, None))
+    times, df = measure(lambda: build_view_dataframe(user_data), repeat=repeat)
+    record("dataframe_build", times, len(df))
+
+    times, df = measure(clean_dataframe, setup=lambda: build_view_dataframe(user_data), repeat=repeat)
+    record("clean_dataframe", times, len(df))
+
+    if rows > grid_max_rows:
+        results.append({"case": "grid_diff[one_edit]", "rows": rows, "skipped": f"rows > --grid-max-rows ({grid_max_rows})"})
+        print(f"{'grid_diff[one_edit]':<40} {rows:>8}  bỏ qua (> --grid-max-rows)")
+    else:
+        edited = df.copy()
+        edited.iloc[len(edited) // 2, edited.columns.get_loc("Ghi_chu")] = "Đã sửa trên lưới"
+        times, changed = measure(lambda: changed_grid_rows(df, edited), repeat=repeat)
+        record("grid_diff[one_edit]", times, len(changed))
+    return results
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(item["case"], item["rows"]): item for item in json.load(f)["results"] if "min_s" in item or "bytes" in item}
+    print(f"\nSo với {baseline_path} (min, tỉ lệ < 1 là nhanh hơn):")
+    for item in results:
+        before = baseline.get((item["case"], item["rows"]))
+        if before is not None and "bytes" in item and "bytes" in before:
+            print(f"{item['case']:<40} {item['rows']:>8} {before['bytes'] / 2 ** 20:>11.1f} -> {item['bytes'] / 2 ** 20:>11.1f} MB  "
+                  f"x{item['bytes'] / before['bytes']:.2f}")
+            continue
+        if before is None or "min_s" not in item or not before["min_s"]:
+            continue
+        ratio = item["min_s"] / before["min_s"]
+        print(f"{item['case']:<40} {item['rows']:>8} {before['min_s'] * 1000:>11.2f} -> {item['min_s'] * 1000:>11.2f} ms  x{ratio:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Đo hiệu năng các hàm xử lý dữ liệu với sheet giả lập.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Số hàng của các sheet giả lập")
+    parser.add_argument("--repeat", type=int, default=3, help="Số lần chạy mỗi phép đo (báo cáo min và trung vị)")
+    parser.add_argument("--grid-max-rows", type=int, default=10_000,
+                        help="Bỏ qua đo so sánh lưới trên sheet lớn hơn (vòng so sánh hiện tại là O(n²))")
+    parser.add_argument("--json", dest="json_path", default=None, help="Ghi kết quả ra file JSON")
+    parser.add_argument("--compare", default=None, help="File JSON của lần chạy trước để so sánh")
+    args = parser.parse_args()
+
+    print(f"{'phép đo':<40} {'hàng':>8} {'khớp':>8} {'min ms':>11} {'trung vị ms':>11}")
+    results = []
+    for rows in args.sizes:
+        results.extend(run_size(rows, args.repeat, args.grid_max_rows))
+    report = {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "machine": platform.machine(),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+# --- Ước lượng dung lượng bộ nhớ của một giá trị ---
+def approx_size(obj, _seen=None):
+    """Ước lượng số byte của obj (đệ quy qua list/tuple/dict/set); đối tượng có approx_nbytes() tự báo."""
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+    nbytes = getattr(obj, "approx_nbytes", None)
+    if callable(nbytes):
+        return nbytes()
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(approx_size(k, _seen) + approx_size(v, _seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(approx_size(item, _seen) for item in obj)
+    return size
+
+
+# --- Bộ nhớ đệm LRU giới hạn theo dung lượng ---
+class LRUCache:
+    """Bộ nhớ đệm LRU giới hạn theo tổng số byte ước lượng, an toàn khi dùng từ nhiều luồng."""
+
+    def __init__(self, max_bytes, name="cache"):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejected = 0
+        self._entries = OrderedDict()  # key -> (value, size, stored_at)
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None, max_age=None):
+        """Lấy giá trị và đánh dấu vừa dùng; quá max_age giây thì coi như không có."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (max_age is not None and entry[2] < time.time() - max_age):
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def peek(self, key, default=None):
+        """Lấy giá trị mà không tính vào hits/misses và không đánh dấu vừa dùng (dùng cho việc nội bộ như làm mới nền)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return default if entry is None else entry[0]
+
+    def set(self, key, value, size=None):
+        """Lưu giá trị rồi loại các mục ít dùng nhất cho đến khi nằm trong giới hạn byte."""
+        size = approx_size(value) if size is None else size
+        with self._lock:
+            self._discard(key)
+            if size > self.max_bytes:
+                # Một mục lớn hơn cả ngân sách thì không lưu, tránh đẩy hết các mục khác ra ngoài
+                self.rejected += 1
+                return value
+            self._entries[key] = (value, size, time.time())
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes and self._entries:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+            return value
+
+    def resize(self, key):
+        """Đo lại dung lượng của một mục đã thay đổi tại chỗ (ví dụ dataset vừa thêm hàng)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            value, _, stored_at = entry
+            self.set(key, value)
+            if key in self._entries:
+                self._entries[key] = (value, self._entries[key][1], stored_at)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            self._discard(key)
+            return default if entry is None else entry[0]
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "rejected": self.rejected,
+            }
+
+
+# --- Làm mới nền: trả ngay giá trị cũ trong giới hạn, tải lại các mục hay dùng ở luồng nền ---
+class BackgroundRefresher:
+    """Stale-while-revalidate trên một LRUCache: giá trị cũ được dùng tiếp tối đa max_staleness giây
+    trong khi luồng nền tải lại, nên người dùng không phải chờ tải (kể cả chờ thử lại khi gặp 429).
+
+    Mỗi mục đăng ký kèm loader(giá trị cũ) -> giá trị mới và revision_fn() -> phiên bản hiện tại của nguồn.
+    Chỉ các mục được dùng trong hot_window giây gần nhất mới được làm mới nền."""
+
+    def __init__(self, cache, interval=5, max_staleness=30, hot_window=600, max_age=None, logger=None):
+        self.cache = cache
+        self.interval = interval
+        self.max_staleness = max_staleness
+        self.hot_window = hot_window
+        self.max_age = max_age
+        self.logger = logger
+        self.refreshes = 0
+        self.errors = 0
+        self.stale_served = 0
+        self.fallbacks_served = 0
+        self.dropped = 0
+        self._entries = {}  # key -> dict(revision, loaded_at, verified_at, stale_since, loader, revision_fn, group, ...)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="cache-refresher", daemon=True)
+        self._thread.start()
+
+    def _is_stale(self, entry, revision, now):
+        return entry["revision"] != revision or (self.max_age is not None and entry["loaded_at"] < now - self.max_age)
+
+    def lookup(self, key, revision):
+        """Giá trị còn dùng được (đúng phiên bản, hoặc cũ chưa quá max_staleness giây), ngược lại None."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            value = self.cache.get(key) if entry is not None else None
+            if value is None:
+                return None
+            entry["last_access"] = now
+            if not self._is_stale(entry, revision, now):
+                entry["verified_at"] = now
+                entry["stale_since"] = None
+                return value
+            if entry["stale_since"] is None:
+                entry["stale_since"] = now
+            if now - entry["stale_since"] > self.max_staleness:
+                return None
+            self.stale_served += 1
+        self._wake.set()
+        return value
+
+    def fallback(self, key):
+        """Giá trị đang có bất kể đã cũ bao lâu, dùng khi không tải được bản mới (Google quá tải); None nếu chưa có."""
+        with self._lock:
+            entry = self._entries.get(key)
+            # lookup() vừa tính một lần trượt cho lần đọc này, không tính thêm
+            value = self.cache.peek(key) if entry is not None else None
+            if value is None:
+                return None
+            if entry["stale_since"] is None:
+                entry["stale_since"] = time.time()
+            entry["last_access"] = time.time()
+            self.fallbacks_served += 1
+        self._wake.set()
+        return value
+
+    def store(self, key, value, revision, loader, revision_fn, group=None):
+        """Lưu giá trị vừa tải (revision lấy trước khi tải) và đăng ký để làm mới nền."""
+        now = time.time()
+        self.cache.set(key, value)
+        with self._lock:
+            self._entries[key] = {
+                "revision": revision, "loaded_at": now, "verified_at": now, "stale_since": None,
+                "last_access": now, "loader": loader, "revision_fn": revision_fn, "group": group,
+                "failures": 0, "retry_at": 0.0, "last_error": None,
+            }
+        return value
+
+    def as_of(self, key):
+        """Thời điểm gần nhất giá trị được xác nhận còn đúng với nguồn, None nếu chưa có."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry["verified_at"] if entry is not None else None
+
+    def is_stale(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry["stale_since"] is not None
+
+    def expire(self, key):
+        """Bỏ giá trị đang có: lần đọc sau phải tải lại ngay (dùng khi chính ứng dụng đổi cấu trúc dữ liệu)."""
+        with self._lock:
+            self._entries.pop(key, None)
+        self.cache.pop(key)
+
+    def expire_group(self, group):
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if entry["group"] == group]
+        for key in keys:
+            self.expire(key)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.refresh_due()
+            except Exception as e:
+                if self.logger:
+                    self.logger.warning(f"Lỗi luồng làm mới nền: {e}")
+
+    def refresh_due(self):
+        """Tải lại các mục hay dùng có phiên bản đã đổi; lỗi chỉ được ghi log và thử lại sau (lùi dần)."""
+        now = time.time()
+        with self._lock:
+            # Giá trị đã bị LRUCache loại ra thì bỏ luôn mục đăng ký: không tải lại dữ liệu không còn ai giữ
+            for key in [key for key in self._entries if key not in self.cache]:
+                del self._entries[key]
+                self.dropped += 1
+            hot = [(key, entry) for key, entry in self._entries.items()
+                   if entry["last_access"] >= now - self.hot_window and entry["retry_at"] <= now]
+        for key, entry in hot:
+            try:
+                revision = entry["revision_fn"]()
+                if not self._is_stale(entry, revision, time.time()):
+                    with self._lock:
+                        entry["verified_at"] = time.time()
+                    continue
+                with self._lock:
+                    if entry["stale_since"] is None:
+                        entry["stale_since"] = time.time()
+                previous = self.cache.peek(key)
+                if previous is None:
+                    with self._lock:
+                        if self._entries.get(key) is entry:
+                            del self._entries[key]
+                            self.dropped += 1
+                    continue
+                value = entry["loader"](previous)
+                with self._lock:
+                    if self._entries.get(key) is not entry:
+                        continue  # Đã bị expire trong lúc tải
+                    self.cache.set(key, value)
+                    entry.update(revision=revision, loaded_at=time.time(), verified_at=time.time(),
+                                 stale_since=None, failures=0, retry_at=0.0, last_error=None)
+                    self.refreshes += 1
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                    entry["failures"] += 1
+                    entry["last_error"] = str(e)
+                    entry["retry_at"] = time.time() + min(300, self.interval * 2 ** entry["failures"])
+                if self.logger:
+                    self.logger.warning(f"Không làm mới được {key}: {e}")
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hot": sum(1 for entry in self._entries.values() if entry["last_access"] >= now - self.hot_window),
+                "stale": sum(1 for entry in self._entries.values() if entry["stale_since"] is not None),
+                "refreshes": self.refreshes,
+                "errors": self.errors,
+                "stale_served": self.stale_served,
+                "fallbacks_served": self.fallbacks_served,
+                "dropped": self.dropped,
+                "max_staleness_s": self.max_staleness,
+                "failing": {str(key): entry["last_error"] for key, entry in self._entries.items() if entry["last_error"]},
+            }
@@ -0,0 +1,372 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timedelta, timezone
+
+import gspread
+import requests
+from gspread.utils import a1_range_to_grid_range, numericise_all, rowcol_to_a1, to_records
+
+from resilience import DRIVE_ENDPOINT, READ_ENDPOINT, WRITE_ENDPOINT
+
+# --- Backend Google Sheets giả lập trong bộ nhớ (bật bằng SHEETS_BACKEND=fake) ---
+# Dùng để chạy thử ứng dụng và kiểm thử tải mà không cần tài khoản Google. Hỗ trợ đúng các hàm gspread
+# mà ứng dụng gọi, có độ trễ và hạn mức (lỗi 429) cấu hình được, và mô phỏng modifiedTime của Drive
+# để cơ chế làm mất hiệu lực bộ nhớ đệm theo phiên bản hoạt động như với Google thật.
+
+
+def _api_error(status, message):
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps({"error": {"code": status, "message": message, "status": "FAKE"}}).encode()
+    return gspread.exceptions.APIError(response)
+
+
+# Các lệnh gọi tính vào hạn mức ghi của Google (dùng cả trong api_budget.py)
+WRITE_CALLS = {"values.append", "values.update", "spreadsheets.batchUpdate"}
+
+
+class FakeBackend:
+    """Trạng thái dùng chung của mọi spreadsheet giả lập: độ trễ, hạn mức mỗi phút và số liệu gọi API.
+
+    breakers (resilience.BreakerRegistry, gán sau khi tạo) ghi nhận kết quả từng lần gọi như phiên HTTP thật."""
+
+    def __init__(self, latency=0.0, quota_per_minute=None):
+        self.latency = latency
+        self.quota_per_minute = quota_per_minute
+        self.breakers = None
+        self.spreadsheets = {}
+        self.lock = threading.RLock()
+        self.calls = Counter()
+        self.throttled = 0
+        self._recent = deque()
+
+    def call(self, name):
+        """Ghi nhận một lần gọi API; trả lỗi 429 khi vượt hạn mức trong 60 giây gần nhất."""
+        breaker = None
+        if self.breakers is not None:
+            endpoint = DRIVE_ENDPOINT if name.startswith("drive.") else WRITE_ENDPOINT if name in WRITE_CALLS else READ_ENDPOINT
+            breaker = self.breakers.get(endpoint)
+        probe = breaker.before_call() if breaker is not None else False
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            now = time.time()
+            while self._recent and self._recent[0] < now - 60:
+                self._recent.popleft()
+            throttled = self.quota_per_minute is not None and len(self._recent) >= self.quota_per_minute
+            if throttled:
+                self.throttled += 1
+            else:
+                self._recent.append(now)
+                self.calls[name] += 1
+        if breaker is not None:
+            breaker.record(429 if throttled else 200, probe)
+        if throttled:
+            raise _api_error(429, "Quota exceeded for quota metric 'Read requests' (fake backend)")
+
+    def add_spreadsheet(self, spreadsheet_id, sheets):
+        with self.lock:
+            book = FakeSpreadsheet(self, spreadsheet_id, sheets)
+            self.spreadsheets[spreadsheet_id] = book
+            return book
+
+    def reset_stats(self):
+        with self.lock:
+            self.calls.clear()
+            self.throttled = 0
+
+    def stats(self):
+        """Số liệu tương tự PooledAuthorizedSession.stats() để hiển thị trong sidebar admin."""
+        with self.lock:
+            return {
+                "backend": "fake",
+                "requests": sum(self.calls.values()),
+                "throttled_429": self.throttled,
+                "latency_s": self.latency,
+                "quota_per_minute": self.quota_per_minute,
+                "calls": dict(self.calls),
+            }
+
+
+class FakeSpreadsheet:
+    def __init__(self, backend, spreadsheet_id, sheets):
+        self.backend = backend
+        self.id = spreadsheet_id
+        self.title = spreadsheet_id
+        self._sheets = {}
+        self._next_sheet_id = 1
+        self._modified = datetime.now(timezone.utc)
+        for title, values in sheets.items():
+            self._add(title, values)
+
+    def _add(self, title, values):
+        worksheet = FakeWorksheet(self, title, self._next_sheet_id, values)
+        self._next_sheet_id += 1
+        self._sheets[title] = worksheet
+        return worksheet
+
+    def touch(self):
+        """Mỗi lần ghi đổi modifiedTime như Drive (tăng dần, độ phân giải mili giây)."""
+        with self.backend.lock:
+            self._modified = max(datetime.now(timezone.utc), self._modified + timedelta(milliseconds=1))
+
+    def get_lastUpdateTime(self):
+        self.backend.call("drive.files.get")
+        with self.backend.lock:
+            return self._modified.strftime("%Y-%m-%dT%H:%M:%S.") + f"{self._modified.microsecond // 1000:03d}Z"
+
+    def worksheet(self, title):
+        with self.backend.lock:
+            if title not in self._sheets:
+                raise gspread.exceptions.WorksheetNotFound(title)
+            return self._sheets[title]
+
+    def worksheets(self, exclude_hidden=False):
+        self.backend.call("spreadsheets.get")
+        with self.backend.lock:
+            return list(self._sheets.values())
+
+    def fetch_sheet_metadata(self, params=None):
+        """Thuộc tính các worksheet; với includeGridData trả các ô trong ranges (giả lập không lưu định dạng ô)."""
+        self.backend.call("spreadsheets.get")
+        params = params or {}
+        with self.backend.lock:
+            if str(params.get("includeGridData", "false")).lower() != "true":
+                return {"spreadsheetId": self.id, "sheets": [
+                    {"properties": {"sheetId": ws.id, "title": ws.title, "index": i}} for i, ws in enumerate(self._sheets.values())
+                ]}
+            ranges = params.get("ranges") or []
+            sheets = []
+            for range_name in [ranges] if isinstance(ranges, str) else ranges:
+                title, _, cells = range_name.partition("!")
+                title = title.strip("'").replace("''", "'")
+                if title not in self._sheets:
+                    raise _api_error(400, f"Unable to parse range: {range_name}")
+                values = self._sheets[title].read(cells or None)
+                sheets.append({"data": [{"rowData": [{"values": [{} for _ in row]} for row in values]}]})
+        return {"spreadsheetId": self.id, "sheets": sheets}
+
+    def add_worksheet(self, title, rows=100, cols=26, index=None):
+        self.backend.call("spreadsheets.batchUpdate")
+        with self.backend.lock:
+            if title in self._sheets:
+                raise _api_error(400, f'A sheet with the name "{title}" already exists.')
+            worksheet = self._add(title, [])
+            self.touch()
+            return worksheet
+
+    def values_batch_get(self, ranges, params=None):
+        self.backend.call("values.batchGet")
+        params = params or {}
+        by_column = params.get("majorDimension") == "COLUMNS"
+        value_ranges = []
+        with self.backend.lock:
+            for range_name in ranges:
+                title, _, cells = range_name.partition("!")
+                title = title.strip("'").replace("''", "'")
+                if title not in self._sheets:
+                    raise _api_error(400, f"Unable to parse range: {range_name}")
+                values = self._sheets[title].read(cells or None, by_column)
+                value_ranges.append({"range": range_name, **({"values": values} if values else {})})
+        return {"spreadsheetId": self.id, "valueRanges": value_ranges}
+
+    def batch_update(self, body):
+        self.backend.call("spreadsheets.batchUpdate")
+        with self.backend.lock:
+            by_id = {worksheet.id: worksheet for worksheet in self._sheets.values()}
+            for request in body.get("requests", []):
+                grid = request["deleteDimension"]["range"]
+                if grid.get("dimension") != "ROWS":
+                    raise _api_error(400, "Fake backend only supports deleting rows")
+                del by_id[grid["sheetId"]].values[grid["startIndex"]:grid["endIndex"]]
+            self.touch()
+        return {"spreadsheetId": self.id, "replies": [{} for _ in body.get("requests", [])]}
+
+
+class FakeWorksheet:
+    def __init__(self, book, title, sheet_id, values):
+        self.book = book
+        self.title = title
+        self.id = sheet_id
+        self.values = [[str(value) for value in row] for row in values]
+
+    @property
+    def _call(self):
+        return self.book.backend.call
+
+    def read(self, cells=None, by_column=False):
+        """Đọc một vùng A1 (None là cả sheet), cắt ô trống ở cuối như Google."""
+        grid = a1_range_to_grid_range(cells) if cells else {}
+        width = max((len(row) for row in self.values), default=0)
+        rows = self.values[grid.get("startRowIndex", 0):grid.get("endRowIndex", len(self.values))]
+        start_col, end_col = grid.get("startColumnIndex", 0), grid.get("endColumnIndex", width)
+        values = [[row[c] if c < len(row) else "" for c in range(start_col, end_col)] for row in rows]
+        if by_column:
+            values = [list(column) for column in zip(*values)] if values else []
+        values = [self._trim(line) for line in values]
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    @staticmethod
+    def _trim(line):
+        line = list(line)
+        while line and line[-1] == "":
+            line.pop()
+        return line
+
+    def row_values(self, row, **kwargs):
+        self._call("values.get")
+        with self.book.backend.lock:
+            return self._trim(self.values[row - 1]) if row <= len(self.values) else []
+
+    def col_values(self, col, **kwargs):
+        self._call("values.get")
+        with self.book.backend.lock:
+            return self._trim(row[col - 1] if col <= len(row) else "" for row in self.values)
+
+    def get_all_values(self, **kwargs):
+        self._call("values.get")
+        with self.book.backend.lock:
+            width = max((len(row) for row in self.values), default=0)
+            return [row + [""] * (width - len(row)) for row in self.values]
+
+    def get_all_records(self, **kwargs):
+        self._call("values.get")
+        with self.book.backend.lock:
+            if not self.values:
+                return []
+            headers = self.values[0]
+            rows = [row + [""] * (len(headers) - len(row)) for row in self.values[1:]]
+            return to_records(headers, [numericise_all(row) for row in rows])
+
+    def get(self, range_name=None, major_dimension=None, value_render_option=None, date_time_render_option=None,
+            combine_merged_cells=False, maintain_size=False, pad_values=False, return_type=None):
+        self._call("values.get")
+        with self.book.backend.lock:
+            return self.read(range_name, major_dimension == "COLUMNS")
+
+    def _write(self, row, col, values):
+        while len(self.values) < row - 1 + len(values):
+            self.values.append([])
+        for r, line in enumerate(values):
+            target = self.values[row - 1 + r]
+            target.extend([""] * (col - 1 + len(line) - len(target)))
+            for c, value in enumerate(line):
+                target[col - 1 + c] = "" if value is None else str(value)
+        self.book.touch()
+
+    def update(self, values=None, range_name=None, **kwargs):
+        self._call("values.update")
+        # Hỗ trợ cả thứ tự tham số cũ update(range_name, values)
+        if isinstance(values, str):
+            values, range_name = range_name, values
+        grid = a1_range_to_grid_range(range_name or "A1")
+        with self.book.backend.lock:
+            self._write(grid.get("startRowIndex", 0) + 1, grid.get("startColumnIndex", 0) + 1, values)
+        return {"updatedRange": f"'{self.title}'!{range_name}"}
+
+    def update_cell(self, row, col, value):
+        return self.update([[value]], rowcol_to_a1(row, col))
+
+    def append_rows(self, values, value_input_option=None, **kwargs):
+        self._call("values.append")
+        with self.book.backend.lock:
+            # Google thêm sau hàng cuối cùng có dữ liệu
+            while self.values and not any(self.values[-1]):
+                self.values.pop()
+            start = len(self.values) + 1
+            self._write(start, 1, values)
+            end = start + len(values) - 1
+            width = max((len(row) for row in values), default=1)
+            return {"updates": {"updatedRange": f"'{self.title}'!A{start}:{rowcol_to_a1(end, width)}",
+                                "updatedRows": len(values)}}
+
+    def append_row(self, values, value_input_option=None, **kwargs):
+        return self.append_rows([values], value_input_option=value_input_option)
+
+
+class FakeHTTPClient:
+    def __init__(self, backend):
+        self.session = backend
+
+
+class FakeClient:
+    """Thay cho gspread.Client: open_by_key trả về spreadsheet giả lập."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.http_client = FakeHTTPClient(backend)
+
+    def set_timeout(self, timeout=None):
+        pass
+
+    def open_by_key(self, key):
+        self.backend.call("spreadsheets.get")
+        with self.backend.lock:
+            if key not in self.backend.spreadsheets:
+                raise gspread.exceptions.SpreadsheetNotFound(key)
+            return self.backend.spreadsheets[key]
+
+
+# --- Dữ liệu mẫu ---
+DEMO_SPREADSHEET_ID = "fake"
+
+
+def demo_sheets(rows=200):
+    """Config, User (admin và user1, mật khẩu Matkhau@123) và một sheet nhập liệu KH có sẵn dữ liệu."""
+    password = hashlib.sha256("Matkhau@123".encode()).hexdigest()
+    now = datetime.now()
+    notes = ["", "Khách hàng VIP", "Đã gọi điện xác nhận", "", "Chờ bổ sung giấy tờ"]
+    data = [["Ho_ten*", "So_CMT*", "Dien_thoai", "Ghi_chu", "Nguoi_nhap", "Thoi_gian_nhap", "Ma_ban_ghi"]]
+    for i in range(rows):
+        data.append([
+            f"Khách hàng {i}", f"{i:012d}", f"09{i:08d}", notes[i % len(notes)],
+            "user1" if i % 2 else "admin",
+            (now - timedelta(hours=7 * i)).strftime("%d/%m/%Y %H:%M:%S"),
+            f"{i:016x}",
+        ])
+    return {
+        "Config": [["Sheetname", "Tìm kiếm", "Nhập", "Xem đã nhập", "Cot_kiem_trung", "Goi_y"],
+                   ["KH", "1", "1", "1", "So_CMT", "Ghi_chu"]],
+        "User": [["Username", "Password", "Role"], ["admin", password, "Admin"], ["user1", password, "User"]],
+        "KH": data,
+    }
+
+
+def create_client(data_path=None, latency=0.0, quota_per_minute=None):
+    """Tạo FakeClient; data_path là file JSON {spreadsheet_id: {tên sheet: [[ô, ...], ...]}}, mặc định dùng dữ liệu mẫu."""
+    backend = FakeBackend(latency=latency, quota_per_minute=quota_per_minute)
+    if data_path:
+        with open(data_path, encoding="utf-8") as f:
+            for spreadsheet_id, sheets in json.load(f).items():
+                backend.add_spreadsheet(spreadsheet_id, sheets)
+    else:
+        backend.add_spreadsheet(DEMO_SPREADSHEET_ID, demo_sheets())
+    return FakeClient(backend)
+
+
+_installed_client = None
+
+
+def install(client):
+    """Cho ứng dụng dùng client đã tạo sẵn (ví dụ để công cụ kiểm thử tải đọc số liệu của backend)."""
+    global _installed_client
+    _installed_client = client
+    return client
+
+
+def client_from_env():
+    """Client đã install(), nếu không thì tạo từ SHEETS_FAKE_DATA, SHEETS_FAKE_LATENCY_MS, SHEETS_FAKE_QUOTA_PER_MINUTE."""
+    if _installed_client is not None:
+        return _installed_client
+    quota = os.getenv("SHEETS_FAKE_QUOTA_PER_MINUTE")
+    return create_client(
+        data_path=os.getenv("SHEETS_FAKE_DATA") or None,
+        latency=float(os.getenv("SHEETS_FAKE_LATENCY_MS", "0")) / 1000,
+        quota_per_minute=int(quota) if quota else None,
+    )
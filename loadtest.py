@@ -0,0 +1,309 @@
+"""Kiểm thử tải: chạy N phiên Streamlit giả lập (streamlit.testing AppTest) song song với backend Sheets giả lập.
+
+Mỗi phiên đăng nhập rồi lặp lại các thao tác thường ngày: nhập form, xem/lọc, sửa trên lưới, tìm kiếm.
+Kết quả: độ trễ mỗi lượt chạy lại (p50/p95/p99) theo thao tác, số lần gọi API mỗi thao tác, số lỗi 429
+và bộ nhớ mỗi phiên. Ví dụ:
+
+    python loadtest.py --sessions 20 --iterations 3 --latency-ms 150 --quota-per-minute 300 --json ketqua.json
+"""
+import argparse
+import json
+import os
+import resource
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ["SHEETS_BACKEND"] = "fake"
+
+import streamlit as st
+import st_aggrid
+from streamlit import config
+from streamlit.runtime.runtime import Runtime
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.testing.v1 import AppTest
+
+import fake_sheets
+from cache_store import LRUCache, approx_size
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "streamlit_app.py")
+PASSWORD = "Matkhau@123"
+ACTIONS = ["open", "login", "navigate", "submit_form", "view_filter", "grid_edit", "search"]
+EDIT_FLAG = "loadtest_edit"
+
+
+# --- Lưới AgGrid giả lập: AppTest không chạy được component, nên trả dữ liệu như người dùng vừa sửa một ô ---
+def simulated_aggrid(data, *args, **kwargs):
+    df = data.copy()
+    edit = st.session_state.get(EDIT_FLAG)
+    if edit and not df.empty and edit["column"] in df.columns:
+        df.iloc[0, df.columns.get_loc(edit["column"])] = edit["value"]
+    return {"data": df}
+
+
+st_aggrid.AgGrid = simulated_aggrid
+
+
+# --- Cho nhiều AppTest chạy song song trong một tiến trình ---
+# Mỗi AppTest.run() tạo Runtime giả rồi đặt lại Runtime._instance = None khi xong, làm hỏng các lượt chạy
+# của phiên khác đang dở. Giữ lại Runtime giả gần nhất để các lượt đó vẫn dùng được; bộ nhớ đệm
+# st.cache_resource vẫn dùng chung giữa các phiên như trên máy chủ thật.
+_last_runtime = [None]
+
+
+def _runtime_instance(cls):
+    if cls._instance is not None:
+        _last_runtime[0] = cls._instance
+    if _last_runtime[0] is None:
+        raise RuntimeError("Runtime hasn't been created!")
+    return _last_runtime[0]
+
+
+def _runtime_exists(cls):
+    return cls._instance is not None or _last_runtime[0] is not None
+
+
+Runtime.instance = classmethod(_runtime_instance)
+Runtime.exists = classmethod(_runtime_exists)
+
+# Mỗi AppTest có ScriptCache riêng nên biên dịch lại script ở lượt đầu; ast.parse song song trên
+# Python 3.11 có thể lỗi "AST constructor recursion depth mismatch", nên biên dịch tuần tự và dùng chung
+_compile_lock = threading.Lock()
+_bytecode = {}
+_get_bytecode = ScriptCache.get_bytecode
+
+
+def _shared_bytecode(self, script_path):
+    with _compile_lock:
+        if script_path not in _bytecode:
+            _bytecode[script_path] = _get_bytecode(self, script_path)
+        return _bytecode[script_path]
+
+
+ScriptCache.get_bytecode = _shared_bytecode
+
+
+def pin_app_test_config():
+    """AppTest bật tạm global.appTest trong mỗi lượt chạy; bật cố định để các lượt song song không tắt lẫn nhau."""
+    config.get_config_options()
+    config._set_option("global.appTest", True, "loadtest")
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[idx]
+
+
+def session_state_bytes(at):
+    """Dung lượng ước lượng của session_state một phiên (bộ nhớ đệm phiên tính theo số byte nó tự đếm)."""
+    total = 0
+    for key, value in at.session_state.filtered_state.items():
+        total += value.current_bytes if isinstance(value, LRUCache) else approx_size(value)
+    return total
+
+
+# --- Ghi nhận kết quả từ nhiều luồng ---
+class Recorder:
+    def __init__(self, backend):
+        self.backend = backend
+        self.latencies = defaultdict(list)
+        self.calls = defaultdict(Counter)  # chỉ ghi khi chạy tuần tự (hiệu chuẩn), vì chạy song song không tách được
+        self.errors = Counter()
+        self.error_samples = {}
+        self.session_bytes = []
+        self._lock = threading.Lock()
+
+    def step(self, at, action, count_calls=False):
+        before = dict(self.backend.calls) if count_calls else None
+        start = time.perf_counter()
+        at.run()
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.latencies[action].append(elapsed)
+            if count_calls:
+                diff = Counter({name: n - before.get(name, 0) for name, n in self.backend.calls.items()})
+                self.calls[action].update(+diff)
+                self.calls[action]["_runs"] += 1
+            messages = [e.value for e in at.exception] + [e.value for e in at.error]
+            if messages:
+                self.errors[action] += 1
+                self.error_samples.setdefault(action, str(messages[0])[:200])
+        return at
+
+
+def click(at, label=None, key=None):
+    for button in at.button:
+        if (key is not None and button.key == key) or (label is not None and button.label == label):
+            button.click()
+            return True
+    return False
+
+
+def fill(at, key, value):
+    """Nhập giá trị vào text_input theo key; False nếu ô không có trên trang (lượt trước bị lỗi)."""
+    for widget in at.text_input:
+        if widget.key == key:
+            widget.input(value)
+            return True
+    return False
+
+
+def navigate(at, recorder, function, count_calls):
+    if click(at, key=f"nav_{function}"):
+        recorder.step(at, "navigate", count_calls)
+
+
+# --- Kịch bản một phiên ---
+def run_session(index, args, recorder, count_calls=False):
+    username = args.users[index % len(args.users)]
+    at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+    recorder.step(at, "open", count_calls)
+    fill(at, "login_username", username)
+    fill(at, "login_password", PASSWORD)
+    if not click(at, label="Đăng nhập"):
+        return
+    recorder.step(at, "login", count_calls)
+
+    for iteration in range(args.iterations):
+        tag = f"{index}-{iteration}"
+
+        navigate(at, recorder, "Nhập liệu", count_calls)
+        for widget in at.text_input:
+            if not str(widget.key).endswith("_input"):
+                continue
+            if widget.key.endswith("Ho_ten_input"):
+                widget.input(f"Khách tải {tag}")
+            elif widget.key.endswith("So_CMT_input"):
+                widget.input(f"{index:06d}{iteration:06d}")
+            else:
+                widget.input("")
+        if click(at, label="Gửi"):
+            recorder.step(at, "submit_form", count_calls)
+
+        navigate(at, recorder, "Xem và sửa dữ liệu", count_calls)
+        fill(at, "view_search_keyword", "")
+        if click(at, key="apply_filter"):
+            recorder.step(at, "view_filter", count_calls)
+            at.session_state[EDIT_FLAG] = {"column": args.edit_column, "value": f"sửa bởi phiên {tag}"}
+            recorder.step(at, "grid_edit", count_calls)
+            at.session_state[EDIT_FLAG] = None
+
+        navigate(at, recorder, "Tìm kiếm", count_calls)
+        if fill(at, "search_keyword", args.keyword) and click(at, key="search_button"):
+            recorder.step(at, "search", count_calls)
+
+    size = session_state_bytes(at)
+    with recorder._lock:
+        recorder.session_bytes.append(size)
+
+
+def rss_bytes():
+    # ru_maxrss tính theo KB trên Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def summarize(recorder, backend_stats, wall_seconds, sessions, rss_growth):
+    actions = {}
+    for action in ACTIONS:
+        latencies = recorder.latencies.get(action, [])
+        if not latencies:
+            continue
+        calls = recorder.calls.get(action)
+        runs = calls["_runs"] if calls else 0
+        actions[action] = {
+            "runs": len(latencies),
+            "p50_ms": round(1000 * percentile(latencies, 50), 1),
+            "p95_ms": round(1000 * percentile(latencies, 95), 1),
+            "p99_ms": round(1000 * percentile(latencies, 99), 1),
+            "errors": recorder.errors.get(action, 0),
+            "api_calls_per_run": round(sum(n for name, n in calls.items() if name != "_runs") / runs, 2) if runs else None,
+            "api_calls_detail": {name: round(n / runs, 2) for name, n in calls.items() if name != "_runs"} if runs else {},
+        }
+    total_runs = sum(item["runs"] for item in actions.values())
+    return {
+        "sessions": sessions,
+        "wall_seconds": round(wall_seconds, 2),
+        "reruns": total_runs,
+        "reruns_per_second": round(total_runs / wall_seconds, 2) if wall_seconds else 0.0,
+        "api_requests": backend_stats["requests"],
+        "api_requests_per_rerun": round(backend_stats["requests"] / total_runs, 2) if total_runs else 0.0,
+        "throttled_429": backend_stats["throttled_429"],
+        "session_state_bytes_avg": int(sum(recorder.session_bytes) / len(recorder.session_bytes)) if recorder.session_bytes else 0,
+        "rss_growth_per_session_bytes": int(rss_growth / sessions) if sessions else 0,
+        "actions": actions,
+        "error_samples": recorder.error_samples,
+    }
+
+
+def print_report(title, report):
+    print(f"\n== {title}: {report['sessions']} phiên, {report['reruns']} lượt chạy trong {report['wall_seconds']}s "
+          f"({report['reruns_per_second']} lượt/s) ==")
+    print(f"{'thao tác':<12} {'lượt':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'lỗi':>5} {'API/lượt':>9}")
+    for action, item in report["actions"].items():
+        calls = "-" if item["api_calls_per_run"] is None else item["api_calls_per_run"]
+        print(f"{action:<12} {item['runs']:>6} {item['p50_ms']:>9} {item['p95_ms']:>9} {item['p99_ms']:>9} "
+              f"{item['errors']:>5} {calls:>9}")
+    print(f"API: {report['api_requests']} request ({report['api_requests_per_rerun']}/lượt), 429: {report['throttled_429']}")
+    print(f"Bộ nhớ: session_state ~{report['session_state_bytes_avg'] / 1024:.1f} KB/phiên, "
+          f"RSS tăng ~{report['rss_growth_per_session_bytes'] / 1024:.1f} KB/phiên")
+    for action, message in report["error_samples"].items():
+        print(f"  lỗi {action}: {message}")
+
+
+def run_phase(args, client, sessions, concurrent):
+    backend = client.backend
+    backend.reset_stats()
+    recorder = Recorder(backend)
+    rss_before = rss_bytes()
+    start = time.perf_counter()
+    if concurrent:
+        with ThreadPoolExecutor(max_workers=sessions) as pool:
+            futures = [pool.submit(run_session, i, args, recorder) for i in range(sessions)]
+            for future in futures:
+                future.result()
+    else:
+        for i in range(sessions):
+            run_session(i, args, recorder, count_calls=True)
+    wall = time.perf_counter() - start
+    return summarize(recorder, backend.stats(), wall, sessions, rss_bytes() - rss_before)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Kiểm thử tải ứng dụng với backend Sheets giả lập.")
+    parser.add_argument("--sessions", type=int, default=10, help="Số phiên chạy đồng thời")
+    parser.add_argument("--iterations", type=int, default=2, help="Số vòng thao tác của mỗi phiên sau khi đăng nhập")
+    parser.add_argument("--latency-ms", type=float, default=100, help="Độ trễ mỗi lần gọi API giả lập")
+    parser.add_argument("--quota-per-minute", type=int, default=300, help="Hạn mức request mỗi phút (0 = không giới hạn)")
+    parser.add_argument("--data", default=None, help="File JSON dữ liệu giả lập (mặc định dùng dữ liệu mẫu)")
+    parser.add_argument("--users", nargs="+", default=["user1", "admin"], help="Tài khoản luân phiên cho các phiên")
+    parser.add_argument("--keyword", default="Khách hàng 1", help="Từ khóa cho thao tác tìm kiếm")
+    parser.add_argument("--edit-column", default="Ghi_chu", help="Cột được sửa trên lưới")
+    parser.add_argument("--timeout", type=float, default=120, help="Thời gian tối đa mỗi lượt chạy (giây)")
+    parser.add_argument("--skip-calibration", action="store_true", help="Bỏ lượt chạy tuần tự đo số API mỗi thao tác")
+    parser.add_argument("--json", dest="json_path", default=None, help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+    pin_app_test_config()
+
+    client = fake_sheets.install(fake_sheets.create_client(
+        data_path=args.data,
+        latency=args.latency_ms / 1000,
+        quota_per_minute=args.quota_per_minute or None,
+    ))
+    results = {"config": vars(args)}
+    if not args.skip_calibration:
+        # Một phiên chạy tuần tự (bộ nhớ đệm còn lạnh): số lần gọi API mỗi thao tác mới tách được theo thao tác
+        results["calibration"] = run_phase(args, client, 1, concurrent=False)
+        print_report("Hiệu chuẩn tuần tự", results["calibration"])
+    results["load"] = run_phase(args, client, args.sessions, concurrent=True)
+    print_report("Tải đồng thời", results["load"])
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
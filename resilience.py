@@ -0,0 +1,260 @@
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+import gspread
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+# --- Endpoint theo hạn mức của Google: đọc và ghi Sheets tính riêng, Drive (modifiedTime) riêng ---
+READ_ENDPOINT = "sheets.read"
+WRITE_ENDPOINT = "sheets.write"
+DRIVE_ENDPOINT = "drive"
+
+
+def endpoint_of(method, url):
+    if "/drive/" in url:
+        return DRIVE_ENDPOINT
+    return READ_ENDPOINT if method.upper() == "GET" else WRITE_ENDPOINT
+
+
+class CircuitOpenError(gspread.exceptions.APIError):
+    """Bộ ngắt của endpoint đang mở: không gửi request, báo lỗi ngay để dùng dữ liệu đệm hoặc xếp hàng ghi.
+
+    Là một APIError 429 dựng sẵn, nên mọi chỗ đang xử lý 429 của Google ("Hệ thống đang bận") dùng được nguyên."""
+
+    def __init__(self, endpoint, retry_after):
+        message = f"Google Sheets ({endpoint}) đang quá tải, tạm ngừng gửi yêu cầu trong {max(0, round(retry_after))} giây."
+        response = requests.Response()
+        response.status_code = 429
+        response._content = json.dumps({"error": {"code": 429, "message": message, "status": "CIRCUIT_OPEN"}}).encode()
+        super().__init__(response)
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+    def __reduce__(self):
+        return self.__class__, (self.endpoint, self.retry_after)
+
+
+def is_unavailable(error):
+    """Lỗi do phía Google tạm thời không phục vụ được (429, 5xx) hoặc do bộ ngắt đang mở."""
+    if isinstance(error, CircuitOpenError):
+        return True
+    if isinstance(error, gspread.exceptions.APIError):
+        status = getattr(error.response, "status_code", 0) or 0
+        return status == 429 or status >= 500
+    return False
+
+
+# --- Bộ ngắt mạch cho mỗi endpoint ---
+# closed:    gửi request bình thường, đếm số lỗi 429/5xx liên tiếp
+# open:      quá failure_threshold lỗi liên tiếp thì báo lỗi ngay, không gửi request (không ngủ trên luồng script)
+# half_open: hết thời gian mở (có jitter để các tiến trình không thử cùng lúc) thì cho đúng một request thăm dò;
+#            thành công thì đóng lại, thất bại thì mở tiếp với thời gian gấp đôi (tối đa max_reset_timeout)
+class CircuitBreaker:
+    def __init__(self, endpoint, failure_threshold=3, reset_timeout=30, max_reset_timeout=300, jitter=0.5):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.jitter = jitter
+        self.state = "closed"
+        self.failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self.probes = 0
+        self.last_error = None
+        self._timeout = reset_timeout
+        self._probe_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Gọi trước mỗi request; trả về True nếu request này là lần thăm dò, raise CircuitOpenError nếu đang mở."""
+        with self._lock:
+            if self.state == "closed":
+                return False
+            now = time.time()
+            if self.state == "open" and now >= self._probe_at:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                self.probes += 1
+                return True
+            self.rejected += 1
+            raise CircuitOpenError(self.endpoint, self._probe_at - now)
+
+    def on_success(self, probe=False):
+        with self._lock:
+            if probe or self.state == "closed":
+                self.state = "closed"
+                self.failures = 0
+                self._timeout = self.reset_timeout
+                self._probing = False
+
+    def on_failure(self, error, probe=False):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error)[:200]
+            if probe:
+                self._probing = False
+                self._timeout = min(self.max_reset_timeout, self._timeout * 2)
+                self._open()
+            elif self.state == "closed" and self.failures >= self.failure_threshold:
+                self._open()
+
+    def release(self, probe=False):
+        """Request đã qua before_call() nhưng không được gửi: nếu là lần thăm dò thì cho request sau thăm dò."""
+        if probe:
+            with self._lock:
+                self._probing = False
+
+    def record(self, status, probe=False):
+        """Ghi nhận mã HTTP của một request đã gửi: 429 và 5xx là lỗi quá tải, còn lại là Google vẫn phục vụ."""
+        if status == 429 or status >= 500:
+            self.on_failure(f"HTTP {status}", probe)
+        else:
+            self.on_success(probe)
+
+    def _open(self):
+        self.state = "open"
+        self.opened += 1
+        self._probe_at = time.time() + self._timeout * (1 + random.uniform(0, self.jitter))
+        logger.warning(f"Mở bộ ngắt {self.endpoint} trong {self._timeout} giây sau {self.failures} lỗi: {self.last_error}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "opened": self.opened,
+                "rejected": self.rejected,
+                "probes": self.probes,
+                "retry_in_s": round(max(0.0, self._probe_at - time.time()), 1) if self.state != "closed" else 0,
+                "last_error": self.last_error,
+            }
+
+
+class BreakerRegistry:
+    """Một CircuitBreaker cho mỗi endpoint, dùng chung cho mọi phiên và luồng của tiến trình."""
+
+    def __init__(self, **options):
+        self.options = options
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, endpoint):
+        with self._lock:
+            if endpoint not in self._breakers:
+                self._breakers[endpoint] = CircuitBreaker(endpoint, **self.options)
+            return self._breakers[endpoint]
+
+    def stats(self):
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {endpoint: breaker.stats() for endpoint, breaker in breakers.items()}
+
+
+# --- Hàng đợi ghi: lần ghi gặp quá tải được giữ lại và gửi lại ở luồng nền ---
+class WriteQueue:
+    """Các lần ghi chưa gửi được (job là hàm không dùng st.*) được luồng nền gửi lại, lùi dần có jitter
+    (base_delay, gấp đôi mỗi lần, tối đa max_delay); khi bộ ngắt còn mở thì job báo lỗi ngay mà không gửi request.
+    Lỗi không phải quá tải thì bỏ job và ghi log.
+
+    Hàng đợi nằm trong bộ nhớ tiến trình: khởi động lại ứng dụng thì các job chưa gửi bị mất (xem stats)."""
+
+    def __init__(self, base_delay=5, max_delay=120, jitter=0.5, history=20):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.completed = 0
+        self.retries = 0
+        self._ids = itertools.count(1)
+        self._jobs = []
+        self._failed = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sheets-write-queue", daemon=True)
+        self._thread.start()
+
+    def _delay(self, attempts):
+        delay = min(self.max_delay, self.base_delay * 2 ** max(0, attempts - 1))
+        return delay * (1 + random.uniform(0, self.jitter))
+
+    def submit(self, description, fn):
+        """Xếp một lần ghi; trả về mã job."""
+        now = time.time()
+        with self._lock:
+            # Không sớm hơn job đứng trước: jitter riêng của từng job không được đảo thứ tự ghi
+            next_at = now + self._delay(1)
+            if self._jobs:
+                next_at = max(next_at, self._jobs[-1]["next_at"])
+            job = {"id": next(self._ids), "description": description, "fn": fn, "attempts": 0,
+                   "submitted_at": now, "next_at": next_at, "last_error": None}
+            self._jobs.append(job)
+        logger.warning(f"Xếp hàng ghi #{job['id']}: {description}")
+        self._wake.set()
+        return job["id"]
+
+    def pending(self):
+        with self._lock:
+            return len(self._jobs)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                wait = self._jobs[0]["next_at"] if self._jobs else None
+            self._wake.wait(None if wait is None else max(0.0, wait - time.time()))
+            self._wake.clear()
+            try:
+                self.drain()
+            except Exception as e:
+                logger.warning(f"Lỗi hàng đợi ghi: {e}")
+
+    def drain(self):
+        """Gửi các job theo đúng thứ tự xếp hàng: chỉ gửi job đầu hàng khi đã đến hạn, job đầu còn quá tải
+        thì các job sau chờ theo."""
+        while True:
+            with self._lock:
+                if not self._jobs or self._jobs[0]["next_at"] > time.time():
+                    return
+                job = self._jobs[0]
+            job["attempts"] += 1
+            try:
+                job["fn"]()
+            except Exception as e:
+                with self._lock:
+                    job["last_error"] = str(e)[:200]
+                    if is_unavailable(e):
+                        self.retries += 1
+                        retry_at = time.time() + self._delay(job["attempts"])
+                        # Các job sau cũng chờ tới lượt này để không ghi vượt thứ tự
+                        for other in self._jobs:
+                            other["next_at"] = max(other["next_at"], retry_at)
+                        return
+                    self._jobs.remove(job)
+                    self._failed.append({k: job[k] for k in ("id", "description", "attempts", "last_error")})
+                logger.error(f"Bỏ lần ghi #{job['id']} ({job['description']}): {e}")
+                continue
+            with self._lock:
+                self._jobs.remove(job)
+                self.completed += 1
+            logger.info(f"Đã ghi #{job['id']} từ hàng đợi: {job['description']}")
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            return {
+                "pending": len(self._jobs),
+                "oldest_s": round(now - min(job["submitted_at"] for job in self._jobs), 1) if self._jobs else 0,
+                "next_attempt_in_s": round(max(0.0, self._jobs[0]["next_at"] - now), 1) if self._jobs else None,
+                "completed": self.completed,
+                "retries": self.retries,
+                "failed": list(self._failed),
+            }
@@ -0,0 +1,237 @@
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+
+from resilience import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+
+# --- Kho dùng chung giữa các tiến trình (nhiều replica Streamlit trên cùng máy) ---
+# Một file SQLite (chế độ WAL, nên đặt trên /dev/shm hoặc ổ cục bộ) giữ ba thứ:
+#   values  - dữ liệu đã đọc từ Sheets, gắn với phiên bản (modifiedTime) lúc đọc
+#   leases  - quyền tải một khóa: tại mỗi thời điểm chỉ một tiến trình gọi API cho khóa đó
+#   buckets - token bucket giới hạn tổng số request của mọi tiến trình
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS "values" (name TEXT PRIMARY KEY, token TEXT, data BLOB, size INTEGER, stored_at REAL);
+CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT, expires REAL);
+CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL, updated REAL);
+"""
+
+
+class SharedStore:
+    """Bộ nhớ đệm và điều phối dùng chung qua SQLite; mỗi luồng dùng một kết nối riêng."""
+
+    def __init__(self, path, max_bytes=512 * 1024 * 1024, lease_seconds=30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lease_seconds = lease_seconds
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self.waits = 0
+        self.errors = 0
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        return conn
+
+    # --- Giá trị gắn phiên bản ---
+    def get(self, name, token):
+        """Giá trị đã lưu của name nếu được đọc ở đúng phiên bản token, ngược lại None."""
+        row = self._connect().execute('SELECT data FROM "values" WHERE name = ? AND token = ?', (name, str(token))).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(zlib.decompress(row[0]))
+
+    def put(self, name, token, value):
+        data = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), 1)
+        conn = self._transaction()
+        try:
+            conn.execute('INSERT OR REPLACE INTO "values" VALUES (?, ?, ?, ?, ?)', (name, str(token), data, len(data), time.time()))
+            # Vượt dung lượng thì bỏ các giá trị lưu lâu nhất
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM "values"').fetchone()[0]
+            for old_name, size in conn.execute('SELECT name, size FROM "values" WHERE name != ? ORDER BY stored_at', (name,)).fetchall():
+                if total <= self.max_bytes:
+                    break
+                conn.execute('DELETE FROM "values" WHERE name = ?', (old_name,))
+                total -= size
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    # --- Một tiến trình tải cho mỗi khóa ---
+    def acquire(self, name, owner):
+        conn = self._transaction()
+        try:
+            row = conn.execute("SELECT owner, expires FROM leases WHERE name = ?", (name,)).fetchone()
+            now = time.time()
+            if row is not None and row[0] != owner and row[1] > now:
+                conn.execute("COMMIT")
+                return False
+            conn.execute("INSERT OR REPLACE INTO leases VALUES (?, ?, ?)", (name, owner, now + self.lease_seconds))
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def release(self, name, owner):
+        self._connect().execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    def get_or_fetch(self, name, token, fetch):
+        """Giá trị của name ở phiên bản token: lấy từ kho nếu tiến trình khác đã tải, nếu không thì giành quyền
+        tải và gọi fetch(); trong lúc tiến trình khác đang tải thì chờ kết quả của nó thay vì gọi API lần nữa.
+
+        Lỗi của kho (khóa file, đầy đĩa...) không làm hỏng việc đọc: khi đó gọi thẳng fetch()."""
+        if token is None:
+            return fetch()
+        try:
+            value = self.get(name, token)
+            if value is not None:
+                self.hits += 1
+                return value
+            self.misses += 1
+            owner = uuid.uuid4().hex
+            deadline = time.time() + self.lease_seconds
+            while not self.acquire(name, owner):
+                self.waits += 1
+                time.sleep(0.2)
+                value = self.get(name, token)
+                if value is not None:
+                    self.hits += 1
+                    return value
+                if time.time() > deadline:
+                    logger.warning(f"Chờ tiến trình khác tải {name} quá lâu, tự tải")
+                    return fetch()
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning(f"Lỗi kho dùng chung khi đọc {name}: {e}")
+            return fetch()
+        try:
+            # Tiến trình khác có thể vừa lưu và nhả quyền giữa lần get() cuối và lúc giành được quyền tải
+            try:
+                value = self.get(name, token)
+            except sqlite3.Error:
+                value = None
+            if value is not None:
+                self.hits += 1
+                return value
+            value = fetch()
+            self.fetches += 1
+            try:
+                self.put(name, token, value)
+            except sqlite3.Error as e:
+                self.errors += 1
+                logger.warning(f"Lỗi kho dùng chung khi lưu {name}: {e}")
+            return value
+        finally:
+            try:
+                self.release(name, owner)
+            except sqlite3.Error:
+                pass
+
+    def stats(self):
+        try:
+            conn = self._connect()
+            entries, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM "values"').fetchone()
+            leases = conn.execute("SELECT COUNT(*) FROM leases WHERE expires > ?", (time.time(),)).fetchone()[0]
+        except sqlite3.Error as e:
+            return {"path": self.path, "error": str(e)}
+        return {
+            "path": self.path,
+            "pid": os.getpid(),
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "active_leases": leases,
+            "hits": self.hits,
+            "misses": self.misses,
+            "fetches": self.fetches,
+            "waits": self.waits,
+            "errors": self.errors,
+        }
+
+
+# --- Giới hạn tốc độ chung cho mọi tiến trình ---
+class RateLimiter:
+    """Token bucket trong SharedStore: mọi tiến trình cùng rút từ một ngân sách request mỗi phút, nên thêm
+    replica không làm tăng tổng số request gửi tới Google (kể cả các lần thử lại).
+
+    Chỉ chờ tối đa max_wait giây (luồng chạy script không bị treo); lâu hơn thì báo CircuitOpenError như khi
+    Google trả 429, để nơi gọi dùng dữ liệu đệm hoặc xếp hàng ghi."""
+
+    def __init__(self, store, per_minute, burst=None, max_wait=1, name="sheets"):
+        self.store = store
+        self.rate = per_minute / 60.0
+        self.capacity = burst if burst is not None else max(1, per_minute // 6)
+        self.max_wait = max_wait
+        self.name = name
+        self.acquired = 0
+        self.waited_seconds = 0.0
+        self.timeouts = 0
+
+    def _take(self):
+        """Rút một token; trả về số giây cần chờ nếu chưa đủ token (0 là đã rút được)."""
+        conn = self.store._transaction()
+        try:
+            now = time.time()
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (self.name,)).fetchone()
+            tokens = self.capacity if row is None else min(self.capacity, row[0] + (now - row[1]) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            conn.execute("INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)", (self.name, tokens, now))
+            conn.execute("COMMIT")
+            return wait
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def acquire(self):
+        start = time.time()
+        while True:
+            try:
+                wait = self._take()
+            except sqlite3.Error as e:
+                logger.warning(f"Lỗi bộ giới hạn tốc độ, bỏ qua giới hạn: {e}")
+                return
+            if not wait:
+                self.acquired += 1
+                self.waited_seconds += time.time() - start
+                return
+            if time.time() - start + wait > self.max_wait:
+                self.timeouts += 1
+                logger.warning(f"Hết ngân sách request chung, cần chờ {wait:.1f} giây: báo quá tải thay vì chờ")
+                raise CircuitOpenError(self.name, wait)
+            time.sleep(wait)
+
+    def stats(self):
+        return {
+            "per_minute": round(self.rate * 60),
+            "burst": self.capacity,
+            "acquired": self.acquired,
+            "waited_s": round(self.waited_seconds, 2),
+            "timeouts": self.timeouts,
+        }
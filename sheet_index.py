@@ -0,0 +1,705 @@
+import bisect
+import heapq
+import sys
+import threading
+import time
+import unicodedata
+from collections import Counter
+from datetime import date, datetime, time as dt_time, timedelta
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# --- Định dạng cột thời gian nhập (giống add_data_to_sheet) ---
+TIMESTAMP_COLUMN = "Thoi_gian_nhap"
+TIMESTAMP_FORMAT = "%d/%m/%Y %H:%M:%S"
+USER_COLUMN = "Nguoi_nhap"
+ID_COLUMN = "Ma_ban_ghi"
+
+
+# Chi phí ước lượng cho mỗi hàng ngoài dữ liệu trong mảng pyarrow: datetime, các mục trong chỉ mục, khóa Ma_ban_ghi
+ROW_INDEX_OVERHEAD = 200
+
+
+def row_nbytes(row):
+    return sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row) + ROW_INDEX_OVERHEAD
+
+
+# --- Chuẩn hóa chữ tiếng Việt để tìm kiếm không phân biệt dấu ---
+# Bỏ mọi dấu kết hợp sau khi tách NFD; đ/Đ không tách được nên đổi riêng
+# Bảng dịch được điền dần theo các ký tự thực sự gặp, không duyệt cả 1,1 triệu điểm mã khi import
+class _StripMarks(dict):
+    def __missing__(self, cp):
+        value = None if unicodedata.combining(chr(cp)) else cp
+        self[cp] = value
+        return value
+
+
+_STRIP_MARKS = _StripMarks({ord("đ"): "d", ord("Đ"): "D"})
+
+
+def normalize_text(value):
+    """Chuỗi để so khớp: bỏ dấu (NFD), casefold, gộp khoảng trắng. "  Nguyễn  Văn " -> "nguyen van"."""
+    text = unicodedata.normalize("NFD", str(value)).translate(_STRIP_MARKS).casefold()
+    return " ".join(text.split())
+
+
+def normalize_row(row):
+    # Giữ nguyên đối tượng chuỗi nếu chuẩn hóa không đổi gì (số, mã) để không tốn thêm bộ nhớ
+    return [normalized if normalized != value else value for value, normalized in ((v, normalize_text(v)) for v in row)]
+
+
+def duplicate_key(values):
+    """Khóa so trùng: từng giá trị chuẩn hóa và bỏ mọi khoảng trắng ("090 123" = "090123"); None nếu có giá trị trống."""
+    key = tuple("".join(normalize_text(value).split()) for value in values)
+    return key if all(key) else None
+
+
+def parse_entry_time(value):
+    """Đổi chuỗi Thoi_gian_nhap thành datetime, trả về None nếu sai định dạng."""
+    try:
+        return datetime.strptime(str(value).strip(), TIMESTAMP_FORMAT)
+    except ValueError:
+        return None
+
+
+def parse_config_date(value):
+    """Đổi ngày dd/mm/YYYY trong sheet Config thành date, None nếu sai định dạng."""
+    try:
+        return datetime.strptime(str(value).strip(), "%d/%m/%Y").date()
+    except ValueError:
+        return None
+
+
+# --- Quý dùng cho sheet lưu trữ ---
+def quarter_start(day):
+    return date(day.year, 3 * ((day.month - 1) // 3) + 1, 1)
+
+
+def quarter_end(day):
+    start = quarter_start(day)
+    next_start = date(start.year + 1, 1, 1) if start.month == 10 else date(start.year, start.month + 3, 1)
+    return next_start - timedelta(days=1)
+
+
+def quarter_label(day):
+    return f"{day.year}_Q{(day.month - 1) // 3 + 1}"
+
+
+# --- Chỉ mục thời gian nhập đã sắp xếp ---
+class TimestampIndex:
+    """Danh sách (thời gian, vị trí hàng) sắp xếp theo thời gian, tra cứu bằng tìm kiếm nhị phân."""
+
+    def __init__(self):
+        self._times = []
+        self._positions = []
+        # Hàng có Thoi_gian_nhap trống hoặc sai định dạng, không bị bỏ qua âm thầm
+        self.malformed = set()
+
+    def __len__(self):
+        return len(self._times)
+
+    def add(self, pos, entry_time):
+        if entry_time is None:
+            self.malformed.add(pos)
+            return
+        # Hàng mới thường có thời gian lớn nhất nên chèn cuối danh sách, O(1)
+        idx = bisect.bisect_right(self._times, entry_time)
+        self._times.insert(idx, entry_time)
+        self._positions.insert(idx, pos)
+
+    def remove(self, pos, entry_time):
+        if entry_time is None:
+            self.malformed.discard(pos)
+            return
+        idx = bisect.bisect_left(self._times, entry_time)
+        while idx < len(self._times) and self._times[idx] == entry_time:
+            if self._positions[idx] == pos:
+                del self._times[idx]
+                del self._positions[idx]
+                return
+            idx += 1
+
+    def _bounds(self, start_date, end_date):
+        lo = bisect.bisect_left(self._times, datetime.combine(start_date, dt_time.min))
+        hi = bisect.bisect_right(self._times, datetime.combine(end_date, dt_time.max))
+        return lo, hi
+
+    def count_between(self, start_date, end_date):
+        lo, hi = self._bounds(start_date, end_date)
+        return max(hi - lo, 0)
+
+    def positions_between(self, start_date, end_date):
+        """Vị trí các hàng có ngày nhập trong [start_date, end_date], theo thứ tự thời gian."""
+        lo, hi = self._bounds(start_date, end_date)
+        return self._positions[lo:hi]
+
+
+def date_range_bounds(start_date, end_date):
+    return datetime.combine(start_date, dt_time.min), datetime.combine(end_date, dt_time.max)
+
+
+# --- Gợi ý nhập liệu theo tiền tố, xếp hạng theo tần suất ---
+class SuggestionIndex:
+    """Các giá trị đã nhập của một cột: danh sách khóa chuẩn hóa (normalize_text) đã sắp xếp để tra tiền tố
+    bằng tìm kiếm nhị phân, kèm số lần xuất hiện. Các biến thể cùng khóa ("Hà Nội", "ha  noi") gộp làm một
+    và được gợi ý theo cách viết phổ biến nhất."""
+
+    def __init__(self, values=()):
+        self._counts = {}  # khóa -> tổng số lần
+        self._forms = {}   # khóa -> {cách viết: số lần}
+        for value in values:
+            self._count(str(value).strip(), 1)
+        # Sắp xếp một lần khi tạo; sau đó mỗi khóa mới được chèn đúng chỗ
+        self._keys = sorted(self._counts)
+        self._top = None
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _count(self, value, delta):
+        key = normalize_text(value)
+        if not key:
+            return None
+        forms = self._forms.setdefault(key, {})
+        forms[value] = forms.get(value, 0) + delta
+        if forms[value] <= 0:
+            del forms[value]
+        self._counts[key] = self._counts.get(key, 0) + delta
+        return key
+
+    def add(self, value):
+        value = str(value).strip()
+        is_new = normalize_text(value) not in self._counts
+        key = self._count(value, 1)
+        if key is None:
+            return
+        if is_new:
+            bisect.insort(self._keys, key)
+        top = self._top
+        if top:
+            # Giữ danh sách phổ biến nhất: chỉ sắp xếp lại khi khóa vừa tăng vào được danh sách
+            if key in top:
+                top.sort(key=self._counts.get, reverse=True)
+            elif self._counts[key] > self._counts[top[-1]]:
+                top[-1] = key
+                top.sort(key=self._counts.get, reverse=True)
+
+    def remove(self, value):
+        value = str(value).strip()
+        key = normalize_text(value)
+        if value not in self._forms.get(key, {}):
+            return
+        self._count(value, -1)
+        if self._counts[key] <= 0:
+            del self._counts[key], self._forms[key]
+            del self._keys[bisect.bisect_left(self._keys, key)]
+        self._top = None
+
+    def _display(self, key):
+        forms = self._forms[key]
+        return max(forms, key=forms.get)
+
+    def top(self, prefix="", limit=50):
+        """[(cách viết, số lần)] của tối đa limit khóa bắt đầu bằng prefix (đã chuẩn hóa), nhiều nhất trước."""
+        prefix = normalize_text(prefix)
+        if not prefix:
+            # Danh sách phổ biến nhất được giữ lại và cập nhật theo từng lần thêm
+            if self._top is None or len(self._top) < min(limit, len(self._counts)):
+                self._top = heapq.nlargest(limit, self._counts, key=self._counts.get)
+            keys = self._top[:limit]
+        else:
+            lo = bisect.bisect_left(self._keys, prefix)
+            hi = bisect.bisect_left(self._keys, prefix + "\U0010ffff")
+            keys = heapq.nlargest(limit, self._keys[lo:hi], key=self._counts.get)
+        return [(self._display(key), self._counts[key]) for key in keys]
+
+
+# --- Lưu hàng theo cột trong mảng pyarrow: vài byte mỗi ô thay vì một đối tượng str Python (~50-80 byte) ---
+# Hàng thêm/sửa gần đây nằm tạm trong list Python và được gộp vào mảng khi vượt ngưỡng (tối thiểu, hoặc 1/8 số hàng)
+COMPACT_MIN_ROWS = 4096
+# Cột có số giá trị khác nhau không quá tỉ lệ này được mã hóa từ điển (Nguoi_nhap, Ghi_chu, địa bàn...)
+DICTIONARY_MAX_RATIO = 0.5
+# Lọc từ khóa trên tập vị trí nhỏ hơn 1/NARROW_SCAN_RATIO số hàng thì chỉ so khớp các ô đó thay vì cả cột
+NARROW_SCAN_RATIO = 8
+
+
+def _string_array(values):
+    return pa.array(values, type=pa.string())
+
+
+def _decode(array):
+    return array.dictionary_decode() if pa.types.is_dictionary(array.type) else array
+
+
+def _compact_array(array):
+    if pa.types.is_dictionary(array.type):
+        return array
+    if len(array) >= 64 and pc.count_distinct(array).as_py() <= len(array) * DICTIONARY_MAX_RATIO:
+        return array.dictionary_encode()
+    return array
+
+
+def _map_strings(array, fn):
+    """Áp fn lên từng chuỗi; cột mã hóa từ điển chỉ cần áp lên các giá trị khác nhau."""
+    if pa.types.is_dictionary(array.type):
+        return pa.DictionaryArray.from_arrays(array.indices, _string_array([fn(value) for value in array.dictionary.to_pylist()]))
+    return _string_array([fn(value) for value in array.to_pylist()])
+
+
+def _match_substring(array, pattern, kernel=pc.match_substring):
+    """Mảng bool: ô nào chứa pattern (hoặc khớp theo kernel khác như pc.starts_with, pc.equal);
+    cột mã hóa từ điển chỉ so trên các giá trị khác nhau."""
+    if pa.types.is_dictionary(array.type):
+        return pc.take(kernel(array.dictionary, pattern), array.indices)
+    return kernel(array, pattern)
+
+
+def _position_array(positions):
+    if isinstance(positions, range):
+        return np.arange(positions.start, positions.stop, positions.step, dtype=np.int64)
+    return np.asarray(positions, dtype=np.int64)
+
+
+class ColumnStore:
+    """Dãy hàng (list chuỗi cùng độ dài width) lưu theo cột; phần đã gộp là mảng pyarrow không đổi,
+    hàng thêm hoặc sửa sau đó nằm trong list Python cho tới lần gộp kế tiếp."""
+
+    def __init__(self, width, columns=None):
+        self.width = width
+        self._set_columns(columns if columns is not None else [_string_array([]) for _ in range(width)])
+
+    def _set_columns(self, columns):
+        self._columns = [_compact_array(column) for column in columns]
+        self._base_len = len(self._columns[0]) if self._columns else 0
+        self._patches = {}  # vị trí trong phần đã gộp -> hàng đã sửa
+        self._tail = []     # hàng thêm sau lần gộp
+        self._base_nbytes = sum(column.nbytes for column in self._columns)
+        self._overlay_nbytes = 0
+
+    def __len__(self):
+        return self._base_len + len(self._tail)
+
+    def __getitem__(self, pos):
+        if pos < 0:
+            pos += len(self)
+        if pos >= self._base_len:
+            return self._tail[pos - self._base_len]
+        row = self._patches.get(pos)
+        if row is None:
+            row = [column[pos].as_py() for column in self._columns]
+        return row
+
+    def __setitem__(self, pos, row):
+        if pos >= self._base_len:
+            self._overlay_nbytes += row_nbytes(row) - row_nbytes(self._tail[pos - self._base_len])
+            self._tail[pos - self._base_len] = row
+        else:
+            old = self._patches.get(pos)
+            self._overlay_nbytes += row_nbytes(row) - (row_nbytes(old) if old is not None else 0)
+            self._patches[pos] = row
+        self._maybe_compact()
+
+    def append(self, row, compact=True):
+        """compact=False khi nạp hàng loạt rồi gọi compact() ngay sau đó (không cần ước lượng dung lượng từng hàng)."""
+        self._tail.append(row)
+        if compact:
+            self._overlay_nbytes += row_nbytes(row)
+            self._maybe_compact()
+
+    @property
+    def nbytes(self):
+        return self._base_nbytes + self._overlay_nbytes
+
+    def _maybe_compact(self):
+        if len(self._patches) + len(self._tail) >= max(COMPACT_MIN_ROWS, self._base_len // 8):
+            self.compact()
+
+    def compact(self):
+        """Gộp các hàng trong list Python vào mảng pyarrow."""
+        if not self._patches and not self._tail:
+            return
+        patched = sorted(self._patches)
+        mask = np.zeros(self._base_len, dtype=bool)
+        mask[patched] = True
+        columns = []
+        for col, column in enumerate(self._columns):
+            column = _decode(column)
+            if patched:
+                column = pc.replace_with_mask(column, pa.array(mask), _string_array([self._patches[pos][col] for pos in patched]))
+            columns.append(pa.concat_arrays([column, _string_array([row[col] for row in self._tail])]))
+        self._set_columns(columns)
+
+    def _combined(self, col):
+        """Cột col gồm phần đã gộp nối với các hàng tạm (sửa trước, thêm sau)."""
+        column = self._columns[col]
+        overlay = [self._patches[pos] for pos in sorted(self._patches)] + self._tail
+        if not overlay:
+            return column
+        extra = _string_array([row[col] for row in overlay])
+        if pa.types.is_dictionary(column.type):
+            extra = extra.dictionary_encode()
+        return pa.chunked_array([column, extra], type=column.type)
+
+    def _indices(self, positions):
+        """Đổi vị trí hàng sang vị trí trong _combined()."""
+        positions = _position_array(positions)
+        if not self._patches and not self._tail:
+            return positions
+        patched = sorted(self._patches)
+        mapping = np.arange(len(self), dtype=np.int64)
+        mapping[self._base_len:] += len(patched)
+        mapping[patched] = self._base_len + np.arange(len(patched), dtype=np.int64)
+        return mapping[positions]
+
+    def take(self, positions):
+        """Các cột (mảng pyarrow kiểu string) của những hàng tại positions, theo thứ tự positions."""
+        indices = self._indices(positions)
+        return [_decode(pa.chunked_array([self._combined(col).take(indices)]).combine_chunks())
+                for col in range(self.width)]
+
+    def column(self, col):
+        """Mọi giá trị của cột col dạng list str, dùng khi lập chỉ mục."""
+        values = self._columns[col].to_pylist()
+        for pos, row in self._patches.items():
+            values[pos] = row[col]
+        values.extend(row[col] for row in self._tail)
+        return values
+
+    def column_array(self, col):
+        """Cột col theo thứ tự hàng dạng mảng pyarrow (giữ mã hóa từ điển nếu có)."""
+        if not self._patches and not self._tail:
+            return self._columns[col]
+        return pa.chunked_array([self._combined(col).take(self._indices(range(len(self))))]).combine_chunks()
+
+    def equals(self, rows):
+        """True nếu rows (list các hàng) trùng từng ô với các hàng đang lưu."""
+        if len(rows) != len(self):
+            return False
+        return all(self.column(c) == [row[c] for row in rows] for c in range(self.width))
+
+
+# --- Dữ liệu một worksheet kèm chỉ mục ---
+class SheetDataset:
+    """Các hàng dữ liệu (danh sách chuỗi theo thứ tự tiêu đề) của một worksheet và chỉ mục đi kèm.
+
+    Hàng được lưu theo cột trong ColumnStore (pyarrow); frame() tạo DataFrame thẳng từ các mảng đó."""
+
+    def __init__(self, headers, rows=()):
+        self.headers = list(headers)
+        self._time_col = self.headers.index(TIMESTAMP_COLUMN) if TIMESTAMP_COLUMN in self.headers else None
+        self._user_col = self.headers.index(USER_COLUMN) if USER_COLUMN in self.headers else None
+        self._id_col = self.headers.index(ID_COLUMN) if ID_COLUMN in self.headers else None
+        self.loaded_at = time.time()
+        # Tăng mỗi khi dữ liệu thay đổi, dùng để nhận biết kết quả lọc đã cũ
+        self.version = 0
+        self.lock = threading.RLock()
+        self._load(rows)
+
+    def _load(self, rows):
+        """Lập chỉ mục lại từ đầu với các hàng rows, gộp vào mảng pyarrow một lần ở cuối."""
+        self.rows = ColumnStore(len(self.headers))
+        self.entry_times = []
+        self.time_index = TimestampIndex()
+        # Chỉ mục Nguoi_nhap -> danh sách vị trí hàng (tăng dần)
+        self.user_index = {}
+        # Chỉ mục Ma_ban_ghi -> vị trí hàng, để sửa bản ghi mà không phải tải lại cả sheet
+        self.id_index = {}
+        # Cột chuẩn hóa (normalize_text) cho tìm kiếm (ColumnStore), chỉ tạo khi có truy vấn đầu tiên
+        self.search_rows = None
+        # Chỉ mục kiểm tra trùng: bộ cột -> (vị trí cột, {khóa: tập vị trí hàng}), tạo khi được hỏi lần đầu
+        self.key_indexes = {}
+        # Gợi ý nhập liệu: vị trí cột -> SuggestionIndex, tạo khi được hỏi lần đầu
+        self.suggestion_indexes = {}
+        # Số bản ghi theo (Nguoi_nhap, ngày nhập) cho trang thống kê, tạo khi được hỏi lần đầu
+        self.day_counts = None
+        for row in rows:
+            self._append(row, compact=False)
+        self.rows.compact()
+
+    @classmethod
+    def from_values(cls, values):
+        """Tạo dataset từ kết quả get_all_values (hàng đầu là tiêu đề)."""
+        if not values:
+            return cls([])
+        return cls(values[0], values[1:])
+
+    def __len__(self):
+        return len(self.rows)
+
+    def approx_nbytes(self):
+        """Dung lượng ước lượng, dùng cho bộ nhớ đệm giới hạn byte."""
+        nbytes = sys.getsizeof(self.headers) + self.rows.nbytes + len(self.rows) * ROW_INDEX_OVERHEAD
+        return nbytes + (self.search_rows.nbytes if self.search_rows is not None else 0)
+
+    def _normalize(self, row):
+        row = [str(v) for v in row[:len(self.headers)]]
+        row.extend([''] * (len(self.headers) - len(row)))
+        return row
+
+    def _entry_time(self, row):
+        if self._time_col is None:
+            return None
+        return parse_entry_time(row[self._time_col])
+
+    def _user(self, row):
+        return row[self._user_col] if self._user_col is not None else ''
+
+    def _record_id(self, row):
+        return row[self._id_col] if self._id_col is not None else ''
+
+    def append(self, row):
+        """Thêm một hàng vào cuối và cập nhật chỉ mục, trả về vị trí hàng."""
+        return self._append(row)
+
+    def _append(self, row, compact=True):
+        with self.lock:
+            row = self._normalize(row)
+            pos = len(self.rows)
+            entry_time = self._entry_time(row)
+            self.rows.append(row, compact=compact)
+            self.entry_times.append(entry_time)
+            self.time_index.add(pos, entry_time)
+            self.user_index.setdefault(self._user(row), []).append(pos)
+            if self._record_id(row):
+                self.id_index[self._record_id(row)] = pos
+            if self.search_rows is not None:
+                self.search_rows.append(normalize_row(row))
+            for cols, index in self.key_indexes.values():
+                self._index_key(index, cols, pos, row)
+            for col, suggestions in self.suggestion_indexes.items():
+                suggestions.add(row[col])
+            if self.day_counts is not None:
+                self._count_day(self._user(row), entry_time, 1)
+            self.version += 1
+            return pos
+
+    def update(self, pos, row):
+        """Ghi đè hàng tại vị trí pos và cập nhật chỉ mục."""
+        with self.lock:
+            row = self._normalize(row)
+            old_row = self.rows[pos]
+            self.time_index.remove(pos, self.entry_times[pos])
+            old_user, new_user = self._user(old_row), self._user(row)
+            if old_user != new_user:
+                # Người sửa trở thành Nguoi_nhap: chuyển hàng sang phân vùng mới
+                owned = self.user_index.get(old_user, [])
+                idx = bisect.bisect_left(owned, pos)
+                if idx < len(owned) and owned[idx] == pos:
+                    del owned[idx]
+                if not owned:
+                    self.user_index.pop(old_user, None)
+                bisect.insort(self.user_index.setdefault(new_user, []), pos)
+            old_id, new_id = self._record_id(old_row), self._record_id(row)
+            if old_id != new_id:
+                if self.id_index.get(old_id) == pos:
+                    del self.id_index[old_id]
+                if new_id:
+                    self.id_index[new_id] = pos
+            entry_time = self._entry_time(row)
+            if self.search_rows is not None:
+                self.search_rows[pos] = normalize_row(row)
+            for cols, index in self.key_indexes.values():
+                self._unindex_key(index, cols, pos, old_row)
+                self._index_key(index, cols, pos, row)
+            for col, suggestions in self.suggestion_indexes.items():
+                suggestions.remove(old_row[col])
+                suggestions.add(row[col])
+            if self.day_counts is not None:
+                self._count_day(old_user, self.entry_times[pos], -1)
+                self._count_day(new_user, entry_time, 1)
+            self.rows[pos] = row
+            self.entry_times[pos] = entry_time
+            self.time_index.add(pos, entry_time)
+            self.version += 1
+
+    def sync(self, values):
+        """Đồng bộ với dữ liệu mới tải: chỉ lập chỉ mục phần đuôi nếu sheet chỉ được thêm hàng.
+
+        Trả về True nếu dataset vẫn dùng được, False nếu tiêu đề đổi và cần tạo lại."""
+        with self.lock:
+            if not values or list(values[0]) != self.headers:
+                return False
+            fresh = [self._normalize(row) for row in values[1:]]
+            known = len(self.rows)
+            if len(fresh) >= known and self.rows.equals(fresh[:known]):
+                for row in fresh[known:]:
+                    self.append(row)
+            else:
+                # Có hàng bị sửa hoặc xóa bên ngoài ứng dụng: lập chỉ mục lại từ đầu
+                self._load(fresh)
+                self.version += 1
+            self.loaded_at = time.time()
+            return True
+
+    def position_of(self, record_id):
+        """Vị trí hàng hiện tại của bản ghi theo Ma_ban_ghi, None nếu không có."""
+        return self.id_index.get(record_id) if record_id else None
+
+    def frame(self, positions):
+        """DataFrame các hàng tại positions; cột kiểu string[pyarrow] lấy thẳng từ mảng đã lưu, không tạo str Python."""
+        with self.lock:
+            columns = self.rows.take(positions)
+        return pd.DataFrame({header: pd.arrays.ArrowStringArray(column) for header, column in zip(self.headers, columns)})
+
+    def positions_between(self, start_date, end_date):
+        """Vị trí các hàng nhập trong khoảng ngày, theo thứ tự hàng trong sheet."""
+        with self.lock:
+            return sorted(self.time_index.positions_between(start_date, end_date))
+
+    def column_index(self, column):
+        """Vị trí cột theo tên (bỏ qua dấu * của cột bắt buộc), None nếu không có."""
+        for idx, header in enumerate(self.headers):
+            if header.rstrip('*') == column.rstrip('*'):
+                return idx
+        return None
+
+    def ensure_search_index(self):
+        """Tạo cột chuẩn hóa nếu chưa có; True nếu vừa tạo (dung lượng dataset tăng)."""
+        with self.lock:
+            if self.search_rows is not None:
+                return False
+            self.search_rows = ColumnStore(len(self.headers), [
+                _map_strings(self.rows.column_array(col), normalize_text) for col in range(len(self.headers))
+            ])
+            return True
+
+    @staticmethod
+    def _index_key(index, cols, pos, row):
+        key = duplicate_key(row[c] for c in cols)
+        if key is not None:
+            index.setdefault(key, set()).add(pos)
+
+    @staticmethod
+    def _unindex_key(index, cols, pos, row):
+        key = duplicate_key(row[c] for c in cols)
+        positions = index.get(key)
+        if positions is not None:
+            positions.discard(pos)
+            if not positions:
+                del index[key]
+
+    def find_key(self, columns, values):
+        """Vị trí các hàng có cùng khóa (duplicate_key) với values trên bộ cột columns; chỉ mục được tạo
+        ở lần hỏi đầu tiên rồi cập nhật theo từng hàng, nên mỗi lần kiểm tra là O(1)."""
+        key = duplicate_key(values)
+        columns = tuple(columns)
+        with self.lock:
+            if columns not in self.key_indexes:
+                cols = [self.column_index(column) for column in columns]
+                if key is None or None in cols:
+                    return []
+                index = {}
+                positions = range(len(cols))
+                for pos, values in enumerate(zip(*(self.rows.column(col) for col in cols))):
+                    self._index_key(index, positions, pos, values)
+                self.key_indexes[columns] = (cols, index)
+            if key is None:
+                return []
+            return sorted(self.key_indexes[columns][1].get(key, ()))
+
+    def suggestions(self, column, prefix="", limit=50):
+        """[(giá trị, số lần)] gợi ý cho cột column theo tiền tố; None nếu dataset không có cột này."""
+        col = self.column_index(column)
+        if col is None:
+            return None
+        with self.lock:
+            if col not in self.suggestion_indexes:
+                self.suggestion_indexes[col] = SuggestionIndex(self.rows.column(col))
+            return self.suggestion_indexes[col].top(prefix, limit)
+
+    @staticmethod
+    def _day(entry_time):
+        return entry_time.date() if entry_time is not None else None
+
+    def _count_day(self, user, entry_time, delta):
+        key = (user, self._day(entry_time))
+        count = self.day_counts[key] + delta
+        if count > 0:
+            self.day_counts[key] = count
+        else:
+            self.day_counts.pop(key, None)
+
+    def daily_counts(self):
+        """{(Nguoi_nhap, ngày nhập): số bản ghi}, ngày None là Thoi_gian_nhap sai định dạng. Đếm cả sheet một lần
+        rồi cập nhật theo từng hàng thêm/sửa, nên kích thước chỉ phụ thuộc số người dùng × số ngày."""
+        with self.lock:
+            if self.day_counts is None:
+                users = self.rows.column(self._user_col) if self._user_col is not None else [''] * len(self.rows)
+                self.day_counts = Counter(zip(users, map(self._day, self.entry_times)))
+            return dict(self.day_counts)
+
+    def _search_columns(self, column):
+        if column is None:
+            return range(len(self.headers))
+        col = self.column_index(column)
+        return [] if col is None else [col]
+
+    def filter_keyword(self, positions, keyword, column=None):
+        """Lọc các vị trí hàng có chứa từ khóa (không phân biệt hoa thường và dấu), trên một cột hoặc cả hàng."""
+        keyword = normalize_text(keyword)
+        with self.lock:
+            self.ensure_search_index()
+            cols = self._search_columns(column)
+            if not cols:
+                return []
+            positions = _position_array(positions)
+            if len(positions) * NARROW_SCAN_RATIO < len(self.rows):
+                # Ít vị trí (thường là kết quả của từ khóa ngắn hơn): chỉ so khớp các ô ở những vị trí đó
+                matched = np.zeros(len(positions), dtype=bool)
+                for col in cols:
+                    cells = self.search_rows.column_array(col).take(positions)
+                    matched |= _match_substring(cells, keyword).to_numpy(zero_copy_only=False)
+                return positions[matched].tolist()
+            # So khớp trên cả cột bằng pyarrow rồi mới chọn các vị trí cần lọc
+            matched = np.zeros(len(self.rows), dtype=bool)
+            for col in cols:
+                matched |= _match_substring(self.search_rows.column_array(col), keyword).to_numpy(zero_copy_only=False)
+        return positions[matched[positions]].tolist()
+
+    def match_scores(self, positions, keyword, column=None):
+        """Điểm xếp hạng của từng vị trí với từ khóa, lấy ô khớp tốt nhất: 3 trùng cả ô, 2 ô bắt đầu bằng
+        từ khóa, 1 từ khóa ở đầu một từ, 0 chỉ chứa từ khóa ở giữa từ."""
+        keyword = normalize_text(keyword)
+        positions = _position_array(positions)
+        scores = np.zeros(len(positions), dtype=np.int8)
+        if not len(positions) or not keyword:
+            return scores
+        with self.lock:
+            self.ensure_search_index()
+            for col in self._search_columns(column):
+                cells = self.search_rows.column_array(col).take(positions)
+                for score, pattern, kernel in (
+                    (1, " " + keyword, pc.match_substring),
+                    (2, keyword, pc.starts_with),
+                    (3, keyword, pc.equal),
+                ):
+                    matched = _match_substring(cells, pattern, kernel).to_numpy(zero_copy_only=False)
+                    np.maximum(scores, np.where(matched, score, 0).astype(np.int8), out=scores)
+        return scores
+
+    def select(self, username=None, start_date=None, end_date=None):
+        """Vị trí hàng theo Nguoi_nhap và/hoặc khoảng ngày, theo thứ tự hàng trong sheet.
+
+        Hàng có Thoi_gian_nhap sai định dạng luôn được giữ lại khi lọc theo ngày."""
+        with self.lock:
+            has_range = bool(start_date and end_date)
+            if username is None:
+                if not has_range:
+                    return list(range(len(self.rows)))
+                positions = self.time_index.positions_between(start_date, end_date)
+                return sorted(positions + list(self.time_index.malformed))
+            owned = self.user_index.get(username, [])
+            if not has_range:
+                return list(owned)
+            if self.time_index.count_between(start_date, end_date) < len(owned):
+                # Khoảng ngày hẹp hơn phân vùng người dùng: duyệt theo chỉ mục thời gian
+                owned = set(owned)
+                positions = [p for p in self.time_index.positions_between(start_date, end_date) if p in owned]
+                positions.extend(p for p in self.time_index.malformed if p in owned)
+                return sorted(positions)
+            lo, hi = date_range_bounds(start_date, end_date)
+            entry_times = self.entry_times
+            return [p for p in owned if entry_times[p] is None or lo <= entry_times[p] <= hi]
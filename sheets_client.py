@@ -0,0 +1,270 @@
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+
+from google.auth.transport.requests import AuthorizedSession
+from gspread.utils import convert_credentials, numericise_all, to_records
+from requests.adapters import HTTPAdapter
+
+from resilience import endpoint_of
+
+logger = logging.getLogger(__name__)
+
+# Google chỉ nén gzip phản hồi khi User-Agent có chữ "gzip"
+GZIP_HEADERS = {"Accept-Encoding": "gzip", "User-Agent": "google-sheet-app (gzip)"}
+
+
+# --- Phiên HTTP dùng chung: pool kết nối giữ sống, nén gzip, làm mới token trước khi hết hạn ---
+class PooledAuthorizedSession(AuthorizedSession):
+    """AuthorizedSession với pool kết nối cố định, dùng chung an toàn giữa các phiên Streamlit và luồng.
+
+    Khi mọi kết nối đều bận, luồng mới chờ kết nối rảnh thay vì mở thêm kết nối (và bắt tay TLS) mới.
+    rate_limiter (nếu có, xem shared_store.RateLimiter) được gọi trước mỗi request, kể cả các lần thử lại.
+    breakers (nếu có, xem resilience.BreakerRegistry) ghi nhận kết quả từng request theo endpoint và từ chối
+    ngay (CircuitOpenError) khi bộ ngắt của endpoint đang mở."""
+
+    def __init__(self, credentials, pool_size=16, refresh_margin=300, rate_limiter=None, breakers=None):
+        super().__init__(credentials)
+        self.pool_size = pool_size
+        self.refresh_margin = refresh_margin
+        self.rate_limiter = rate_limiter
+        self.breakers = breakers
+        self._adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=True, max_retries=0)
+        self.mount("https://", self._adapter)
+        self.headers.update(GZIP_HEADERS)
+        self._stats_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._requests = 0
+        self._in_flight = 0
+        self._max_in_flight = 0
+        self._bytes_received = 0
+        self._request_seconds = 0.0
+        self._token_refreshes = 0
+        self._refresh_errors = 0
+        self._refresher = threading.Thread(target=self._refresh_loop, name="sheets-token-refresher", daemon=True)
+        self._refresher.start()
+
+    def _seconds_to_expiry(self):
+        expiry = self.credentials.expiry
+        if not self.credentials.token or expiry is None:
+            return 0
+        # google-auth lưu expiry dạng UTC không kèm múi giờ
+        return (expiry.replace(tzinfo=timezone.utc) - datetime.now(timezone.utc)).total_seconds()
+
+    def refresh_token(self):
+        with self._refresh_lock:
+            if self._seconds_to_expiry() > self.refresh_margin:
+                return
+            self.credentials.refresh(self._auth_request)
+            self._token_refreshes += 1
+
+    def _refresh_loop(self):
+        """Luồng nền làm mới token trước hạn refresh_margin giây để không request nào phải chờ."""
+        while True:
+            try:
+                self.refresh_token()
+                time.sleep(max(self._seconds_to_expiry() - self.refresh_margin, 30))
+            except Exception as e:
+                self._refresh_errors += 1
+                logger.warning(f"Không làm mới được token Google: {e}")
+                time.sleep(30)
+
+    def request(self, method, url, *args, **kwargs):
+        breaker = self.breakers.get(endpoint_of(method, url)) if self.breakers is not None else None
+        probe = breaker.before_call() if breaker is not None else False
+        try:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+        except BaseException:
+            # Request chưa được gửi: không tính là lỗi của endpoint, nhưng phải trả lại lượt thăm dò
+            if breaker is not None:
+                breaker.release(probe)
+            raise
+        with self._stats_lock:
+            self._requests += 1
+            self._in_flight += 1
+            self._max_in_flight = max(self._max_in_flight, self._in_flight)
+        start = time.perf_counter()
+        try:
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except Exception as e:
+                if breaker is not None:
+                    breaker.on_failure(e, probe)
+                raise
+            if breaker is not None:
+                breaker.record(response.status_code, probe)
+            # Content-Length là số byte đã nén thực sự truyền qua mạng
+            received = int(response.headers.get("Content-Length", 0) or 0)
+            with self._stats_lock:
+                self._bytes_received += received
+            return response
+        finally:
+            with self._stats_lock:
+                self._in_flight -= 1
+                self._request_seconds += time.perf_counter() - start
+
+    def stats(self):
+        """Số liệu pool kết nối để chọn SHEETS_POOL_SIZE phù hợp với số người dùng đồng thời."""
+        pools = []
+        for key in list(self._adapter.poolmanager.pools.keys()):
+            pool = self._adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            pools.append({
+                "host": pool.host,
+                "connections_opened": pool.num_connections,
+                "requests": pool.num_requests,
+                "idle": pool.pool.qsize() if pool.pool is not None else 0,
+            })
+        with self._stats_lock:
+            return {
+                "pool_size": self.pool_size,
+                "requests": self._requests,
+                "in_flight": self._in_flight,
+                "max_in_flight": self._max_in_flight,
+                "bytes_received": self._bytes_received,
+                "avg_request_ms": round(1000 * self._request_seconds / self._requests, 1) if self._requests else 0.0,
+                "token_refreshes": self._token_refreshes,
+                "token_refresh_errors": self._refresh_errors,
+                "token_expires_in_s": int(self._seconds_to_expiry()),
+                "pools": pools,
+                "rate_limit": self.rate_limiter.stats() if self.rate_limiter is not None else None,
+            }
+
+
+def create_session(credentials, pool_size=16, refresh_margin=300, rate_limiter=None, breakers=None):
+    """Tạo phiên HTTP dùng chung cho gspread từ credentials oauth2client hoặc google-auth."""
+    return PooledAuthorizedSession(convert_credentials(credentials), pool_size=pool_size, refresh_margin=refresh_margin,
+                                   rate_limiter=rate_limiter, breakers=breakers)
+
+
+# --- Đọc nhiều vùng của một spreadsheet trong một request values_batch_get ---
+class BatchReader:
+    """Gom các vùng (A1, kèm tên sheet) cần đọc trong một lượt chạy rồi gửi chung một request.
+
+    add() đăng ký vùng, fetch() gửi mọi vùng đang chờ, get() trả kết quả (tự gửi nếu vùng chưa được đọc)."""
+
+    def __init__(self, book, value_render_option="FORMATTED_VALUE"):
+        self.book = book
+        self.value_render_option = value_render_option
+        self._pending = []
+        self._results = {}
+
+    def add(self, range_name):
+        if range_name not in self._results and range_name not in self._pending:
+            self._pending.append(range_name)
+
+    def fetch(self):
+        if not self._pending:
+            return
+        ranges, self._pending = self._pending, []
+        response = self.book.values_batch_get(ranges, params={"valueRenderOption": self.value_render_option})
+        # Google trả các vùng theo đúng thứ tự đã gửi; vùng trống không có khóa "values"
+        for range_name, value_range in zip(ranges, response.get("valueRanges", [])):
+            self._results[range_name] = value_range.get("values", [])
+
+    def get(self, range_name):
+        if range_name not in self._results:
+            self.add(range_name)
+            self.fetch()
+        return self._results[range_name]
+
+
+def records_from_values(values):
+    """Như Worksheet.get_all_records (hàng đầu là tiêu đề, số được chuyển kiểu) nhưng từ giá trị đã đọc sẵn."""
+    if not values:
+        return []
+    headers = values[0]
+    rows = [list(row) + [""] * (len(headers) - len(row)) for row in values[1:]]
+    return to_records(headers, [numericise_all(row) for row in rows])
+
+
+# --- Phiên bản spreadsheet: thay cho TTL cố định của bộ nhớ đệm ---
+class RevisionTracker:
+    """Theo dõi modifiedTime (Drive) của từng spreadsheet theo một lịch chung cho mọi phiên.
+
+    Dữ liệu lưu kèm phiên bản lúc đọc và còn hiệu lực chừng nào phiên bản chưa đổi, nên sheet
+    không đổi thì không bao giờ phải tải lại. Nếu không đọc được modifiedTime thì phiên bản
+    đổi theo từng khoảng fallback_ttl giây, tức là quay về hành vi TTL cũ."""
+
+    def __init__(self, poll_interval=5, fallback_ttl=60):
+        self.poll_interval = poll_interval
+        self.fallback_ttl = fallback_ttl
+        self.polls = 0
+        self.poll_errors = 0
+        self._lock = threading.Lock()
+        self._state = {}  # spreadsheet_id -> {"remote", "revision", "checked_at", "lock"}
+
+    def _entry(self, key):
+        with self._lock:
+            if key not in self._state:
+                self._state[key] = {"remote": None, "revision": 0, "checked_at": 0.0, "lock": threading.Lock()}
+            return self._state[key]
+
+    def _poll(self, entry, book):
+        try:
+            remote = book.get_lastUpdateTime()
+        except Exception as e:
+            self.poll_errors += 1
+            logger.warning(f"Không đọc được thời điểm sửa đổi của spreadsheet: {e}")
+            remote = ("ttl", int(time.time() // self.fallback_ttl))
+        self.polls += 1
+        entry["checked_at"] = time.time()
+        if remote != entry["remote"]:
+            entry["remote"] = remote
+            entry["revision"] += 1
+
+    def revision(self, key, book):
+        """Phiên bản hiện tại; chỉ một luồng gọi Drive cho mỗi spreadsheet trong mỗi chu kỳ poll_interval."""
+        entry = self._entry(key)
+        if entry["checked_at"] < time.time() - self.poll_interval:
+            with entry["lock"]:
+                if entry["checked_at"] < time.time() - self.poll_interval:
+                    self._poll(entry, book)
+        return entry["revision"]
+
+    def remote(self, key):
+        """modifiedTime đã đọc gần nhất (không gọi Drive); None nếu chưa đọc được hoặc đang dùng TTL dự phòng."""
+        remote = self._entry(key)["remote"]
+        return remote if isinstance(remote, str) else None
+
+    def _adopt_remote(self, entry, book):
+        try:
+            entry["remote"] = book.get_lastUpdateTime()
+            entry["checked_at"] = time.time()
+            self.polls += 1
+        except Exception as e:
+            self.poll_errors += 1
+            logger.warning(f"Không đọc được thời điểm sửa đổi của spreadsheet: {e}")
+
+    def note_write(self, key, book):
+        """Sau khi chính ứng dụng ghi và đã cập nhật bộ nhớ đệm tại chỗ: nhận modifiedTime mới mà không đổi phiên bản.
+
+        Ghi của người khác xen giữa lần ghi này và lần đọc modifiedTime sẽ không được nhận ra cho tới
+        lần thay đổi sau; dataset vẫn được đối chiếu lại định kỳ (xem REVISION_MAX_AGE)."""
+        entry = self._entry(key)
+        with entry["lock"]:
+            self._adopt_remote(entry, book)
+
+    def invalidate(self, key, book=None):
+        """Tín hiệu thay đổi cục bộ (ví dụ thêm cột, lưu trữ): mọi dữ liệu của spreadsheet hết hiệu lực ngay.
+
+        Nếu có book thì nhận luôn modifiedTime mới để lần kiểm tra sau không làm mất hiệu lực thêm lần nữa."""
+        entry = self._entry(key)
+        with entry["lock"]:
+            entry["revision"] += 1
+            if book is not None:
+                self._adopt_remote(entry, book)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "poll_interval_s": self.poll_interval,
+                "polls": self.polls,
+                "poll_errors": self.poll_errors,
+                "spreadsheets": {str(key): {"revision": entry["revision"], "modified": str(entry["remote"]),
+                                            "checked_s_ago": round(time.time() - entry["checked_at"], 1)}
+                                 for key, entry in self._state.items()},
+            }
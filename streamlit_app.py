@@ -6,12 +6,22 @@ from oauth2client.service_account import ServiceAccountCredentials
 import os
 import json
 import time
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import pandas as pd
+import numpy as np
 import logging
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode, DataReturnMode
 import pytz
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import wraps
+from array import array
+from cache_store import BackgroundRefresher, LRUCache
+import fake_sheets
+from resilience import BreakerRegistry, WriteQueue, is_unavailable
+from sheets_client import BatchReader, RevisionTracker, create_session, records_from_values
+from shared_store import RateLimiter, SharedStore
+from sheet_index import ID_COLUMN, SheetDataset, duplicate_key, normalize_text, parse_config_date, quarter_end, quarter_label, quarter_start
 
 # --- Cấu hình logging ---
 logging.basicConfig(filename='app.log', level=logging.INFO)
@@ -89,91 +99,298 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # --- Kết nối Google Sheets ---
+# Số kết nối HTTP giữ sống dùng chung cho mọi phiên; xem số liệu pool trong sidebar admin
+SHEETS_POOL_SIZE = int(os.getenv("SHEETS_POOL_SIZE", "16"))
+# "fake" dùng backend giả lập trong bộ nhớ (fake_sheets.py) để chạy thử và kiểm thử tải
+SHEETS_BACKEND = os.getenv("SHEETS_BACKEND", "google")
+
+# --- Chạy nhiều tiến trình (replica) trên cùng máy: kho dùng chung để không tải trùng và chung hạn mức API ---
+# Đường dẫn file SQLite dùng chung (ví dụ /dev/shm/google-sheet-app.db); để trống thì mỗi tiến trình độc lập như trước
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH", "")
+SHARED_CACHE_MAX_MB = int(os.getenv("SHARED_CACHE_MAX_MB", "512"))
+# Tổng số request Sheets/Drive mỗi phút của mọi tiến trình (0 là không giới hạn); cần SHARED_CACHE_PATH
+SHEETS_RATE_PER_MINUTE = int(os.getenv("SHEETS_RATE_PER_MINUTE", "0"))
+
+@st.cache_resource
+def get_shared_store():
+    if not SHARED_CACHE_PATH:
+        return None
+    try:
+        return SharedStore(SHARED_CACHE_PATH, max_bytes=SHARED_CACHE_MAX_MB * 1024 * 1024)
+    except Exception as e:
+        logger.error(f"Không mở được kho dùng chung {SHARED_CACHE_PATH}: {e}")
+        return None
+
+@st.cache_resource
+def get_rate_limiter():
+    store = get_shared_store()
+    if store is None or SHEETS_RATE_PER_MINUTE <= 0:
+        return None
+    return RateLimiter(store, SHEETS_RATE_PER_MINUTE)
+
+# --- Bộ ngắt mạch theo endpoint (đọc, ghi, Drive): không ngủ chờ thử lại trên luồng chạy script ---
+# Sau BREAKER_FAILURES lỗi 429/5xx liên tiếp thì báo lỗi ngay (dùng dữ liệu đệm hoặc xếp hàng ghi) trong
+# BREAKER_RESET_SECONDS giây rồi thử lại bằng một request thăm dò; thăm dò lỗi thì chờ gấp đôi, tối đa BREAKER_MAX_RESET_SECONDS
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "3"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+BREAKER_MAX_RESET_SECONDS = float(os.getenv("BREAKER_MAX_RESET_SECONDS", "300"))
+
+@st.cache_resource
+def get_breakers():
+    return BreakerRegistry(failure_threshold=BREAKER_FAILURES, reset_timeout=BREAKER_RESET_SECONDS,
+                           max_reset_timeout=BREAKER_MAX_RESET_SECONDS)
+
+@st.cache_resource
+def get_write_queue():
+    return WriteQueue()
+
+@st.cache_resource
+def get_gspread_client():
+    if SHEETS_BACKEND == "fake":
+        client = fake_sheets.client_from_env()
+        client.backend.breakers = get_breakers()
+        return client
+    scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+    creds_dict = json.loads(os.getenv("GOOGLE_CREDENTIALS_JSON"))
+    creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
+    session = create_session(creds, pool_size=SHEETS_POOL_SIZE, rate_limiter=get_rate_limiter(), breakers=get_breakers())
+    client = gspread.authorize(creds, session=session)
+    # Giới hạn thời gian kết nối/đọc để luồng chờ pool không bị treo vô hạn
+    client.set_timeout((10, 60))
+    return client
+
+def transport_stats():
+    session = get_gspread_client().http_client.session
+    return session.stats() if hasattr(session, "stats") else {}
+
+# Mỗi spreadsheet (shard) được mở một lần và dùng chung cho mọi phiên
+@st.cache_resource
+def open_spreadsheet(spreadsheet_id):
+    return get_gspread_client().open_by_key(spreadsheet_id)
+
 @st.cache_resource
 def connect_to_gsheets():
     try:
-        scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
         creds_json = os.getenv("GOOGLE_CREDENTIALS_JSON")
         sheet_id = os.getenv("SHEET_ID")
+        if SHEETS_BACKEND == "fake":
+            return open_spreadsheet(sheet_id or fake_sheets.DEMO_SPREADSHEET_ID)
         
         if not creds_json or not sheet_id:
             st.error("Thiếu biến môi trường GOOGLE_CREDENTIALS_JSON hoặc SHEET_ID")
             return None
         
-        creds_dict = json.loads(creds_json)
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-        client = gspread.authorize(creds)
-        return client.open_by_key(sheet_id)
+        return open_spreadsheet(sheet_id)
     except Exception as e:
         st.error(f"Lỗi kết nối Google Sheets: {e}")
         logger.error(f"Lỗi kết nối Google Sheets: {e}")
         return None
 
+# --- Tham chiếu worksheet trên nhiều spreadsheet: "Sheetname" hoặc "Sheetname@<Spreadsheet_ID>" ---
+SPREADSHEET_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{20,}')
+
+def make_sheet_ref(sheet_name, spreadsheet_id=None):
+    spreadsheet_id = str(spreadsheet_id or '').strip()
+    return f"{sheet_name}@{spreadsheet_id}" if spreadsheet_id else sheet_name
+
+def split_sheet_ref(sheet_ref):
+    sheet_name, sep, spreadsheet_id = sheet_ref.rpartition('@')
+    if sep and SPREADSHEET_ID_PATTERN.fullmatch(spreadsheet_id):
+        return sheet_name, spreadsheet_id
+    return sheet_ref, None
+
+def get_spreadsheet(sh, sheet_ref):
+    _, spreadsheet_id = split_sheet_ref(sheet_ref)
+    return open_spreadsheet(spreadsheet_id) if spreadsheet_id else sh
+
+def open_worksheet(sh, sheet_ref):
+    sheet_name, _ = split_sheet_ref(sheet_ref)
+    return get_spreadsheet(sh, sheet_ref).worksheet(sheet_name)
+
+# --- Bộ nhớ đệm giới hạn dung lượng: dùng chung toàn tiến trình và riêng từng phiên ---
+CACHE_MAX_MB = int(os.getenv("CACHE_MAX_MB", "256"))
+SESSION_CACHE_MAX_MB = int(os.getenv("SESSION_CACHE_MAX_MB", "32"))
+
+@st.cache_resource
+def get_shared_cache():
+    return LRUCache(CACHE_MAX_MB * 1024 * 1024, name="shared")
+
+def get_session_cache():
+    if "session_cache" not in st.session_state:
+        st.session_state.session_cache = LRUCache(SESSION_CACHE_MAX_MB * 1024 * 1024, name="session")
+    return st.session_state.session_cache
+
+# --- Phiên bản spreadsheet: dữ liệu đệm còn hiệu lực cho đến khi spreadsheet thay đổi (thay cho TTL 60 giây) ---
+# Chu kỳ kiểm tra modifiedTime trên Drive, dùng chung cho mọi phiên
+REVISION_POLL_SECONDS = float(os.getenv("REVISION_POLL_SECONDS", "5"))
+# Dataset vẫn được đối chiếu lại sau khoảng này (chỉ lập chỉ mục phần thay đổi) phòng khi bỏ sót thay đổi
+REVISION_MAX_AGE = int(os.getenv("REVISION_MAX_AGE", "900"))
+
+@st.cache_resource
+def get_revision_tracker():
+    return RevisionTracker(poll_interval=REVISION_POLL_SECONDS)
+
+@st.cache_resource
+def get_write_counters():
+    """Số lần ứng dụng đã ghi vào từng worksheet, dùng làm khóa cho kết quả đệm không được cập nhật tại chỗ."""
+    return {}
+
+def sheet_revision(sh, spreadsheet_id=None):
+    book = open_spreadsheet(spreadsheet_id) if spreadsheet_id else sh
+    return get_revision_tracker().revision(spreadsheet_id, book)
+
+def session_cached(key, revision):
+    """Giá trị trong bộ nhớ đệm của phiên nếu được lưu ở đúng phiên bản revision, ngược lại None."""
+    entry = get_session_cache().get(key)
+    return entry[1] if entry is not None and entry[0] == revision else None
+
+def session_store(key, revision, value):
+    get_session_cache().set(key, (revision, value))
+    return value
+
+def note_spreadsheet_write(sh, sheet_ref):
+    """Gọi sau khi ghi và đã cập nhật dataset tại chỗ: lần kiểm tra modifiedTime sau không làm mất hiệu lực bộ nhớ đệm."""
+    counters = get_write_counters()
+    counters[sheet_ref] = counters.get(sheet_ref, 0) + 1
+    get_revision_tracker().note_write(split_sheet_ref(sheet_ref)[1], get_spreadsheet(sh, sheet_ref))
+
+def invalidate_spreadsheet(sh, spreadsheet_id=None):
+    """Thay đổi cấu trúc (thêm cột, thêm/xóa sheet, sửa Config): mọi dữ liệu đệm của spreadsheet hết hiệu lực ngay."""
+    get_revision_tracker().invalidate(spreadsheet_id, open_spreadsheet(spreadsheet_id) if spreadsheet_id else sh)
+    get_refresher().expire_group(spreadsheet_id)
+
+# --- Làm mới nền: dùng tiếp dữ liệu cũ trong khi luồng nền tải bản mới (Config, User, tiêu đề, dataset hay xem) ---
+# Dữ liệu cũ chỉ được dùng tối đa chừng này giây sau khi spreadsheet thay đổi, quá hạn thì tải ngay
+MAX_STALENESS_SECONDS = int(os.getenv("MAX_STALENESS_SECONDS", "30"))
+
+@st.cache_resource
+def get_refresher():
+    return BackgroundRefresher(get_shared_cache(), interval=REVISION_POLL_SECONDS, max_staleness=MAX_STALENESS_SECONDS,
+                               max_age=REVISION_MAX_AGE, logger=logger)
+
+def revision_source(spreadsheet_id, book):
+    """Hàm lấy phiên bản spreadsheet cho luồng nền (không dùng st.* ngoài luồng chạy script)."""
+    tracker = get_revision_tracker()
+    return lambda: tracker.revision(spreadsheet_id, book)
+
+def cached_or_load(sh, key, spreadsheet_id, loader):
+    """Giá trị trong bộ nhớ đệm chung nếu còn dùng được, nếu không thì tải ngay và đăng ký làm mới nền."""
+    book = open_spreadsheet(spreadsheet_id) if spreadsheet_id else sh
+    refresher = get_refresher()
+    revision = sheet_revision(sh, spreadsheet_id)
+    value = refresher.lookup(key, revision)
+    if value is None:
+        try:
+            value = refresher.store(key, loader(None), revision, loader, revision_source(spreadsheet_id, book), group=spreadsheet_id)
+        except gspread.exceptions.APIError as e:
+            value = unavailable_fallback(key, e)
+    return value
+
+def unavailable_fallback(key, error):
+    """Google quá tải hoặc bộ ngắt đang mở: dùng bản đệm đang có dù đã cũ, không có thì báo lỗi như cũ."""
+    value = get_refresher().fallback(key) if is_unavailable(error) else None
+    if value is None:
+        raise error
+    logger.warning(f"Dùng dữ liệu đệm cũ cho {key}: {error}")
+    return value
+
+def shared_loader(book, spreadsheet_id, name, fetch):
+    """Bọc fetch() để các tiến trình dùng chung kết quả đọc theo modifiedTime: tiến trình đầu tiên gọi API,
+    các tiến trình khác (kể cả đang chờ cùng lúc) lấy kết quả từ kho. Gọi ở luồng chính, dùng được ở luồng nền."""
+    store = get_shared_store()
+    if store is None:
+        return fetch
+    tracker = get_revision_tracker()
+    return lambda *args: store.get_or_fetch(f"{book.id}|{name}", tracker.remote(spreadsheet_id), lambda: fetch(*args))
+
+def note_data_freshness(keys):
+    """Ghi lại thời điểm dữ liệu vừa đọc còn khớp với Google Sheets, để hiện "Dữ liệu tính đến ..."."""
+    refresher = get_refresher()
+    times = [t for t in (refresher.as_of(key) for key in keys) if t]
+    st.session_state.data_as_of = (min(times) if times else time.time(), any(refresher.is_stale(key) for key in keys))
+
+def show_data_freshness():
+    as_of, refreshing = st.session_state.get("data_as_of", (None, False))
+    if as_of:
+        as_of_text = datetime.fromtimestamp(as_of, pytz.timezone('Asia/Ho_Chi_Minh')).strftime("%H:%M:%S %d/%m/%Y")
+        st.caption(f"🕒 Dữ liệu tính đến {as_of_text}" + (" (đang cập nhật bản mới)" if refreshing else ""))
+
 # --- Lấy định dạng cột từ Google Sheet ---
+# Định dạng ô tiêu đề hiếm khi đổi: giữ trong bộ nhớ đệm chung theo hàng tiêu đề, tối đa COLUMN_FORMATS_MAX_AGE giây
+COLUMN_FORMATS_MAX_AGE = int(os.getenv("COLUMN_FORMATS_MAX_AGE", "3600"))
+
+def guess_column_format(header):
+    """Suy luận định dạng dựa trên tên cột."""
+    header_lower = header.lower()
+    if 'ngày' in header_lower or 'date' in header_lower:
+        return 'date'
+    if 'di động' in header_lower or 'điện thoại' in header_lower or 'cmt' in header_lower or 'số' in header_lower:
+        return 'number'
+    return 'text'
+
+def fetch_header_number_formats(book, sheet_name):
+    """Một request: kiểu numberFormat của từng ô trên hàng tiêu đề ('' nếu ô không đặt định dạng)."""
+    metadata = book.fetch_sheet_metadata({
+        "includeGridData": "true",
+        "ranges": gspread.utils.absolute_range_name(sheet_name, "1:1"),
+        "fields": "sheets.data.rowData.values.effectiveFormat.numberFormat.type",
+    })
+    sheets = metadata.get('sheets') or [{}]
+    rows = (sheets[0].get('data') or [{}])[0].get('rowData') or [{}]
+    return [cell.get('effectiveFormat', {}).get('numberFormat', {}).get('type', '') for cell in rows[0].get('values', [])]
+
 def get_column_formats(sh, sheet_name):
-    try:
-        worksheet = sh.worksheet(sheet_name)
-        # Lấy tiêu đề cột
-        headers = worksheet.row_values(1)
-        formats = {}
-        # Thử lấy định dạng từ API
-        sheet_formats = worksheet.get('A1:' + chr(65 + len(headers) - 1) + '1', include_tailing_empty=False, value_render_option='UNFORMATTED_VALUE', include_format=True)
-        for idx, cell in enumerate(sheet_formats[0]):
-            header = headers[idx].rstrip('*')
-            if 'format' in cell:
-                format_pattern = cell['format'].get('numberFormat', {}).get('type', '')
-                if format_pattern == 'DATE':
-                    formats[header] = 'date'
-                elif format_pattern == 'NUMBER':
-                    formats[header] = 'number'
-                else:
-                    formats[header] = 'text'
-            else:
-                # Suy luận định dạng dựa trên tên cột
-                header_lower = header.lower()
-                if 'ngày' in header_lower or 'date' in header_lower:
-                    formats[header] = 'date'
-                elif 'di động' in header_lower or 'điện thoại' in header_lower or 'cmt' in header_lower or 'số' in header_lower:
-                    formats[header] = 'number'
-                else:
-                    formats[header] = 'text'
+    sheet_ref = get_write_shard(sh, sheet_name)
+    headers = get_sheet_headers(sh, sheet_ref)
+    cache = get_shared_cache()
+    key = ("formats", sheet_ref, tuple(headers))
+    formats = cache.get(key, max_age=COLUMN_FORMATS_MAX_AGE)
+    if formats is not None:
         return formats
+    try:
+        number_formats = fetch_header_number_formats(get_spreadsheet(sh, sheet_ref), split_sheet_ref(sheet_ref)[0])
+    except gspread.exceptions.APIError as e:
+        if e.response.status_code == 429:
+            st.warning("Hệ thống đang bận, vui lòng thử lại sau ít giây.")
+        logger.error(f"Lỗi khi lấy định dạng cột: {e}")
+        # Không lưu vào bộ nhớ đệm để lần sau lấy lại định dạng thật
+        return {header.rstrip('*'): guess_column_format(header.rstrip('*')) for header in headers}
     except Exception as e:
         st.error(f"Lỗi khi lấy định dạng cột: {e}")
         logger.error(f"Lỗi khi lấy định dạng cột: {e}")
-        # Nếu không lấy được định dạng, suy luận dựa trên tên cột
-        headers = worksheet.row_values(1)
-        formats = {}
-        for header in headers:
-            header_clean = header.rstrip('*')
-            header_lower = header_clean.lower()
-            if 'ngày' in header_lower or 'date' in header_lower:
-                formats[header_clean] = 'date'
-            elif 'di động' in header_lower or 'điện thoại' in header_lower or 'cmt' in header_lower or 'số' in header_lower:
-                formats[header_clean] = 'number'
-            else:
-                formats[header_clean] = 'text'
-        return formats
+        number_formats = []
+    formats = {}
+    for idx, header in enumerate(headers):
+        header = header.rstrip('*')
+        format_pattern = number_formats[idx] if idx < len(number_formats) else ''
+        if format_pattern == 'DATE':
+            formats[header] = 'date'
+        elif format_pattern == 'NUMBER':
+            formats[header] = 'number'
+        elif format_pattern:
+            formats[header] = 'text'
+        else:
+            formats[header] = guess_column_format(header)
+    return cache.set(key, formats)
 
 # --- Làm sạch dữ liệu DataFrame với kiểm tra ký tự ---
 def clean_dataframe(df):
     """Làm sạch DataFrame, giữ nguyên ký tự tiếng Việt và số 0 ở đầu."""
     for col in df.columns:
         try:
-            # Chuyển tất cả thành chuỗi, giữ nguyên số 0 ở đầu
-            df[col] = df[col].astype(str).str.strip()
+            # Chuyển tất cả thành chuỗi (string[pyarrow], xử lý theo cả cột), giữ nguyên số 0 ở đầu
+            df[col] = df[col].astype("string[pyarrow]").str.strip()
             # Thay thế giá trị không hợp lệ
             df[col] = df[col].replace(['Err', 'Uhjr', '', ' ', '.', '   ', '<NA>'], pd.NA)
             df[col] = df[col].fillna('')
-            # Lọc ký tự không in được và log chúng
-            original_values = df[col].copy()
-            df[col] = df[col].apply(lambda x: ''.join(c for c in x if c.isprintable() or ord(c) > 31))
+            # Lọc ký tự điều khiển (không in được) và log chúng
+            original_values = df[col]
+            df[col] = df[col].str.replace(r'[\x00-\x1f]', '', regex=True)
             # Log các ký tự bị loại bỏ
-            for idx, (orig, cleaned) in enumerate(zip(original_values, df[col])):
-                if orig != cleaned:
-                    diff_chars = ''.join(c for c in orig if c not in cleaned and ord(c) <= 31)
-                    if diff_chars:
-                        logger.warning(f"Row {idx}, Column {col}: Removed non-printable chars: {repr(diff_chars)}")
+            for idx in (original_values != df[col]).to_numpy().nonzero()[0]:
+                orig = original_values.iloc[idx]
+                diff_chars = ''.join(c for c in orig if ord(c) <= 31)
+                logger.warning(f"Row {idx}, Column {col}: Removed non-printable chars: {repr(diff_chars)}")
             logger.info(f"DataFrame column {col} after cleaning: {df[col].head().to_list()}")
         except Exception as e:
             logger.error(f"Lỗi khi làm sạch cột {col}: {e}")
@@ -190,98 +407,117 @@ def validate_input(value, field_name):
         return False, f"Trường {field_name} chỉ chứa khoảng trắng."
     return True, cleaned_value
 
+# --- Ảnh chụp một spreadsheet: danh sách worksheet, hàng tiêu đề, Config và User ---
+def fetch_spreadsheet_snapshot(book, with_tables):
+    """Hai request: danh sách worksheet, rồi một values_batch_get cho tiêu đề mọi worksheet (kèm Config, User nếu with_tables)."""
+    titles = [ws.title for ws in book.worksheets()]
+    tables = [name for name in ("Config", "User") if with_tables and name in titles]
+    reader = BatchReader(book)
+    for title in titles:
+        reader.add(gspread.utils.absolute_range_name(title, "1:1"))
+    for name in tables:
+        reader.add(gspread.utils.absolute_range_name(name))
+    reader.fetch()
+    snapshot = {"titles": set(titles), "headers": {}, "Config": None, "User": None}
+    for title in titles:
+        values = reader.get(gspread.utils.absolute_range_name(title, "1:1"))
+        snapshot["headers"][title] = list(values[0]) if values else []
+    for name in tables:
+        snapshot[name] = records_from_values(reader.get(gspread.utils.absolute_range_name(name)))
+    return snapshot
+
+def get_spreadsheet_snapshot(sh, spreadsheet_id=None):
+    """Ảnh chụp dùng chung cho mọi phiên, được luồng nền làm mới khi spreadsheet thay đổi."""
+    book = open_spreadsheet(spreadsheet_id) if spreadsheet_id else sh
+    fetch = shared_loader(book, spreadsheet_id, "snapshot", lambda: fetch_spreadsheet_snapshot(book, spreadsheet_id is None))
+    return cached_or_load(sh, ("snapshot", spreadsheet_id), spreadsheet_id, lambda previous: fetch())
+
 # --- Đọc cấu hình từ sheet Config ---
-@retry(
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=1, min=2, max=10),
-    retry=retry_if_exception_type(gspread.exceptions.APIError)
-)
 def get_sheet_config(sh):
-    cache_key = "sheet_config"
-    if cache_key not in st.session_state or st.session_state.get(f"{cache_key}_timestamp", 0) < time.time() - 60:
-        try:
-            worksheet = sh.worksheet("Config")
-            data = worksheet.get_all_records()
-            if not data:
-                st.error("Sheet Config trống. Vui lòng thêm dữ liệu với các cột: Sheetname, Tìm kiếm, Nhập, Xem đã nhập.")
-                return []
-            st.session_state[cache_key] = data
-            st.session_state[f"{cache_key}_timestamp"] = time.time()
-        except gspread.exceptions.WorksheetNotFound:
-            st.error("Không tìm thấy sheet 'Config'. Vui lòng tạo sheet 'Config' với các cột: Sheetname, Tìm kiếm, Nhập, Xem đã nhập.")
-            return []
-        except gspread.exceptions.APIError as e:
-            if e.response.status_code == 429:
-                st.warning("Hệ thống đang bận, vui lòng thử lại sau ít giây.")
-            raise
-        except Exception as e:
-            st.error(f"Lỗi khi đọc sheet Config: {e}")
-            logger.error(f"Lỗi khi đọc sheet Config: {e}")
+    try:
+        data = get_spreadsheet_snapshot(sh)["Config"]
+        if data is None:
+            raise gspread.exceptions.WorksheetNotFound("Config")
+        if not data:
+            st.error("Sheet Config trống. Vui lòng thêm dữ liệu với các cột: Sheetname, Tìm kiếm, Nhập, Xem đã nhập.")
             return []
-    return st.session_state[cache_key]
+    except gspread.exceptions.WorksheetNotFound:
+        st.error("Không tìm thấy sheet 'Config'. Vui lòng tạo sheet 'Config' với các cột: Sheetname, Tìm kiếm, Nhập, Xem đã nhập.")
+        return []
+    except gspread.exceptions.APIError as e:
+        if e.response.status_code == 429:
+            st.warning("Hệ thống đang bận, vui lòng thử lại sau ít giây.")
+        raise
+    except Exception as e:
+        st.error(f"Lỗi khi đọc sheet Config: {e}")
+        logger.error(f"Lỗi khi đọc sheet Config: {e}")
+        return []
+    return data
+
+# --- Tên các worksheet và hàng tiêu đề (lấy từ ảnh chụp spreadsheet) ---
+def get_worksheet_titles(sh, spreadsheet_id=None):
+    return get_spreadsheet_snapshot(sh, spreadsheet_id)["titles"]
+
+def config_sheet_exists(sh, row):
+    return row['Sheetname'] in get_worksheet_titles(sh, str(row.get('Spreadsheet_ID', '')).strip() or None)
+
+def get_sheet_headers(sh, sheet_ref):
+    sheet_name, spreadsheet_id = split_sheet_ref(sheet_ref)
+    return get_spreadsheet_snapshot(sh, spreadsheet_id)["headers"].get(sheet_name, [])
 
 # --- Lấy danh sách sheet nhập liệu từ Config ---
 def get_input_sheets(sh):
-    cache_key = "input_sheets"
-    if cache_key not in st.session_state or st.session_state.get(f"{cache_key}_timestamp", 0) < time.time() - 60:
-        try:
-            config = get_sheet_config(sh)
-            if not config:
-                return []
-            sheets = [row['Sheetname'] for row in config if row.get('Nhập') == 1]
-            existing_sheets = [ws.title for ws in sh.worksheets()]
-            valid_sheets = [s for s in sheets if s in existing_sheets]
-            if not valid_sheets:
-                st.warning("Không tìm thấy sheet nhập liệu nào hợp lệ theo cấu hình Config.")
-            st.session_state[cache_key] = valid_sheets
-            st.session_state[f"{cache_key}_timestamp"] = time.time()
-        except Exception as e:
-            st.error(f"Lỗi khi lấy danh sách sheet nhập liệu: {e}")
-            logger.error(f"Lỗi khi lấy danh sách sheet nhập liệu: {e}")
+    try:
+        config = get_sheet_config(sh)
+        if not config:
             return []
-    return st.session_state[cache_key]
+        # Một sheet có thể nằm trên nhiều spreadsheet (shard), chỉ liệt kê một lần
+        valid_sheets = list(dict.fromkeys(
+            row['Sheetname'] for row in config if row.get('Nhập') == 1 and config_sheet_exists(sh, row)
+        ))
+        if not valid_sheets:
+            st.warning("Không tìm thấy sheet nhập liệu nào hợp lệ theo cấu hình Config.")
+        return valid_sheets
+    except Exception as e:
+        st.error(f"Lỗi khi lấy danh sách sheet nhập liệu: {e}")
+        logger.error(f"Lỗi khi lấy danh sách sheet nhập liệu: {e}")
+        return []
 
 # --- Lấy danh sách sheet tra cứu từ Config ---
 def get_lookup_sheets(sh):
-    cache_key = "lookup_sheets"
-    if cache_key not in st.session_state or st.session_state.get(f"{cache_key}_timestamp", 0) < time.time() - 60:
-        try:
-            config = get_sheet_config(sh)
-            if not config:
-                return []
-            sheets = [row['Sheetname'] for row in config if row.get('Tìm kiếm') == 1]
-            existing_sheets = [ws.title for ws in sh.worksheets()]
-            valid_sheets = [s for s in sheets if s in existing_sheets]
-            if not valid_sheets:
-                st.warning("Không tìm thấy sheet tra cứu nào hợp lệ theo cấu hình Config.")
-            st.session_state[cache_key] = valid_sheets
-            st.session_state[f"{cache_key}_timestamp"] = time.time()
-        except Exception as e:
-            st.error(f"Lỗi khi lấy danh sách sheet tra cứu: {e}")
-            logger.error(f"Lỗi khi lấy danh sách sheet tra cứu: {e}")
+    try:
+        config = get_sheet_config(sh)
+        if not config:
             return []
-    return st.session_state[cache_key]
+        # Một sheet có thể nằm trên nhiều spreadsheet (shard), chỉ liệt kê một lần
+        valid_sheets = list(dict.fromkeys(
+            row['Sheetname'] for row in config if row.get('Tìm kiếm') == 1 and config_sheet_exists(sh, row)
+        ))
+        if not valid_sheets:
+            st.warning("Không tìm thấy sheet tra cứu nào hợp lệ theo cấu hình Config.")
+        return valid_sheets
+    except Exception as e:
+        st.error(f"Lỗi khi lấy danh sách sheet tra cứu: {e}")
+        logger.error(f"Lỗi khi lấy danh sách sheet tra cứu: {e}")
+        return []
 
 # --- Lấy danh sách sheet xem đã nhập từ Config ---
 def get_view_sheets(sh):
-    cache_key = "view_sheets"
-    if cache_key not in st.session_state or st.session_state.get(f"{cache_key}_timestamp", 0) < time.time() - 60:
-        try:
-            config = get_sheet_config(sh)
-            if not config:
-                return []
-            sheets = [row['Sheetname'] for row in config if row.get('Xem đã nhập') == 1]
-            existing_sheets = [ws.title for ws in sh.worksheets()]
-            valid_sheets = [s for s in sheets if s in existing_sheets]
-            if not valid_sheets:
-                st.warning("Không tìm thấy sheet xem dữ liệu nào hợp lệ theo cấu hình Config.")
-            st.session_state[cache_key] = valid_sheets
-            st.session_state[f"{cache_key}_timestamp"] = time.time()
-        except Exception as e:
-            st.error(f"Lỗi khi lấy danh sách sheet xem đã nhập: {e}")
-            logger.error(f"Lỗi khi lấy danh sách sheet xem đã nhập: {e}")
+    try:
+        config = get_sheet_config(sh)
+        if not config:
             return []
-    return st.session_state[cache_key]
+        # Một sheet có thể nằm trên nhiều spreadsheet (shard), chỉ liệt kê một lần
+        valid_sheets = list(dict.fromkeys(
+            row['Sheetname'] for row in config if row.get('Xem đã nhập') == 1 and config_sheet_exists(sh, row)
+        ))
+        if not valid_sheets:
+            st.warning("Không tìm thấy sheet xem dữ liệu nào hợp lệ theo cấu hình Config.")
+        return valid_sheets
+    except Exception as e:
+        st.error(f"Lỗi khi lấy danh sách sheet xem đã nhập: {e}")
+        logger.error(f"Lỗi khi lấy danh sách sheet xem đã nhập: {e}")
+        return []
 
 # --- Kiểm tra xem chuỗi có mã hóa SHA256 chưa ---
 def is_hashed(pw):
@@ -304,16 +540,12 @@ def is_strong_password(password):
     return True, ""
 
 # --- Lấy danh sách người dùng từ sheet "User" ---
-@retry(
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=1, min=2, max=10),
-    retry=retry_if_exception_type(gspread.exceptions.APIError)
-)
 def get_users(sh):
     try:
-        worksheet = sh.worksheet("User")
-        data = worksheet.get_all_records()
-        return data
+        users = get_spreadsheet_snapshot(sh)["User"]
+        if users is None:
+            raise gspread.exceptions.WorksheetNotFound("User")
+        return users
     except gspread.exceptions.APIError as e:
         if e.response.status_code == 429:
             st.warning("Hệ thống đang bận, vui lòng thử lại sau ít giây.")
@@ -332,19 +564,13 @@ def check_login(sh, username, password):
     hashed_input = hash_password(password)
     for user in users:
         stored_password = str(user.get('Password', ''))
-        if user.get('Username') == username:
-            if stored_password == password:
-                return user.get('Role', 'User'), True
-            if stored_password == hashed_input:
-                return user.get('Role', 'User'), False
+        if user.get('Username') == username and stored_password in (password, hashed_input):
+            # Chi nhánh (nếu có) dùng để chọn shard ghi dữ liệu; chỉ gán khi đăng nhập đúng
+            st.session_state.branch = str(user.get('Chi_nhanh', '')).strip()
+            return user.get('Role', 'User'), stored_password == password
     return None, False
 
 # --- Đổi mật khẩu ---
-@retry(
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=1, min=2, max=10),
-    retry=retry_if_exception_type(gspread.exceptions.APIError)
-)
 def change_password(sh, username, old_pw, new_pw):
     try:
         worksheet = sh.worksheet("User")
@@ -356,6 +582,9 @@ def change_password(sh, username, old_pw, new_pw):
             stored_password = str(user.get('Password', ''))
             if user.get('Username') == username and (stored_password == old_pw or stored_password == hashed_old):
                 worksheet.update_cell(idx + 2, 2, hashed_new)
+                note_spreadsheet_write(sh, "User")
+                # Ảnh chụp chứa sheet User không được cập nhật tại chỗ
+                get_refresher().expire(("snapshot", None))
                 return True
         return False
     except gspread.exceptions.APIError as e:
@@ -367,43 +596,61 @@ def change_password(sh, username, old_pw, new_pw):
         logger.error(f"Lỗi khi đổi mật khẩu: {e}")
         return False
 
+# --- Shard của một sheet: các dòng Config cùng Sheetname với Spreadsheet_ID khác nhau ---
+def get_sheet_shards(sh, sheet_name):
+    """Tham chiếu tới mọi worksheet chứa dữ liệu của sheet, theo thứ tự trong Config."""
+    refs = [make_sheet_ref(row['Sheetname'], row.get('Spreadsheet_ID'))
+            for row in get_sheet_config(sh) if row.get('Sheetname') == sheet_name]
+    return list(dict.fromkeys(refs)) or [sheet_name]
+
+def get_write_shard(sh, sheet_name):
+    """Shard nhận dữ liệu mới: dòng Nhập = 1 có cột Shard trùng năm hiện tại hoặc chi nhánh người dùng, nếu không thì dòng đầu tiên."""
+    rows = [row for row in get_sheet_config(sh) if row.get('Sheetname') == sheet_name and row.get('Nhập') == 1]
+    if not rows:
+        return sheet_name
+    shard_keys = {str(datetime.now(pytz.timezone('Asia/Ho_Chi_Minh')).year), str(st.session_state.get('branch', ''))} - {''}
+    for row in rows:
+        if str(row.get('Shard', '')).strip() in shard_keys:
+            return make_sheet_ref(row['Sheetname'], row.get('Spreadsheet_ID'))
+    return make_sheet_ref(rows[0]['Sheetname'], rows[0].get('Spreadsheet_ID'))
+
+# --- Cột hệ thống do ứng dụng ghi, không hiển thị trên form nhập ---
+SYSTEM_COLUMNS = ["Nguoi_nhap", "Thoi_gian_nhap", ID_COLUMN]
+
 # --- Lấy tiêu đề cột từ sheet, tách cột bắt buộc (*) ---
 def get_columns(sh, sheet_name):
-    cache_key = f"columns_{sheet_name}"
-    if cache_key not in st.session_state or st.session_state.get(f"{cache_key}_timestamp", 0) < time.time() - 60:
-        try:
-            worksheet = sh.worksheet(sheet_name)
-            headers = worksheet.row_values(1)
-            required_columns = [h for h in headers if h.endswith('*')]
-            optional_columns = [h for h in headers if not h.endswith('*') and h not in ["Nguoi_nhap", "Thoi_gian_nhap"]]
-            st.session_state[cache_key] = (required_columns, optional_columns)
-            st.session_state[f"{cache_key}_timestamp"] = time.time()
-        except gspread.exceptions.APIError as e:
-            if e.response.status_code == 429:
-                st.warning("Hệ thống đang bận, vui lòng thử lại sau ít giây.")
-            raise
-        except Exception as e:
-            st.error(f"Lỗi khi lấy tiêu đề cột: {e}")
-            logger.error(f"Lỗi khi lấy tiêu đề cột: {e}")
-            return [], []
-    return st.session_state[cache_key]
-
-# --- Kiểm tra và thêm cột Nguoi_nhap, Thoi_gian_nhap nếu chưa có ---
-@retry(
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=1, min=2, max=10),
-    retry=retry_if_exception_type(gspread.exceptions.APIError)
-)
+    try:
+        headers = get_sheet_headers(sh, get_write_shard(sh, sheet_name))
+        required_columns = [h for h in headers if h.endswith('*')]
+        optional_columns = [h for h in headers if not h.endswith('*') and h not in SYSTEM_COLUMNS]
+        return required_columns, optional_columns
+    except gspread.exceptions.APIError as e:
+        if e.response.status_code == 429:
+            st.warning("Hệ thống đang bận, vui lòng thử lại sau ít giây.")
+        raise
+    except Exception as e:
+        st.error(f"Lỗi khi lấy tiêu đề cột: {e}")
+        logger.error(f"Lỗi khi lấy tiêu đề cột: {e}")
+        return [], []
+
+# --- Kiểm tra và thêm cột Nguoi_nhap, Thoi_gian_nhap, Ma_ban_ghi nếu chưa có ---
 def ensure_columns(sh, sheet_name):
     try:
-        worksheet = sh.worksheet(sheet_name)
+        worksheet = open_worksheet(sh, sheet_name)
         headers = worksheet.row_values(1)
+        width = len(headers)
         if "Nguoi_nhap" not in headers:
             headers.append("Nguoi_nhap")
             worksheet.update_cell(1, len(headers), "Nguoi_nhap")
         if "Thoi_gian_nhap" not in headers:
             headers.append("Thoi_gian_nhap")
             worksheet.update_cell(1, len(headers), "Thoi_gian_nhap")
+        # Cột ẩn chứa mã bản ghi cố định, dùng để sửa đúng hàng dù sheet đã thêm/xóa hàng
+        if ID_COLUMN not in headers:
+            headers.append(ID_COLUMN)
+            worksheet.update_cell(1, len(headers), ID_COLUMN)
+        if len(headers) != width:
+            invalidate_spreadsheet(sh, split_sheet_ref(sheet_name)[1])
         return headers
     except gspread.exceptions.APIError as e:
         if e.response.status_code == 429:
@@ -414,27 +661,37 @@ def ensure_columns(sh, sheet_name):
         logger.error(f"Lỗi khi kiểm tra/thêm cột: {e}")
         return []
 
+# --- Tạo hàng theo thứ tự tiêu đề, điền các cột hệ thống ---
+def build_row(headers, data, username, record_id, current=None):
+    """Cột không có trong data lấy lại giá trị đang lưu (current) để bản sửa từ màn hình chỉ tải một số cột không xóa mất dữ liệu."""
+    # Đặt múi giờ Việt Nam (UTC+7)
+    vn_timezone = pytz.timezone('Asia/Ho_Chi_Minh')
+    current_time = datetime.now(vn_timezone).strftime("%d/%m/%Y %H:%M:%S")
+    system_values = {"Nguoi_nhap": username, "Thoi_gian_nhap": current_time, ID_COLUMN: record_id}
+    current = current or [''] * len(headers)
+    return [system_values[h] if h in system_values else data.get(h.rstrip('*'), data.get(h, current[i]))
+            for i, h in enumerate(headers)]
+
+def new_record_id():
+    return uuid.uuid4().hex[:16]
+
 # --- Thêm dữ liệu vào sheet ---
-@retry(
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=1, min=2, max=10),
-    retry=retry_if_exception_type(gspread.exceptions.APIError)
-)
 def add_data_to_sheet(sh, sheet_name, data, username):
+    """True nếu đã ghi, QUEUED nếu Google đang quá tải và bản ghi được xếp hàng gửi lại, False nếu lỗi."""
     try:
-        worksheet = sh.worksheet(sheet_name)
-        headers = ensure_columns(sh, sheet_name)
-        row_data = [data.get(header.rstrip('*'), '') for header in headers[:-2]]
-        row_data.append(username)
-        # Đặt múi giờ Việt Nam (UTC+7)
-        vn_timezone = pytz.timezone('Asia/Ho_Chi_Minh')
-        current_time = datetime.now(vn_timezone).strftime("%d/%m/%Y %H:%M:%S")
-        row_data.append(current_time)
-        worksheet.append_row(row_data)
-        # Xóa cache liên quan
-        for key in list(st.session_state.keys()):
-            if key.startswith(f"{sheet_name}_"):
-                del st.session_state[key]
+        sheet_ref = get_write_shard(sh, sheet_name)
+        record_id = new_record_id()
+        try:
+            worksheet = open_worksheet(sh, sheet_ref)
+            headers = ensure_columns(sh, sheet_ref)
+            row_data = build_row(headers, data, username, record_id)
+            response = worksheet.append_row(row_data)
+        except gspread.exceptions.APIError as e:
+            if is_unavailable(e) and queue_append(sh, sheet_ref, data, username, record_id):
+                return QUEUED
+            raise
+        note_sheet_append(sheet_ref, headers, response, row_data)
+        note_spreadsheet_write(sh, sheet_ref)
         return True
     except gspread.exceptions.APIError as e:
         if e.response.status_code == 429:
@@ -446,27 +703,188 @@ def add_data_to_sheet(sh, sheet_name, data, username):
         logger.error(f"Lỗi khi nhập liệu vào {sheet_name}: {str(e)}")
         return False
 
+# --- Ghi khi Google quá tải: xếp hàng để luồng nền gửi lại thay vì bắt người dùng chờ ---
+QUEUED = "queued"
+
+def queued_write_target(sh, sheet_ref):
+    """(book, tên sheet, tiêu đề) cho job ghi chạy ở luồng nền, lấy ở luồng chính; None nếu sheet chưa có đủ cột hệ thống."""
+    headers = get_sheet_headers(sh, sheet_ref)
+    if not set(SYSTEM_COLUMNS) <= set(headers):
+        return None
+    return get_spreadsheet(sh, sheet_ref), split_sheet_ref(sheet_ref)[0], headers
+
+def queued_write_done(sheet_ref, book):
+    """Hàm gọi sau khi job ghi xong: dữ liệu đệm của spreadsheet hết hiệu lực vì không được cập nhật tại chỗ."""
+    counters, tracker = get_write_counters(), get_revision_tracker()
+    spreadsheet_id = split_sheet_ref(sheet_ref)[1]
+
+    def done():
+        counters[sheet_ref] = counters.get(sheet_ref, 0) + 1
+        tracker.invalidate(spreadsheet_id, book)
+
+    return done
+
+def queue_append(sh, sheet_ref, data, username, record_id):
+    target = queued_write_target(sh, sheet_ref)
+    if target is None:
+        return None
+    book, sheet_name, headers = target
+    # Thoi_gian_nhap là lúc người dùng gửi, không phải lúc job chạy
+    row_data = build_row(headers, data, username, record_id)
+    done = queued_write_done(sheet_ref, book)
+
+    def append():
+        book.worksheet(sheet_name).append_row(row_data)
+        done()
+
+    return get_write_queue().submit(f"Thêm bản ghi {record_id} vào {sheet_ref}", append)
+
+def queue_update(sh, sheet_ref, data, username, record_id):
+    """Chỉ xếp hàng được bản ghi đã có Ma_ban_ghi: job tìm lại đúng hàng theo mã lúc gửi."""
+    target = queued_write_target(sh, sheet_ref) if record_id else None
+    if target is None:
+        return None
+    book, sheet_name, headers = target
+    id_col = headers.index(ID_COLUMN)
+    done = queued_write_done(sheet_ref, book)
+
+    def update():
+        worksheet = book.worksheet(sheet_name)
+        ids = worksheet.col_values(id_col + 1)
+        if record_id not in ids:
+            raise ValueError(f"Không còn bản ghi {record_id} trong {sheet_ref}")
+        row_number = ids.index(record_id) + 1
+        current = pad_row(worksheet.row_values(row_number), len(headers))
+        row_data = build_row(headers, data, username, record_id, current)
+        worksheet.update([row_data], f"A{row_number}:{gspread.utils.rowcol_to_a1(row_number, len(headers))}")
+        done()
+
+    return get_write_queue().submit(f"Sửa bản ghi {record_id} tại {sheet_ref}", update)
+
+# --- Kiểm tra trùng khi nhập (Config: Cot_kiem_trung, Chan_trung) ---
+def get_duplicate_rules(sh, sheet_name):
+    """([bộ cột khóa], chặn hay chỉ cảnh báo) của một sheet nhập liệu.
+
+    Cot_kiem_trung liệt kê các khóa cách nhau bởi dấu phẩy, khóa nhiều cột nối bằng dấu +,
+    ví dụ "So_CMT, Ho_ten+Dien_thoai". Chan_trung = 1 thì không cho lưu bản ghi trùng."""
+    for row in get_sheet_config(sh):
+        if row.get('Sheetname') == sheet_name:
+            value = str(row.get('Cot_kiem_trung', '')).strip()
+            keys = [tuple(column.strip().rstrip('*') for column in key.split('+') if column.strip())
+                    for key in value.split(',') if key.strip()]
+            return keys, str(row.get('Chan_trung', '')).strip() == '1'
+    return [], False
+
+def find_duplicates(sh, sheet_name, records):
+    """[(vị trí trong records, bộ cột khóa, [nơi trùng])] cho các bản ghi trùng khóa với dữ liệu đã có
+    hoặc với bản ghi đứng trước trong cùng lô. Tra trên chỉ mục trong bộ nhớ dùng chung, được cập nhật
+    sau mỗi lần ghi; chỉ đọc API (riêng các cột khóa) khi sheet chưa có trong bộ nhớ đệm."""
+    try:
+        keys, _ = get_duplicate_rules(sh, sheet_name)
+        if not keys:
+            return []
+        # Khách hàng đã chuyển sang sheet lưu trữ (rollover) vẫn bị tính là trùng khi nhập lại
+        sources = get_sheet_shards(sh, sheet_name) + [ref for ref, _, _ in get_archive_sheets(sh, sheet_name)]
+        datasets = {source: fresh_dataset(sh, source) for source in dict.fromkeys(sources)}
+        missing = [source for source, dataset in datasets.items() if dataset is None]
+        if missing:
+            columns = tuple(sorted({column for key in keys for column in key}))
+            datasets.update(load_sheet_datasets(sh, missing, columns=columns))
+        duplicates, batch = [], {}
+        for pos, record in enumerate(records):
+            for key in keys:
+                values = [record.get(column, '') for column in key]
+                matches = [f"hàng {idx + 2} sheet {split_sheet_ref(source)[0]}"
+                           for source, dataset in datasets.items() for idx in dataset.find_key(key, values)]
+                normalized = duplicate_key(values)
+                if normalized is not None and (key, normalized) in batch:
+                    matches.append(f"dòng {batch[(key, normalized)] + 1} của lô nhập")
+                if matches:
+                    duplicates.append((pos, key, matches))
+                if normalized is not None:
+                    batch.setdefault((key, normalized), pos)
+        return duplicates
+    except gspread.exceptions.APIError as e:
+        # Quy tắc chỉ cảnh báo thì không chặn việc ghi (có thể được xếp hàng) khi Google quá tải
+        if is_unavailable(e) and not get_duplicate_rules(sh, sheet_name)[1]:
+            logger.warning(f"Bỏ qua kiểm tra trùng tại {sheet_name} vì Google Sheets quá tải: {e}")
+            st.warning("Chưa kiểm tra được dữ liệu trùng vì Google Sheets đang quá tải.")
+            return []
+        if e.response.status_code == 429:
+            st.warning("Hệ thống đang bận, vui lòng thử lại sau ít giây.")
+        raise
+    except Exception as e:
+        st.error(f"Lỗi khi kiểm tra trùng dữ liệu: {e}")
+        logger.error(f"Lỗi khi kiểm tra trùng dữ liệu tại {sheet_name}: {e}")
+        return []
+
+def describe_duplicates(duplicates):
+    return "; ".join(f"{' + '.join(key)} trùng {', '.join(matches)}" for _, key, matches in duplicates)
+
+# --- Gợi ý nhập liệu (Config: Goi_y, các tên cột cách nhau bởi dấu phẩy) ---
+# Số gợi ý gửi xuống trình duyệt cho mỗi ô; trình duyệt tự lọc theo chữ đang gõ
+SUGGESTION_LIMIT = int(os.getenv("SUGGESTION_LIMIT", "200"))
+
+def get_suggestion_columns(sh, sheet_name):
+    """Tuple tên cột có gợi ý từ các giá trị đã nhập."""
+    for row in get_sheet_config(sh):
+        if row.get('Sheetname') == sheet_name:
+            value = str(row.get('Goi_y', '')).strip()
+            return tuple(column.strip().rstrip('*') for column in value.split(',') if column.strip())
+    return ()
+
+def get_suggestions(sh, sheet_name, columns, prefixes=None, limit=SUGGESTION_LIMIT):
+    """{cột: [giá trị gợi ý]} bắt đầu bằng tiền tố của cột trong prefixes (không có thì mọi giá trị), xếp theo
+    tần suất, gộp từ mọi shard. Chỉ mục gợi ý (tìm nhị phân theo tiền tố) nằm trong dataset dùng chung và được
+    cập nhật sau mỗi lần ghi; sheet chưa có trong bộ nhớ đệm thì chỉ tải các cột gợi ý."""
+    prefixes = prefixes or {}
+    try:
+        if not columns:
+            return {}
+        sources = get_sheet_shards(sh, sheet_name)
+        datasets = {source: fresh_dataset(sh, source) for source in sources}
+        missing = [source for source, dataset in datasets.items() if dataset is None]
+        if missing:
+            datasets.update(load_sheet_datasets(sh, missing, columns=tuple(sorted(columns))))
+        result = {}
+        for column in columns:
+            counts = {}
+            for dataset in datasets.values():
+                for value, count in dataset.suggestions(column, prefixes.get(column, ''), limit) or []:
+                    counts[value] = counts.get(value, 0) + count
+            result[column] = sorted(counts, key=counts.get, reverse=True)[:limit]
+        return result
+    except gspread.exceptions.APIError as e:
+        if e.response.status_code == 429:
+            st.warning("Hệ thống đang bận, vui lòng thử lại sau ít giây.")
+        raise
+    except Exception as e:
+        st.error(f"Lỗi khi lấy gợi ý nhập liệu: {e}")
+        logger.error(f"Lỗi khi lấy gợi ý nhập liệu tại {sheet_name}: {e}")
+        return {}
+
 # --- Cập nhật bản ghi trong sheet ---
-@retry(
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=1, min=2, max=10),
-    retry=retry_if_exception_type(gspread.exceptions.APIError)
-)
 def update_data_in_sheet(sh, sheet_name, row_idx, data, username):
+    """Cập nhật bản ghi tại row_idx (vị trí lúc hiển thị); vị trí được xác minh lại bằng Ma_ban_ghi.
+
+    Trả về như add_data_to_sheet (QUEUED khi Google quá tải và bản ghi có Ma_ban_ghi)."""
     try:
-        worksheet = sh.worksheet(sheet_name)
-        headers = ensure_columns(sh, sheet_name)
-        row_data = [data.get(header.rstrip('*'), '') for header in headers[:-2]]
-        row_data.append(username)
-        # Đặt múi giờ Việt Nam (UTC+7)
-        vn_timezone = pytz.timezone('Asia/Ho_Chi_Minh')
-        current_time = datetime.now(vn_timezone).strftime("%d/%m/%Y %H:%M:%S")
-        row_data.append(current_time)
-        worksheet.update(f"A{row_idx + 2}:{chr(65 + len(headers) - 1)}{row_idx + 2}", [row_data])
-        # Xóa cache liên quan
-        for key in list(st.session_state.keys()):
-            if key.startswith(f"{sheet_name}_"):
-                del st.session_state[key]
+        try:
+            worksheet = open_worksheet(sh, sheet_name)
+            headers = ensure_columns(sh, sheet_name)
+            row_number, current = resolve_row_number(sh, worksheet, sheet_name, headers, row_idx, data.get(ID_COLUMN, ''))
+            if row_number is None:
+                st.error("Bản ghi đã bị xóa hoặc thay đổi bởi người khác. Vui lòng bấm Làm mới và thử lại.")
+                return False
+            # Bản ghi cũ chưa có mã thì được cấp mã ở lần sửa đầu tiên
+            row_data = build_row(headers, data, username, data.get(ID_COLUMN) or new_record_id(), current)
+            worksheet.update([row_data], f"A{row_number}:{gspread.utils.rowcol_to_a1(row_number, len(headers))}")
+        except gspread.exceptions.APIError as e:
+            if is_unavailable(e) and queue_update(sh, sheet_name, data, username, data.get(ID_COLUMN, '')):
+                return QUEUED
+            raise
+        note_sheet_update(sheet_name, headers, row_number - 2, row_data)
+        note_spreadsheet_write(sh, sheet_name)
         return True
     except gspread.exceptions.APIError as e:
         if e.response.status_code == 429:
@@ -478,48 +896,317 @@ def update_data_in_sheet(sh, sheet_name, row_idx, data, username):
         logger.error(f"Lỗi khi cập nhật dữ liệu tại {sheet_name}, row {row_idx}: {str(e)}")
         return False
 
+def resolve_row_number(sh, worksheet, sheet_name, headers, row_idx, record_id):
+    """Trả về (số hàng tính cả tiêu đề, giá trị đang lưu của hàng), xác minh bằng một lần đọc đúng hàng đó.
+
+    Vị trí dự kiến lấy từ chỉ mục Ma_ban_ghi của dataset; nếu hàng đã dịch chuyển thì tìm lại
+    trên riêng cột Ma_ban_ghi. Bản ghi chưa có mã được đối chiếu với nội dung đang lưu trong dataset."""
+    datasets = cached_datasets(sheet_name)
+    position = next((dataset.position_of(record_id) for dataset in datasets
+                     if dataset.position_of(record_id) is not None), None)
+    row_number = (row_idx if position is None else position) + 2
+    current = pad_row(worksheet.row_values(row_number), len(headers))
+    id_col = headers.index(ID_COLUMN)
+    if record_id:
+        if current[id_col] == record_id:
+            return row_number, current
+        ids = worksheet.col_values(id_col + 1)
+        if record_id in ids:
+            row_number = ids.index(record_id) + 1
+            invalidate_sheet_dataset(sheet_name)
+            return row_number, pad_row(worksheet.row_values(row_number), len(headers))
+        return None, None
+    for dataset in datasets:
+        if (row_idx < len(dataset) and set(dataset.headers) <= set(headers)
+                and project_row(headers, current, dataset.headers) == dataset.rows[row_idx]):
+            return row_number, current
+    return None, None
+
+def pad_row(row, width):
+    return row + [''] * (width - len(row))
+
+def project_row(headers, row, columns):
+    """Lấy các giá trị của row (theo thứ tự headers) ứng với danh sách cột columns."""
+    return [row[headers.index(column)] for column in columns]
+
+# --- Dataset dùng chung giữa các phiên (mỗi worksheet một bản, nằm trong bộ nhớ đệm chung) ---
+def fetch_sheet_values(worksheet):
+    return worksheet.get_all_values(value_render_option='FORMATTED_VALUE')
+
+def column_letter(col):
+    return re.sub(r'\d', '', gspread.utils.rowcol_to_a1(1, col))
+
+def fetch_projected_values(book, sheet_name, headers, columns):
+    """Như fetch_sheet_values nhưng chỉ đọc các cột trong columns (cùng cột bắt buộc và cột hệ thống),
+    trong một lần values_batch_get; headers là hàng tiêu đề đã đọc trước."""
+    wanted = set(columns) | set(SYSTEM_COLUMNS)
+    indexes = [idx for idx, header in enumerate(headers) if header.endswith('*') or header.rstrip('*') in wanted]
+    if not indexes:
+        return [headers]
+    response = book.values_batch_get(
+        [gspread.utils.absolute_range_name(sheet_name, f"{column_letter(idx + 1)}2:{column_letter(idx + 1)}") for idx in indexes],
+        params={'majorDimension': 'COLUMNS', 'valueRenderOption': 'FORMATTED_VALUE'}
+    )
+    # Mỗi cột bị cắt ô trống ở cuối nên độ dài có thể khác nhau
+    column_values = [(value_range.get('values') or [[]])[0] for value_range in response.get('valueRanges', [])]
+    height = max((len(values) for values in column_values), default=0)
+    rows = [[values[r] if r < len(values) else '' for values in column_values] for r in range(height)]
+    return [[headers[idx] for idx in indexes]] + rows
+
+# Số luồng tối đa khi đọc song song nhiều shard/sheet
+FANOUT_WORKERS = int(os.getenv("SHEETS_FANOUT_WORKERS", "8"))
+
+@st.cache_resource
+def get_dataset_projections():
+    """Tham chiếu sheet -> các bộ cột đã tải riêng, để ghi/xóa cập nhật cả dataset chỉ có một số cột."""
+    return {}
+
+@st.cache_resource
+def get_pending_loads():
+    """Khóa dataset -> future của lần tải đã quá thời hạn chờ nhưng chưa xong, để lần gọi sau dùng lại
+    thay vì tải thêm một lần."""
+    return {}
+
+def dataset_key(sheet_ref, columns=None):
+    return ("dataset", sheet_ref) if columns is None else ("dataset", sheet_ref, columns)
+
+def dataset_keys(sheet_ref):
+    """Khóa dataset đủ cột và các bản chỉ có một số cột của một worksheet."""
+    return [dataset_key(sheet_ref)] + [dataset_key(sheet_ref, columns) for columns in get_dataset_projections().get(sheet_ref, ())]
+
+def cached_datasets(sheet_ref):
+    """Các dataset (đủ cột trước) của một worksheet đang có trong bộ nhớ đệm."""
+    cache = get_shared_cache()
+    return [dataset for dataset in (cache.get(key) for key in dataset_keys(sheet_ref)) if dataset is not None]
+
+def fresh_dataset(sh, sheet_ref):
+    """Dataset đủ cột dùng được ngay (không cần đọc sheet) nếu có."""
+    return get_refresher().lookup(dataset_key(sheet_ref), sheet_revision(sh, split_sheet_ref(sheet_ref)[1]))
+
+def make_dataset_loader(book, sheet_ref, columns=None):
+    """Hàm tải dataset dùng cả ở luồng nền: đọc worksheet rồi đồng bộ vào dataset cũ (chỉ lập chỉ mục phần mới thêm)."""
+    sheet_name, spreadsheet_id = split_sheet_ref(sheet_ref)
+
+    def read(headers):
+        if columns is None:
+            return fetch_sheet_values(book.worksheet(sheet_name))
+        headers = headers if headers is not None else book.worksheet(sheet_name).row_values(1)
+        return fetch_projected_values(book, sheet_name, headers, columns)
+
+    fetch = shared_loader(book, spreadsheet_id, f"values|{sheet_name}|{columns}", read)
+
+    def load(previous, headers=None):
+        values = fetch(headers)
+        if previous is None or not previous.sync(values):
+            return SheetDataset.from_values(values)
+        return previous
+
+    return load
+
+def load_sheet_datasets(sh, sheet_refs, force=False, columns=None, timeout=None):
+    """Trả về {ref: dataset}; dataset thiếu hoặc cũ quá MAX_STALENESS_SECONDS được tải song song ngay,
+    dataset mới cũ được dùng tiếp trong khi luồng nền tải bản mới.
+
+    columns (tuple tên cột) chỉ tải các cột đó cùng cột bắt buộc và cột hệ thống.
+    timeout (giây): dataset chưa tải xong sau thời hạn này không có trong kết quả; việc tải vẫn chạy tiếp
+    và kết quả được lưu vào bộ nhớ đệm cho lần sau."""
+    refresher = get_refresher()
+    datasets, stale = {}, []
+    for sheet_ref in dict.fromkeys(sheet_refs):
+        # Lấy phiên bản trước khi đọc để thay đổi xảy ra trong lúc đọc không bị bỏ sót
+        revision = sheet_revision(sh, split_sheet_ref(sheet_ref)[1])
+        dataset = None if force else refresher.lookup(dataset_key(sheet_ref, columns), revision)
+        if dataset is None:
+            stale.append((sheet_ref, revision))
+        else:
+            datasets[sheet_ref] = dataset
+    if stale:
+        # Mở spreadsheet và đọc tiêu đề ở luồng chính (dùng st.cache_resource), luồng phụ chỉ gọi API
+        books = {sheet_ref: get_spreadsheet(sh, sheet_ref) for sheet_ref, _ in stale}
+        headers = {sheet_ref: get_sheet_headers(sh, sheet_ref) for sheet_ref, _ in stale} if columns is not None else {}
+        loaders = {sheet_ref: make_dataset_loader(books[sheet_ref], sheet_ref, columns) for sheet_ref, _ in stale}
+        sources = {sheet_ref: revision_source(split_sheet_ref(sheet_ref)[1], books[sheet_ref]) for sheet_ref, _ in stale}
+        cache, projections, pending = get_shared_cache(), get_dataset_projections(), get_pending_loads()
+
+        def store(sheet_ref, revision, dataset):
+            if columns is not None:
+                projections.setdefault(sheet_ref, set()).add(columns)
+            return refresher.store(dataset_key(sheet_ref, columns), dataset, revision, loaders[sheet_ref], sources[sheet_ref],
+                                   group=split_sheet_ref(sheet_ref)[1])
+
+        def store_late(sheet_ref, revision, future):
+            try:
+                store(sheet_ref, revision, future.result())
+            except Exception as e:
+                logger.warning(f"Lỗi khi tải nền {sheet_ref}: {e}")
+            finally:
+                pending.pop(dataset_key(sheet_ref, columns), None)
+
+        futures = {}
+        if not force:
+            for sheet_ref, _ in stale:
+                future = pending.get(dataset_key(sheet_ref, columns))
+                if future is not None:
+                    futures[sheet_ref] = future
+        to_load = [sheet_ref for sheet_ref, _ in stale if sheet_ref not in futures]
+        if to_load:
+            pool = ThreadPoolExecutor(max_workers=max(1, min(len(to_load), FANOUT_WORKERS)))
+            for sheet_ref in to_load:
+                futures[sheet_ref] = pool.submit(loaders[sheet_ref], cache.peek(dataset_key(sheet_ref, columns)), headers.get(sheet_ref))
+            pool.shutdown(wait=False)
+        wait(futures.values(), timeout=timeout)
+        for sheet_ref, revision in stale:
+            future = futures[sheet_ref]
+            if future.done():
+                try:
+                    datasets[sheet_ref] = store(sheet_ref, revision, future.result())
+                except gspread.exceptions.APIError as e:
+                    datasets[sheet_ref] = unavailable_fallback(dataset_key(sheet_ref, columns), e)
+            elif sheet_ref in to_load:
+                # Quá thời hạn: lưu vào bộ nhớ đệm khi tải xong (luồng phụ không dùng st.*)
+                pending[dataset_key(sheet_ref, columns)] = future
+                future.add_done_callback(lambda done, sheet_ref=sheet_ref, revision=revision: store_late(sheet_ref, revision, done))
+    note_data_freshness([dataset_key(sheet_ref, columns) for sheet_ref in datasets])
+    return datasets
+
+def get_sheet_dataset(sh, sheet_name, force=False):
+    """Trả về dataset của một worksheet (tên hoặc tham chiếu shard)."""
+    return load_sheet_datasets(sh, [sheet_name], force=force)[sheet_name]
+
+def invalidate_sheet_dataset(sheet_name):
+    cache = get_shared_cache()
+    cache.pop(dataset_key(sheet_name))
+    for columns in get_dataset_projections().pop(sheet_name, set()):
+        cache.pop(dataset_key(sheet_name, columns))
+
+def note_sheet_append(sheet_name, headers, response, row_data):
+    """Cập nhật các dataset sau append_row; nếu vị trí hàng hoặc tiêu đề không khớp thì buộc tải lại."""
+    cache = get_shared_cache()
+    updated_range = (response or {}).get('updates', {}).get('updatedRange', '')
+    match = re.search(r'![A-Z]+(\d+)', updated_range)
+    for key in dataset_keys(sheet_name):
+        dataset = cache.peek(key)
+        if dataset is None:
+            continue
+        same_headers = dataset.headers == headers if len(key) == 2 else set(dataset.headers) <= set(headers)
+        if match and same_headers and int(match.group(1)) - 2 == len(dataset):
+            dataset.append(project_row(headers, row_data, dataset.headers))
+            cache.resize(key)
+        else:
+            invalidate_sheet_dataset(sheet_name)
+            return
+
+def note_sheet_update(sheet_name, headers, row_idx, row_data):
+    cache = get_shared_cache()
+    for key in dataset_keys(sheet_name):
+        dataset = cache.peek(key)
+        if dataset is None:
+            continue
+        same_headers = dataset.headers == headers if len(key) == 2 else set(dataset.headers) <= set(headers)
+        if same_headers and row_idx < len(dataset):
+            dataset.update(row_idx, project_row(headers, row_data, dataset.headers))
+            cache.resize(key)
+        else:
+            invalidate_sheet_dataset(sheet_name)
+            return
+
+# --- Kết quả lọc (mảng vị trí hàng) trong bộ nhớ đệm của phiên ---
+def cached_view(key, compute):
+    """Trả về mảng vị trí hàng đã lọc; khóa gồm phiên bản dataset nên dữ liệu mới tự làm mất hiệu lực."""
+    cache = get_session_cache()
+    view = cache.get(("view",) + key)
+    if view is None:
+        view = cache.set(("view",) + key, array('l', compute()))
+    return view
+
+def keyword_view(key, dataset, keyword, column, positions):
+    """cached_view của bộ lọc từ khóa trên positions() (key không gồm từ khóa). Khi từ khóa mới chứa từ khóa
+    vừa lọc trước đó trong cùng key (người dùng gõ thêm), chỉ lọc lại trong kết quả cũ thay vì quét lại từ đầu."""
+    cache = get_session_cache()
+    last = cache.get(("last_keyword",) + key)
+    base = last[1] if last and last[0] in keyword else None
+    view = cached_view(key + (keyword,), lambda: dataset.filter_keyword(positions() if base is None else base, keyword, column))
+    cache.set(("last_keyword",) + key, (keyword, view))
+    return view
+
+# --- Chỉ dựng DataFrame cho trang kết quả đang xem; tổng số kết quả lấy từ độ dài mảng vị trí ---
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "100"))
+
+def page_of(parts, page, page_size=SEARCH_PAGE_SIZE):
+    """Cắt [(nguồn, dataset, vị trí hoặc DataFrame)] lấy trang page (từ 0) theo thứ tự nối các phần."""
+    start, stop = page * page_size, (page + 1) * page_size
+    result, offset = [], 0
+    for source, dataset, view in parts:
+        lo, hi = max(start - offset, 0), min(stop - offset, len(view))
+        if lo < hi:
+            result.append((source, dataset, view.iloc[lo:hi] if isinstance(view, pd.DataFrame) else view[lo:hi]))
+        offset += len(view)
+    return result
+
+def page_selector(total, key, page_size=SEARCH_PAGE_SIZE):
+    """Chọn trang khi kết quả nhiều hơn một trang; trả về số trang (từ 0)."""
+    pages = max(1, -(-total // page_size))
+    page = 0
+    if pages > 1:
+        page = st.number_input(f"Trang (trên {pages})", min_value=1, max_value=pages, value=1, step=1, key=key) - 1
+    shown = min(page_size, total - page * page_size)
+    st.caption(f"Hiển thị {page * page_size + 1}-{page * page_size + shown} trên tổng {total} kết quả." if total else "")
+    return page
+
+# --- Cột chuẩn hóa để tìm kiếm không dấu: tạo một lần cho mỗi dataset, sau đó cập nhật theo từng hàng ---
+def prepare_search(key, dataset):
+    """Tạo cột chuẩn hóa nếu chưa có và đo lại dung lượng dataset trong bộ nhớ đệm dùng chung."""
+    if dataset.ensure_search_index():
+        get_shared_cache().resize(key)
+
+# --- Cột hiển thị trên màn hình xem (cột Cot_hien_thi trong Config, các tên cột cách nhau bởi dấu phẩy) ---
+def get_view_columns(sh, sheet_name):
+    """Tuple tên cột cần hiển thị, None nếu Config không giới hạn (tải mọi cột)."""
+    for row in get_sheet_config(sh):
+        value = str(row.get('Cot_hien_thi', '')).strip()
+        if row.get('Sheetname') == sheet_name and value:
+            return tuple(column.strip().rstrip('*') for column in value.split(',') if column.strip())
+    return None
+
+# --- Lọc hàng của một dataset cho màn hình xem ---
+def select_user_rows(dataset, owner, start_date=None, end_date=None, keyword=''):
+    """Vị trí hàng theo người nhập (None = mọi người), khoảng ngày và từ khóa (không phân biệt dấu)."""
+    positions = dataset.select(username=owner, start_date=start_date, end_date=end_date)
+    if keyword:
+        positions = dataset.filter_keyword(positions, keyword)
+    return positions
+
 # --- Lấy dữ liệu đã nhập, hỗ trợ admin thấy tất cả ---
 def get_user_data(sh, sheet_name, username, role, start_date=None, end_date=None, keyword=None):
+    """Trả về (headers, [(sheet, dataset, các vị trí hàng)]), tự đọc thêm các sheet lưu trữ nếu khoảng ngày chạm tới."""
     try:
-        cache_key = f"{sheet_name}_{username}_{role}_{start_date}_{end_date}_{keyword}"
-        worksheet = sh.worksheet(sheet_name)
-        row_count = len(worksheet.get_all_records())
-        cached_row_count = st.session_state.get(f"{cache_key}_row_count", 0)
-
-        if cache_key not in st.session_state or row_count > cached_row_count:
-            @retry(
-                stop=stop_after_attempt(3),
-                wait=wait_exponential(multiplier=1, min=2, max=10),
-                retry=retry_if_exception_type(gspread.exceptions.APIError)
-            )
-            def fetch_data():
-                data = worksheet.get_all_records(value_render_option='FORMATTED_VALUE')
-                headers = worksheet.row_values(1)
-                # Ép kiểu tất cả dữ liệu thành chuỗi
-                for row in data:
-                    for key in row:
-                        row[key] = str(row[key])
-                return headers, data
-
-            headers, data = fetch_data()
-            filtered_data = []
-            for idx, row in enumerate(data):
-                if role.lower() == 'admin' or row.get("Nguoi_nhap") == username:
-                    if start_date and end_date:
-                        try:
-                            entry_time = datetime.strptime(row.get("Thoi_gian_nhap", ""), "%d/%m/%Y %H:%M:%S")
-                            if not (start_date <= entry_time.date() <= end_date):
-                                continue
-                        except ValueError:
-                            continue
-                    if keyword:
-                        keyword = keyword.lower()
-                        if not any(keyword in str(value).lower() for value in row.values()):
-                            continue
-                    filtered_data.append((idx, row))
-            st.session_state[cache_key] = (headers, filtered_data)
-            st.session_state[f"{cache_key}_row_count"] = row_count
-        return st.session_state[cache_key]
+        # Người dùng thường chỉ duyệt phân vùng hàng của mình, kết hợp chỉ mục thời gian
+        owner = None if role.lower() == 'admin' else username
+        keyword = normalize_text(keyword) if keyword else ''
+        sources = get_sheet_shards(sh, sheet_name)
+        if start_date and end_date:
+            sources += [ref for ref, archive_start, archive_end in get_archive_sheets(sh, sheet_name)
+                        if archive_start <= end_date and start_date <= archive_end]
+        # Đọc song song mọi shard và sheet lưu trữ rồi gộp kết quả; chỉ tải các cột được hiển thị
+        columns = get_view_columns(sh, sheet_name)
+        datasets = load_sheet_datasets(sh, sources, columns=columns)
+        headers, results, malformed_count = [], [], 0
+        for source, dataset in datasets.items():
+            key = ("user_data", source, id(dataset), dataset.version, owner, start_date, end_date)
+            selected = lambda: cached_view(key, lambda: select_user_rows(dataset, owner, start_date, end_date))
+            if keyword:
+                prepare_search(dataset_key(source, columns), dataset)
+                view = keyword_view(key, dataset, keyword, None, selected)
+            else:
+                view = selected()
+            headers = headers or dataset.headers
+            if start_date and end_date:
+                malformed_count += sum(1 for idx in view if dataset.entry_times[idx] is None)
+            if view:
+                results.append((source, dataset, view))
+        if malformed_count:
+            st.warning(f"Có {malformed_count} bản ghi thiếu hoặc sai định dạng Thoi_gian_nhap (dd/mm/YYYY HH:MM:SS). Các bản ghi này luôn được hiển thị để kiểm tra và sửa.")
+        return headers, results
     except gspread.exceptions.APIError as e:
         if e.response.status_code == 429:
             st.warning("Hệ thống đang bận, vui lòng thử lại sau ít giây.")
@@ -529,41 +1216,725 @@ def get_user_data(sh, sheet_name, username, role, start_date=None, end_date=None
         logger.error(f"Lỗi khi lấy dữ liệu đã nhập: {e}")
         return [], []
 
+# --- Thống kê số bản ghi theo người nhập × ngày × sheet (bảng đếm trong dataset, cập nhật theo từng lần ghi) ---
+STATS_COLUMNS = ["Sheet", "Nguoi_nhap", "Ngay", "So_ban_ghi"]
+
+def get_entry_stats(sh, start_date, end_date):
+    """Trả về (DataFrame STATS_COLUMNS của mọi sheet nhập liệu trong khoảng ngày, số bản ghi sai định dạng ngày).
+
+    Lấy từ bảng đếm của dataset nên chi phí chỉ phụ thuộc số người × số ngày, không phụ thuộc số hàng; chỉ đọc
+    API (cột bắt buộc và cột hệ thống) với sheet chưa có trong bộ nhớ đệm."""
+    try:
+        rows, malformed, keys = [], 0, []
+        for sheet_name in get_input_sheets(sh):
+            sources = get_sheet_shards(sh, sheet_name)
+            sources += [ref for ref, archive_start, archive_end in get_archive_sheets(sh, sheet_name)
+                        if archive_start <= end_date and start_date <= archive_end]
+            datasets = {source: fresh_dataset(sh, source) for source in sources}
+            missing = [source for source, dataset in datasets.items() if dataset is None]
+            if missing:
+                datasets.update(load_sheet_datasets(sh, missing, columns=()))
+            keys += [dataset_key(source, () if source in missing else None) for source in sources]
+            for dataset in datasets.values():
+                for (user, day), count in dataset.daily_counts().items():
+                    if day is None:
+                        malformed += count
+                    elif start_date <= day <= end_date:
+                        rows.append((sheet_name, user, day, count))
+        note_data_freshness(keys)
+        return pd.DataFrame(rows, columns=STATS_COLUMNS), malformed
+    except gspread.exceptions.APIError as e:
+        if e.response.status_code == 429:
+            st.warning("Hệ thống đang bận, vui lòng thử lại sau ít giây.")
+        raise
+    except Exception as e:
+        st.error(f"Lỗi khi lấy thống kê nhập liệu: {e}")
+        logger.error(f"Lỗi khi lấy thống kê nhập liệu: {e}")
+        return pd.DataFrame(columns=STATS_COLUMNS), 0
+
+# --- Dữ liệu cho lưới sửa: DataFrame từ kết quả get_user_data và các hàng người dùng đã sửa ---
+def build_view_dataframe(user_data):
+    """DataFrame gồm row_idx, các cột dữ liệu (string[pyarrow], lấy thẳng từ dataset) và sheet nguồn của từng hàng."""
+    frames = []
+    for sheet, dataset, positions in user_data:
+        df = dataset.frame(positions)
+        df.insert(0, 'row_idx', positions)
+        df['sheet'] = sheet
+        frames.append(df)
+    return concat_frames(frames)
+
+def concat_frames(frames):
+    """Nối các DataFrame kết quả; một phần duy nhất thì dùng luôn, không sao chép."""
+    if len(frames) == 1:
+        return frames[0]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+def changed_grid_rows(df, updated_df):
+    """Các hàng (Series) của updated_df khác với hàng gốc cùng (row_idx, sheet) trong df."""
+    changed = []
+    if updated_df.empty or updated_df.equals(df):
+        return changed
+    for _, row in updated_df.iterrows():
+        row_idx = row['row_idx']
+        if pd.isna(row_idx) or not str(row_idx).isdigit():
+            continue  # Bỏ qua hàng không hợp lệ
+        matches = df[(df['row_idx'] == row_idx) & (df['sheet'] == row['sheet'])]
+        original_row = matches.iloc[0] if not matches.empty else None
+        # So theo giá trị: lưới trả về cột object còn df dùng string[pyarrow]
+        if original_row is not None and row.drop(['row_idx', 'sheet']).tolist() != original_row.drop(['row_idx', 'sheet']).tolist():
+            changed.append(row)
+    return changed
+
+# --- Tìm kiếm trên một cột: chỉ tải cột đó rồi tải riêng các hàng khớp ---
+# Quá số hàng khớp này thì tải cả sheet sẽ rẻ hơn đọc từng hàng
+PROJECTED_SEARCH_MAX_ROWS = int(os.getenv("PROJECTED_SEARCH_MAX_ROWS", "200"))
+
+def search_column_values(sh, sheet_ref, keyword, column):
+    """Trả về (headers, các hàng khớp) hoặc None nếu nên tải cả sheet (cột không có hoặc quá nhiều hàng khớp)."""
+    sheet_name, spreadsheet_id = split_sheet_ref(sheet_ref)
+    revision = sheet_revision(sh, spreadsheet_id)
+    # Kết quả không được cập nhật tại chỗ khi ghi nên khóa gồm cả số lần ứng dụng đã ghi vào sheet
+    key = ("column_search", sheet_ref, get_write_counters().get(sheet_ref, 0), keyword, column)
+    result = session_cached(key, revision)
+    if result is not None:
+        return result
+    book = get_spreadsheet(sh, sheet_ref)
+    worksheet = book.worksheet(sheet_name)
+    headers = get_sheet_headers(sh, sheet_ref)
+    col = next((idx for idx, header in enumerate(headers) if header.rstrip('*') == column), None)
+    if col is None:
+        return None
+    keyword = normalize_text(keyword)
+    row_numbers = [n for n, value in enumerate(worksheet.col_values(col + 1)[1:], start=2) if keyword in normalize_text(value)]
+    if len(row_numbers) > PROJECTED_SEARCH_MAX_ROWS:
+        return None
+    rows = []
+    if row_numbers:
+        last = column_letter(len(headers))
+        response = book.values_batch_get(
+            [gspread.utils.absolute_range_name(sheet_name, f"A{n}:{last}{n}") for n in row_numbers],
+            params={'valueRenderOption': 'FORMATTED_VALUE'}
+        )
+        rows = [pad_row((value_range.get('values') or [[]])[0], len(headers)) for value_range in response.get('valueRanges', [])]
+    return session_store(key, revision, (headers, rows))
+
 # --- Tìm kiếm trong sheet ---
-def search_in_sheet(sh, sheet_name, keyword, column=None):
-    cache_key = f"search_{sheet_name}_{keyword}_{column}"
-    if cache_key not in st.session_state or st.session_state.get(f"{cache_key}_timestamp", 0) < time.time() - 60:
-        try:
-            worksheet = sh.worksheet(sheet_name)
-            # Lấy dữ liệu với giá trị dạng chuỗi
-            data = worksheet.get_all_records(value_render_option='FORMATTED_VALUE')
-            headers = worksheet.row_values(1)
-            # Ép kiểu tất cả dữ liệu thành chuỗi
-            for row in data:
-                for key in row:
-                    row[key] = str(row[key])
+def search_in_sheet(sh, sheet_name, keyword, column=None, page=0):
+    """Trả về (headers, DataFrame trang page của các hàng khớp, cột kiểu string[pyarrow], tổng số hàng khớp)."""
+    try:
+        keyword = normalize_text(keyword) if keyword else ''
+        clean_column = None if column in (None, "Tất cả") else column.rstrip('*')
+        sources = get_sheet_shards(sh, sheet_name)
+        headers, results, full_sources = [], [], []
+        for source in sources:
+            # Tìm trên một cột khi chưa có bản đủ cột trong bộ nhớ đệm: chỉ tải cột đó và các hàng khớp
+            if clean_column and keyword and fresh_dataset(sh, source) is None:
+                projected = search_column_values(sh, source, keyword, clean_column)
+                if projected is not None:
+                    headers = headers or projected[0]
+                    if projected[1]:
+                        results.append((source, None, pd.DataFrame(projected[1], columns=projected[0], dtype="string[pyarrow]")))
+                    continue
+            full_sources.append(source)
+        datasets = load_sheet_datasets(sh, full_sources) if full_sources else {}
+        if not full_sources:
+            note_data_freshness([])
+        for source, dataset in datasets.items():
+            headers = headers or dataset.headers
             if not keyword:
-                st.session_state[cache_key] = (headers, data)
+                results.append((source, dataset, range(len(dataset))))
+                continue
+            prepare_search(dataset_key(source), dataset)
+            view = keyword_view(
+                ("search", source, id(dataset), dataset.version, clean_column), dataset, keyword, clean_column,
+                lambda: range(len(dataset))
+            )
+            if view:
+                results.append((source, dataset, view))
+        frames = [view if dataset is None else dataset.frame(view) for _, dataset, view in page_of(results, page)]
+        return headers, concat_frames(frames), sum(len(view) for _, _, view in results)
+    except gspread.exceptions.APIError as e:
+        if e.response.status_code == 429:
+            st.warning("Hệ thống đang bận, vui lòng thử lại sau ít giây.")
+        raise
+    except Exception as e:
+        st.error(f"Lỗi khi tìm kiếm dữ liệu: {e}")
+        logger.error(f"Lỗi khi tìm kiếm dữ liệu: {e}")
+        return [], pd.DataFrame(), 0
+
+# --- Tìm kiếm trên mọi sheet tra cứu cùng lúc ---
+GLOBAL_SEARCH_OPTION = "🔎 Tất cả sheet tra cứu"
+# Thời hạn (giây) chờ các sheet tải song song; sheet chậm hơn được bỏ qua ở lần tìm này
+GLOBAL_SEARCH_TIMEOUT = float(os.getenv("GLOBAL_SEARCH_TIMEOUT", "10"))
+
+def global_search(sh, keyword, column=None, page=0):
+    """Tìm từ khóa trên mọi sheet tra cứu (kể cả các shard), tải song song qua bộ nhớ đệm.
+
+    Trả về (DataFrame trang page của kết quả có cột Sheet, xếp hạng theo độ khớp rồi theo thứ tự sheet,
+    tổng số kết quả, danh sách sheet chưa tải xong trong GLOBAL_SEARCH_TIMEOUT)."""
+    try:
+        keyword = normalize_text(keyword) if keyword else ''
+        if not keyword:
+            return pd.DataFrame(), 0, []
+        clean_column = None if column in (None, "Tất cả") else column.rstrip('*')
+        sources = {source: sheet_name for sheet_name in get_lookup_sheets(sh) for source in get_sheet_shards(sh, sheet_name)}
+        datasets = load_sheet_datasets(sh, list(sources), timeout=GLOBAL_SEARCH_TIMEOUT)
+        cache = get_session_cache()
+        results, scores = [], []
+        for source in sources:
+            dataset = datasets.get(source)
+            if dataset is None or (clean_column and dataset.column_index(clean_column) is None):
+                continue
+            prepare_search(dataset_key(source), dataset)
+            key = ("search", source, id(dataset), dataset.version, clean_column)
+            view = keyword_view(key, dataset, keyword, clean_column, lambda: range(len(dataset)))
+            if not view:
+                continue
+            score = cache.get(("scores",) + key + (keyword,))
+            if score is None:
+                score = cache.set(("scores",) + key + (keyword,), dataset.match_scores(view, keyword, clean_column))
+            results.append((source, dataset, view))
+            scores.append(score)
+        pending = list(dict.fromkeys(sources[source] for source in sources if source not in datasets))
+        total = sum(len(view) for _, _, view in results)
+        if not total:
+            return pd.DataFrame(), 0, pending
+        # Xếp hạng mọi kết quả trên mảng điểm (thứ tự sheet, rồi thứ tự hàng khi cùng điểm), chỉ dựng trang cần xem
+        part = np.repeat(np.arange(len(results)), [len(view) for _, _, view in results])
+        offset = np.concatenate([np.arange(len(view)) for _, _, view in results])
+        ranked = np.argsort(-np.concatenate(scores), kind="stable")[page * SEARCH_PAGE_SIZE:(page + 1) * SEARCH_PAGE_SIZE]
+        frames = []
+        for index, (source, dataset, view) in enumerate(results):
+            rank = np.flatnonzero(part[ranked] == index)
+            if not len(rank):
+                continue
+            # Bỏ dấu * của cột bắt buộc để cột cùng tên ở các sheet gộp được với nhau
+            frame = dataset.frame([view[i] for i in offset[ranked[rank]]]).rename(columns=lambda h: h.rstrip('*'))
+            frame.insert(0, "Sheet", sources[source])
+            frame["_rank"] = rank
+            frames.append(frame)
+        df = concat_frames(frames).sort_values("_rank").drop(columns=["_rank"]).reset_index(drop=True)
+        return df, total, pending
+    except gspread.exceptions.APIError as e:
+        if e.response.status_code == 429:
+            st.warning("Hệ thống đang bận, vui lòng thử lại sau ít giây.")
+        raise
+    except Exception as e:
+        st.error(f"Lỗi khi tìm kiếm trên các sheet tra cứu: {e}")
+        logger.error(f"Lỗi khi tìm kiếm trên các sheet tra cứu: {e}")
+        return pd.DataFrame(), 0, []
+
+# --- Sheet lưu trữ theo quý (đăng ký trong Config qua cột Luu_tru_cua, Tu_ngay, Den_ngay) ---
+ARCHIVE_CONFIG_COLUMNS = ["Luu_tru_cua", "Tu_ngay", "Den_ngay", "Spreadsheet_ID"]
+
+def get_archive_sheets(sh, sheet_name):
+    """Danh sách (tham chiếu sheet lưu trữ, từ ngày, đến ngày) của một sheet dữ liệu."""
+    archives = []
+    for row in get_sheet_config(sh):
+        if row.get('Luu_tru_cua') == sheet_name:
+            archive_start = parse_config_date(row.get('Tu_ngay', ''))
+            archive_end = parse_config_date(row.get('Den_ngay', ''))
+            if archive_start and archive_end:
+                archives.append((make_sheet_ref(row['Sheetname'], row.get('Spreadsheet_ID')), archive_start, archive_end))
+    return archives
+
+def ensure_config_columns(sh, columns):
+    worksheet = sh.worksheet("Config")
+    headers = worksheet.row_values(1)
+    width = len(headers)
+    for column in columns:
+        if column not in headers:
+            headers.append(column)
+            worksheet.update_cell(1, len(headers), column)
+    if len(headers) != width:
+        invalidate_spreadsheet(sh)
+    return worksheet, headers
+
+def rollover_sheet(sh, sheet_ref, cutoff_date):
+    """Chuyển các hàng nhập trước đầu quý chứa cutoff_date của một shard sang sheet lưu trữ theo quý
+    (tạo trong cùng spreadsheet).
+
+    Trả về số hàng đã chuyển, hoặc None nếu có lỗi."""
+    sheet_name, spreadsheet_id = split_sheet_ref(sheet_ref)
+    try:
+        cutoff_date = quarter_start(cutoff_date)
+        book = get_spreadsheet(sh, sheet_ref)
+        dataset = get_sheet_dataset(sh, sheet_ref, force=True)
+        # Hàng có Thoi_gian_nhap sai định dạng được giữ lại ở sheet chính
+        old_positions = [p for p in dataset.select(start_date=date.min, end_date=cutoff_date - timedelta(days=1))
+                         if dataset.entry_times[p] is not None]
+        if not old_positions:
+            return 0
+        groups = {}
+        for pos in old_positions:
+            groups.setdefault(quarter_start(dataset.entry_times[pos].date()), []).append(pos)
+
+        existing_sheets = {ws.title: ws for ws in book.worksheets()}
+        config = get_sheet_config(sh)
+        registered = {make_sheet_ref(row.get('Sheetname'), row.get('Spreadsheet_ID')) for row in config}
+        lookup_flag = next((row.get('Tìm kiếm', 0) for row in config if row.get('Sheetname') == sheet_name), 0)
+        config_ws, config_headers = ensure_config_columns(sh, ARCHIVE_CONFIG_COLUMNS)
+
+        for start, positions in sorted(groups.items()):
+            archive_name = f"{sheet_name}_{quarter_label(start)}"
+            rows = [dataset.rows[p] for p in positions]
+            archive_ws = existing_sheets.get(archive_name)
+            if archive_ws is None:
+                archive_ws = book.add_worksheet(title=archive_name, rows=len(rows) + 1, cols=len(dataset.headers))
+                archive_ws.update([dataset.headers] + rows, "A1")
             else:
-                keyword = keyword.lower()
-                if column == "Tất cả":
-                    filtered_data = [row for row in data if any(keyword in str(value).lower() for value in row.values())]
-                else:
-                    clean_column = column.rstrip('*')
-                    filtered_data = [row for row in data if keyword in str(row.get(clean_column, '')).lower()]
-                st.session_state[cache_key] = (headers, filtered_data)
-            st.session_state[f"{cache_key}_timestamp"] = time.time()
+                archived_values = archive_ws.get_all_values()
+                if not archived_values or archived_values[0] != dataset.headers:
+                    raise ValueError(f"Tiêu đề sheet lưu trữ {archive_name} khác sheet {sheet_name}")
+                # Chạy lại sau khi bị gián đoạn: không chép trùng các hàng đã có trong sheet lưu trữ
+                archived = {tuple(row) for row in archived_values[1:]}
+                rows = [row for row in rows if tuple(row) not in archived]
+                if rows:
+                    archive_ws.append_rows(rows, value_input_option='RAW')
+            archive_ref = make_sheet_ref(archive_name, spreadsheet_id)
+            if archive_ref not in registered:
+                values = {
+                    'Spreadsheet_ID': spreadsheet_id or '',
+                    'Sheetname': archive_name, 'Tìm kiếm': lookup_flag, 'Nhập': 0, 'Xem đã nhập': 0,
+                    'Luu_tru_cua': sheet_name,
+                    'Tu_ngay': start.strftime("%d/%m/%Y"), 'Den_ngay': quarter_end(start).strftime("%d/%m/%Y"),
+                }
+                config_ws.append_row([values.get(header, '') for header in config_headers], value_input_option='RAW')
+            invalidate_sheet_dataset(archive_ref)
+
+        # Xóa các hàng đã lưu trữ trong một lần gọi, từ dưới lên để vị trí không bị lệch
+        runs = []
+        for pos in sorted(old_positions):
+            if runs and runs[-1][1] == pos + 1:
+                runs[-1][1] = pos + 2
+            else:
+                runs.append([pos + 1, pos + 2])
+        hot_ws = book.worksheet(sheet_name)
+        book.batch_update({"requests": [
+            {"deleteDimension": {"range": {"sheetId": hot_ws.id, "dimension": "ROWS", "startIndex": start, "endIndex": end}}}
+            for start, end in reversed(runs)
+        ]})
+        invalidate_sheet_dataset(sheet_ref)
+        # Config và danh sách worksheet đã đổi
+        invalidate_spreadsheet(sh)
+        if spreadsheet_id:
+            invalidate_spreadsheet(sh, spreadsheet_id)
+        logger.info(f"Đã lưu trữ {len(old_positions)} bản ghi của {sheet_ref} trước {cutoff_date}")
+        return len(old_positions)
+    except gspread.exceptions.APIError as e:
+        if e.response.status_code == 429:
+            st.warning("Hệ thống đang bận, vui lòng thử lại sau ít giây.")
+        raise
+    except Exception as e:
+        st.error(f"Lỗi khi lưu trữ dữ liệu: {e}")
+        logger.error(f"Lỗi khi lưu trữ dữ liệu {sheet_ref}: {e}")
+        return None
+
+# --- Tự động lưu trữ mỗi ngày một lần (bật bằng ARCHIVE_AFTER_DAYS) ---
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "0"))
+
+@st.cache_resource
+def get_rollover_state():
+    return {"last_run": None}
+
+def run_scheduled_rollover(sh):
+    """Chạy khi admin mở ứng dụng lần đầu trong ngày để người dùng thường không phải chờ."""
+    state = get_rollover_state()
+    today = datetime.now(pytz.timezone('Asia/Ho_Chi_Minh')).date()
+    if not ARCHIVE_AFTER_DAYS or state["last_run"] == today:
+        return
+    state["last_run"] = today
+    cutoff = today - timedelta(days=ARCHIVE_AFTER_DAYS)
+    for sheet_name in get_input_sheets(sh):
+        moved = sum(rollover_sheet(sh, sheet_ref, cutoff) or 0 for sheet_ref in get_sheet_shards(sh, sheet_name))
+        if moved:
+            st.info(f"Đã tự động lưu trữ {moved} bản ghi cũ của sheet {sheet_name}.")
+
+# --- Google quá tải (429/5xx) hoặc bộ ngắt đang mở: dừng phần giao diện đang chạy thay vì hiện lỗi ---
+def stop_when_unavailable(section):
+    @wraps(section)
+    def run(*args, **kwargs):
+        try:
+            return section(*args, **kwargs)
         except gspread.exceptions.APIError as e:
-            if e.response.status_code == 429:
-                st.warning("Hệ thống đang bận, vui lòng thử lại sau ít giây.")
-            raise
-        except Exception as e:
-            st.error(f"Lỗi khi tìm kiếm dữ liệu: {e}")
-            logger.error(f"Lỗi khi tìm kiếm dữ liệu: {e}")
-            return [], []
-    return st.session_state[cache_key]
+            if not is_unavailable(e):
+                raise
+            logger.warning(f"Dừng {section.__name__} vì Google Sheets quá tải: {e}")
+            st.info("Phần này tạm dừng trong lúc Google Sheets quá tải và sẽ hiển thị lại khi kết nối ổn định.")
+    return run
+
+# --- Các phần giao diện chạy lại độc lập (st.fragment): thao tác trong một phần không chạy lại các phần khác ---
+@st.fragment
+@stop_when_unavailable
+def input_section(sh):
+    """Phần nhập liệu; chạy lại riêng khi người dùng thao tác trong phần này."""
+    st.subheader("📝 Nhập liệu")
+    input_sheets = get_input_sheets(sh)
+    if not input_sheets:
+        st.error("Không tìm thấy sheet nhập liệu hợp lệ.")
+    else:
+        selected_sheet = st.selectbox("Chọn sheet để nhập liệu", input_sheets, key="input_sheet")
+        required_columns, optional_columns = get_columns(sh, selected_sheet)
+        column_formats = get_column_formats(sh, selected_sheet)
+        form_columns = [header.rstrip('*') for header in required_columns + optional_columns]
+        suggestion_columns = [column for column in get_suggestion_columns(sh, selected_sheet)
+                              if column in form_columns and column_formats.get(column, 'text') == 'text']
+        # Ô tìm gợi ý nằm ngoài form nên gõ xong là phần nhập liệu chạy lại và tra chỉ mục theo tiền tố
+        prefixes = {}
+        if suggestion_columns:
+            for box, column in zip(st.columns(len(suggestion_columns)), suggestion_columns):
+                prefixes[column] = box.text_input(
+                    f"Tìm gợi ý {column}",
+                    key=f"{selected_sheet}_{column}_prefix",
+                    placeholder="Gõ vài chữ đầu rồi Enter"
+                )
+        suggestions = get_suggestions(sh, selected_sheet, tuple(suggestion_columns), prefixes)
+        if required_columns or optional_columns:
+            with st.form(f"input_form_{selected_sheet}"):
+                form_data = {}
+                for header in required_columns:
+                    clean_header = header.rstrip('*')
+                    st.markdown(f'<span class="required-label">{clean_header} (bắt buộc)</span>', unsafe_allow_html=True)
+                    format_type = column_formats.get(clean_header, 'text')
+                    if format_type == 'date':
+                        form_data[clean_header] = st.date_input(
+                            label=clean_header,
+                            label_visibility="collapsed",
+                            key=f"{selected_sheet}_{clean_header}_input",
+                            value=None,
+                            format="DD/MM/YYYY"
+                        )
+                    elif format_type == 'number':
+                        form_data[clean_header] = st.text_input(
+                            label=clean_header,
+                            label_visibility="collapsed",
+                            key=f"{selected_sheet}_{clean_header}_input",
+                            help="Chỉ nhập số"
+                        )
+                    elif clean_header in suggestions:
+                        # Chọn giá trị đã có hoặc gõ giá trị mới
+                        form_data[clean_header] = st.selectbox(
+                            label=clean_header,
+                            options=suggestions[clean_header],
+                            index=None,
+                            accept_new_options=True,
+                            label_visibility="collapsed",
+                            key=f"{selected_sheet}_{clean_header}_input"
+                        )
+                    else:
+                        form_data[clean_header] = st.text_input(
+                            label=clean_header,
+                            label_visibility="collapsed",
+                            key=f"{selected_sheet}_{clean_header}_input"
+                        )
+                for header in optional_columns:
+                    clean_header = header.rstrip('*')
+                    format_type = column_formats.get(clean_header, 'text')
+                    if format_type == 'date':
+                        form_data[clean_header] = st.date_input(
+                            label=clean_header,
+                            label_visibility="collapsed",
+                            key=f"{selected_sheet}_{clean_header}_input",
+                            value=None,
+                            format="DD/MM/YYYY"
+                        )
+                    elif format_type == 'number':
+                        form_data[clean_header] = st.text_input(
+                            label=clean_header,
+                            label_visibility="collapsed",
+                            key=f"{selected_sheet}_{clean_header}_input",
+                            placeholder=f"{clean_header} (tùy chọn, chỉ nhập số)",
+                            help="Chỉ nhập số"
+                        )
+                    elif clean_header in suggestions:
+                        form_data[clean_header] = st.selectbox(
+                            label=clean_header,
+                            options=suggestions[clean_header],
+                            index=None,
+                            accept_new_options=True,
+                            placeholder=f"{clean_header} (tùy chọn, chọn hoặc gõ mới)",
+                            label_visibility="collapsed",
+                            key=f"{selected_sheet}_{clean_header}_input"
+                        )
+                    else:
+                        form_data[clean_header] = st.text_input(
+                            label=clean_header,
+                            placeholder=f"{clean_header} (tùy chọn)",
+                            label_visibility="collapsed",
+                            key=f"{selected_sheet}_{clean_header}_input"
+                        )
+                submit_data = st.form_submit_button("Gửi")
+
+                if submit_data:
+                    missing_required = []
+                    validated_data = {}
+                    # Validate các trường bắt buộc
+                    for header in required_columns:
+                        clean_header = header.rstrip('*')
+                        format_type = column_formats.get(clean_header, 'text')
+                        value = form_data.get(clean_header, '')
+                        if format_type == 'date':
+                            if value is None:
+                                st.error(f"Trường {clean_header} không được để trống.")
+                                missing_required.append(clean_header)
+                            else:
+                                validated_data[clean_header] = value.strftime("%d/%m/%Y")
+                        elif format_type == 'number':
+                            if not value:
+                                st.error(f"Trường {clean_header} không được để trống.")
+                                missing_required.append(clean_header)
+                            elif not re.match(r'^\d+$', str(value)):
+                                st.error(f"Trường {clean_header} chỉ được nhập số.")
+                                missing_required.append(clean_header)
+                            else:
+                                validated_data[clean_header] = str(value)
+                        else:
+                            is_valid, result = validate_input(value, clean_header)
+                            if not is_valid:
+                                st.error(result)
+                                missing_required.append(clean_header)
+                            else:
+                                validated_data[clean_header] = result
+                    # Nếu có trường bắt buộc bị thiếu, dừng lại và không lưu
+                    if missing_required:
+                        st.error(f"Vui lòng nhập các trường bắt buộc: {', '.join(missing_required)}")
+                        return  # Dừng xử lý, không lưu dữ liệu
+                    # Không validate các trường không bắt buộc, chỉ lấy giá trị
+                    for header in optional_columns:
+                        clean_header = header.rstrip('*')
+                        format_type = column_formats.get(clean_header, 'text')
+                        value = form_data.get(clean_header, '')
+                        if format_type == 'date':
+                            validated_data[clean_header] = value.strftime("%d/%m/%Y") if value else ''
+                        elif format_type == 'number':
+                            if value and not re.match(r'^\d+$', str(value)):
+                                st.error(f"Trường {clean_header} chỉ được nhập số.")
+                                return
+                            validated_data[clean_header] = str(value) if value else ''
+                        else:
+                            validated_data[clean_header] = value if value else ''
+                    # Kiểm tra trùng trên chỉ mục trong bộ nhớ trước khi ghi
+                    duplicates = find_duplicates(sh, selected_sheet, [validated_data])
+                    if duplicates:
+                        if get_duplicate_rules(sh, selected_sheet)[1]:
+                            st.error(f"Không lưu vì dữ liệu bị trùng: {describe_duplicates(duplicates)}")
+                            return
+                        st.warning(f"Dữ liệu có thể bị trùng: {describe_duplicates(duplicates)}")
+                    # Lưu dữ liệu nếu không có lỗi
+                    result = add_data_to_sheet(sh, selected_sheet, validated_data, st.session_state.username)
+                    if result == QUEUED:
+                        st.info("⏳ Google Sheets đang quá tải: dữ liệu đã được xếp hàng và sẽ tự động lưu trong ít phút.")
+                    elif result:
+                        st.success("🎉 Dữ liệu đã được nhập thành công!")
+                    else:
+                        st.error("Lỗi khi nhập dữ liệu. Vui lòng kiểm tra log và thử lại.")
+
+@st.fragment
+@stop_when_unavailable
+def view_section(sh):
+    """Phần xem và sửa dữ liệu đã nhập; đổi bộ lọc hay sửa ô chỉ chạy lại phần này."""
+    st.subheader("📊 Xem và sửa dữ liệu đã nhập")
+    view_sheets = get_view_sheets(sh)
+    if not view_sheets:
+        st.error("Không tìm thấy sheet xem dữ liệu hợp lệ.")
+    else:
+        selected_view_sheet = st.selectbox("Chọn sheet để xem", view_sheets, key="view_sheet")
+        col1, col2 = st.columns(2)
+        with col1:
+            start_date = st.date_input("Từ ngày", value=datetime.now().date() - timedelta(days=90), key="start_date")
+        with col2:
+            end_date = st.date_input("Đến ngày", value=datetime.now().date(), key="end_date")
+        # Gõ từ khóa (Enter hoặc rời ô nhập) là lọc luôn, không cần bấm Áp dụng bộ lọc
+        search_keyword = st.text_input("Tìm kiếm bản ghi", key="view_search_keyword")
+        if search_keyword.strip():
+            st.session_state.filter_applied = True
+
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("Áp dụng bộ lọc", key="apply_filter"):
+                st.session_state.filter_applied = True
+        with col2:
+            if st.button("Làm mới", key="refresh_data"):
+                # Mọi shard và sheet lưu trữ của sheet đang xem đều được tải lại
+                for sheet_ref in get_sheet_shards(sh, selected_view_sheet) + [ref for ref, _, _ in get_archive_sheets(sh, selected_view_sheet)]:
+                    invalidate_sheet_dataset(sheet_ref)
+                st.session_state.filter_applied = True
+
+        if 'filter_applied' in st.session_state and st.session_state.filter_applied:
+            headers, user_data = get_user_data(
+                sh, selected_view_sheet, st.session_state.username, st.session_state.role, start_date, end_date, search_keyword
+            )
+            show_data_freshness()
+            if headers and user_data:
+                # Lưới chỉ dựng và gửi một trang; tổng số bản ghi lấy từ các mảng vị trí
+                total = sum(len(view) for _, _, view in user_data)
+                page_key = f"view_page|{selected_view_sheet}|{start_date}|{end_date}|{normalize_text(search_keyword)}"
+                pages = max(1, -(-total // SEARCH_PAGE_SIZE))
+                if int(st.session_state.get(page_key, 1)) > pages:
+                    st.session_state[page_key] = pages
+                page = page_selector(total, page_key)
+                df = clean_dataframe(build_view_dataframe(page_of(user_data, page)))
+
+                # Tạo grid với inline editing
+                gb = GridOptionsBuilder.from_dataframe(df)
+                for col in df.columns:
+                    if col not in ['row_idx', 'sheet', ID_COLUMN]:
+                        gb.configure_column(
+                            col,
+                            minWidth=200,
+                            autoSize=True,
+                            wrapText=True,
+                            autoHeight=True,
+                            editable=True  # Bật chỉnh sửa trực tiếp
+                        )
+                    else:
+                        gb.configure_column(col, hide=True)
+                gb.configure_grid_options(
+                    domLayout='autoHeight',
+                    suppressHorizontalScroll=False,
+                    suppressColumnVirtualisation=False,
+                    autoSizeColumnsMode='fitCellContents',
+                    enableRangeSelection=True,
+                    rowSelection='multiple',
+                    enableCellTextSelection=True
+                )
+                grid_response = AgGrid(
+                    df,
+                    gridOptions=gb.build(),
+                    update_mode=GridUpdateMode.VALUE_CHANGED,
+                    data_return_mode=DataReturnMode.AS_INPUT,
+                    height=400 if len(df) < 10 else 600,
+                    fit_columns_on_grid_load=True,
+                    allow_unsafe_jscode=True,
+                    custom_css={"#gridToolBar": {"display": "none"}},
+                )
+
+                # Lấy dữ liệu đã chỉnh sửa
+                updated_df = pd.DataFrame(grid_response['data'])
+                for row in changed_grid_rows(df, updated_df):
+                    row_idx = row['row_idx']
+                    sheet_name = row['sheet']
+                    if sheet_name not in get_sheet_shards(sh, selected_view_sheet):
+                        st.warning(f"Bản ghi thuộc sheet lưu trữ {sheet_name} chỉ được xem, không sửa.")
+                        continue
+                    updated_data = row.drop(['row_idx', 'sheet']).to_dict()
+                    # Validate dữ liệu trước khi cập nhật
+                    missing_required = []
+                    validated_data = {}
+                    required_columns, _ = get_columns(sh, sheet_name)
+                    for header in required_columns:
+                        clean_header = header.rstrip('*')
+                        value = updated_data.get(header, updated_data.get(clean_header, ''))
+                        is_valid, result = validate_input(value, clean_header)
+                        if not is_valid:
+                            st.error(result)
+                            return
+                        validated_data[clean_header] = result
+                        if not value:
+                            missing_required.append(clean_header)
+                    for header in updated_data:
+                        if header.rstrip('*') not in validated_data:
+                            is_valid, result = validate_input(updated_data.get(header, ''), header)
+                            validated_data[header.rstrip('*')] = result if is_valid else ''
+                    if missing_required:
+                        st.error(f"Vui lòng nhập các trường bắt buộc: {', '.join(missing_required)}")
+                        return
+                    else:
+                        result = update_data_in_sheet(sh, sheet_name, int(row_idx), validated_data, st.session_state.username)
+                        if result == QUEUED:
+                            st.info(f"⏳ Google Sheets đang quá tải: bản sửa #{int(row_idx) + 2} đã được xếp hàng và sẽ tự động lưu trong ít phút.")
+                        elif result:
+                            st.success(f"🎉 Bản ghi #{int(row_idx) + 2} đã được cập nhật thành công!", icon="✅")
+                        else:
+                            st.error("Lỗi khi cập nhật dữ liệu. Vui lòng kiểm tra log và thử lại.")
+                            return
+            else:
+                st.info("Không có dữ liệu nào được nhập trong khoảng thời gian hoặc từ khóa này.")
+
+@st.fragment
+@stop_when_unavailable
+def stats_section(sh):
+    """Trang thống kê nhập liệu (quản trị viên)."""
+    st.subheader("📊 Thống kê nhập liệu")
+    col1, col2 = st.columns(2)
+    with col1:
+        stats_start = st.date_input("Từ ngày", value=datetime.now().date() - timedelta(days=30), key="stats_start")
+    with col2:
+        stats_end = st.date_input("Đến ngày", value=datetime.now().date(), key="stats_end")
+    stats, malformed = get_entry_stats(sh, stats_start, stats_end)
+    show_data_freshness()
+    if malformed:
+        st.warning(f"Có {malformed} bản ghi thiếu hoặc sai định dạng Thoi_gian_nhap, không được tính theo ngày.")
+    if stats.empty:
+        st.info("Không có bản ghi nào được nhập trong khoảng thời gian này.")
+    else:
+        stats_sheet = st.selectbox("Sheet", ["Tất cả"] + sorted(stats["Sheet"].unique()), key="stats_sheet")
+        if stats_sheet != "Tất cả":
+            stats = stats[stats["Sheet"] == stats_sheet]
+        st.metric("Tổng số bản ghi", int(stats["So_ban_ghi"].sum()))
+        st.markdown("**Theo người nhập và sheet**")
+        st.dataframe(stats.pivot_table(index="Nguoi_nhap", columns="Sheet", values="So_ban_ghi", aggfunc="sum",
+                                       fill_value=0, margins=True, margins_name="Tổng"))
+        st.markdown("**Theo ngày**")
+        by_day = stats.pivot_table(index="Ngay", columns="Nguoi_nhap", values="So_ban_ghi", aggfunc="sum", fill_value=0)
+        st.bar_chart(by_day)
+        st.dataframe(by_day.sort_index(ascending=False))
+
+@st.fragment
+@stop_when_unavailable
+def search_section(sh):
+    """Phần tìm kiếm; chạy lại riêng khi đổi sheet, cột hay từ khóa."""
+    st.subheader("🔍 Tìm kiếm")
+    lookup_sheets = get_lookup_sheets(sh)
+    if not lookup_sheets:
+        st.error("Không tìm thấy sheet tra cứu hợp lệ.")
+    else:
+        selected_lookup_sheet = st.selectbox("Chọn sheet để tìm kiếm", lookup_sheets + [GLOBAL_SEARCH_OPTION], key="lookup_sheet")
+        search_all = selected_lookup_sheet == GLOBAL_SEARCH_OPTION
+        headers = []
+        for lookup_sheet in (lookup_sheets if search_all else [selected_lookup_sheet]):
+            required, optional = get_columns(sh, lookup_sheet)
+            headers.extend(h for h in [h.rstrip('*') for h in required] + optional if h not in headers)
+        search_column = st.selectbox("Chọn cột để tìm kiếm", ["Tất cả"] + headers, key="search_column")
+        # Kết quả cập nhật theo từ khóa (mỗi lần Enter hoặc rời ô nhập chỉ chạy lại phần này); nút Tìm kiếm
+        # với từ khóa trống liệt kê cả sheet
+        keyword = st.text_input("Nhập từ khóa tìm kiếm", key="search_keyword", placeholder="Gõ từ khóa rồi nhấn Enter")
+        clicked = st.button("Tìm kiếm", key="search_button")
+        if clicked:
+            st.session_state.search_active = True
+        if not (keyword.strip() or st.session_state.get("search_active")):
+            return
+        page_key = f"search_page|{selected_lookup_sheet}|{search_column}|{normalize_text(keyword)}"
+        if search_all and not keyword.strip():
+            if clicked:
+                st.warning("Vui lòng nhập từ khóa để tìm trên tất cả sheet tra cứu.")
+            return
+
+        def run_search(page):
+            if search_all:
+                search_results, total, pending = global_search(sh, keyword, search_column, page)
+                if pending:
+                    st.warning(f"Chưa tải xong sheet: {', '.join(pending)}. Kết quả của các sheet này sẽ có ở lần tìm sau.")
+                return search_results, total
+            return search_in_sheet(sh, selected_lookup_sheet, keyword, search_column, page)[1:]
+
+        page = max(0, int(st.session_state.get(page_key, 1)) - 1)
+        search_results, total = run_search(page)
+        if page and total and search_results.empty:
+            # Dữ liệu thay đổi làm số trang ít đi: quay về trang đầu
+            st.session_state[page_key] = 1
+            search_results, total = run_search(0)
+        show_data_freshness()
+        if total and not search_results.empty:
+            page_selector(total, page_key)
+            df = search_results.drop(columns=[ID_COLUMN], errors='ignore')
+            df = clean_dataframe(df)
+            st.dataframe(df)
+        else:
+            st.info("Không tìm thấy kết quả nào khớp với từ khóa.")
 
 # --- Giao diện chính ---
+@stop_when_unavailable
 def main():
     if 'login' not in st.session_state:
         st.session_state.login = False
@@ -586,6 +1957,10 @@ def main():
     if not sh:
         return
 
+    # Thông báo của lần chạy trước (đăng nhập, đăng xuất, đổi mật khẩu) hiện sau st.rerun() thay vì ngủ chờ người dùng đọc
+    for kind, message in st.session_state.pop("flash", []):
+        getattr(st, kind)(message)
+
     if st.session_state.lockout_time > time.time():
         st.error(f"Tài khoản bị khóa. Vui lòng thử lại sau {int(st.session_state.lockout_time - time.time())} giây.")
         return
@@ -601,6 +1976,20 @@ def main():
             st.session_state.selected_function = func
     if st.sidebar.button("Hiển thị tất cả", key="show_all"):
         st.session_state.selected_function = "all"
+    if st.session_state.login and st.session_state.role.lower() == 'admin':
+        if st.sidebar.button("Lưu trữ dữ liệu", key="nav_archive"):
+            st.session_state.selected_function = "Lưu trữ dữ liệu"
+        if st.sidebar.button("Thống kê nhập liệu", key="nav_stats"):
+            st.session_state.selected_function = "Thống kê nhập liệu"
+    if st.session_state.login and st.session_state.role.lower() == 'admin':
+        with st.sidebar.expander("Bộ nhớ đệm"):
+            st.json({"shared": get_shared_cache().stats(), "session": get_session_cache().stats(),
+                     "revisions": get_revision_tracker().stats(), "refresher": get_refresher().stats(),
+                     "cross_process": get_shared_store().stats() if get_shared_store() is not None else None})
+        with st.sidebar.expander("Kết nối Google Sheets"):
+            st.json(transport_stats())
+        with st.sidebar.expander("Bộ ngắt mạch và hàng đợi ghi"):
+            st.json({"breakers": get_breakers().stats(), "write_queue": get_write_queue().stats()})
 
     st.title("Ứng dụng quản lý nhập liệu - Agribank")
 
@@ -625,10 +2014,9 @@ def main():
                     st.session_state.login_attempts = 0
                     st.session_state.show_change_password = force_change_password
                     st.session_state.force_change_password = force_change_password
-                    st.success(f"Đăng nhập thành công với quyền: {role}")
+                    st.session_state.flash = [("success", f"Đăng nhập thành công với quyền: {role}")]
                     if force_change_password:
-                        st.warning("Mật khẩu của bạn chưa được mã hóa. Vui lòng đổi mật khẩu ngay!")
-                    time.sleep(1)
+                        st.session_state.flash.append(("warning", "Mật khẩu của bạn chưa được mã hóa. Vui lòng đổi mật khẩu ngay!"))
                     st.rerun()
                 else:
                     st.session_state.login_attempts += 1
@@ -644,8 +2032,7 @@ def main():
             st.session_state.show_change_password = False
             st.session_state.force_change_password = False
             st.session_state.selected_function = "Nhập liệu"
-            st.success("Đã đăng xuất!")
-            time.sleep(1)
+            st.session_state.flash = [("success", "Đã đăng xuất!")]
             st.rerun()
 
         if st.session_state.selected_function in ["all", "Đổi mật khẩu"] or st.session_state.force_change_password:
@@ -668,265 +2055,49 @@ def main():
                                 st.error(msg)
                             else:
                                 if change_password(sh, st.session_state.username, old_password, new_password):
-                                    st.success("🎉 Đổi mật khẩu thành công! Vui lòng đăng nhập lại.")
+                                    st.session_state.flash = [("success", "🎉 Đổi mật khẩu thành công! Vui lòng đăng nhập lại.")]
                                     st.session_state.login = False
                                     st.session_state.username = ''
                                     st.session_state.role = ''
                                     st.session_state.login_attempts = 0
                                     st.session_state.show_change_password = False
                                     st.session_state.force_change_password = False
-                                    time.sleep(1)
                                     st.rerun()
                                 else:
                                     st.error("Mật khẩu cũ không chính xác.")
 
         if st.session_state.selected_function in ["all", "Nhập liệu"] and not st.session_state.force_change_password:
-            st.subheader("📝 Nhập liệu")
-            input_sheets = get_input_sheets(sh)
-            if not input_sheets:
-                st.error("Không tìm thấy sheet nhập liệu hợp lệ.")
-            else:
-                selected_sheet = st.selectbox("Chọn sheet để nhập liệu", input_sheets, key="input_sheet")
-                required_columns, optional_columns = get_columns(sh, selected_sheet)
-                column_formats = get_column_formats(sh, selected_sheet)
-                if required_columns or optional_columns:
-                    with st.form(f"input_form_{selected_sheet}"):
-                        form_data = {}
-                        for header in required_columns:
-                            clean_header = header.rstrip('*')
-                            st.markdown(f'<span class="required-label">{clean_header} (bắt buộc)</span>', unsafe_allow_html=True)
-                            format_type = column_formats.get(clean_header, 'text')
-                            if format_type == 'date':
-                                form_data[clean_header] = st.date_input(
-                                    label=clean_header,
-                                    label_visibility="collapsed",
-                                    key=f"{selected_sheet}_{clean_header}_input",
-                                    value=None,
-                                    format="DD/MM/YYYY"
-                                )
-                            elif format_type == 'number':
-                                form_data[clean_header] = st.text_input(
-                                    label=clean_header,
-                                    label_visibility="collapsed",
-                                    key=f"{selected_sheet}_{clean_header}_input",
-                                    help="Chỉ nhập số"
-                                )
-                            else:
-                                form_data[clean_header] = st.text_input(
-                                    label=clean_header,
-                                    label_visibility="collapsed",
-                                    key=f"{selected_sheet}_{clean_header}_input"
-                                )
-                        for header in optional_columns:
-                            clean_header = header.rstrip('*')
-                            format_type = column_formats.get(clean_header, 'text')
-                            if format_type == 'date':
-                                form_data[clean_header] = st.date_input(
-                                    label=clean_header,
-                                    label_visibility="collapsed",
-                                    key=f"{selected_sheet}_{clean_header}_input",
-                                    value=None,
-                                    format="DD/MM/YYYY"
-                                )
-                            elif format_type == 'number':
-                                form_data[clean_header] = st.text_input(
-                                    label=clean_header,
-                                    label_visibility="collapsed",
-                                    key=f"{selected_sheet}_{clean_header}_input",
-                                    placeholder=f"{clean_header} (tùy chọn, chỉ nhập số)",
-                                    help="Chỉ nhập số"
-                                )
-                            else:
-                                form_data[clean_header] = st.text_input(
-                                    label=clean_header,
-                                    placeholder=f"{clean_header} (tùy chọn)",
-                                    label_visibility="collapsed",
-                                    key=f"{selected_sheet}_{clean_header}_input"
-                                )
-                        submit_data = st.form_submit_button("Gửi")
-
-                        if submit_data:
-                            missing_required = []
-                            validated_data = {}
-                            # Validate các trường bắt buộc
-                            for header in required_columns:
-                                clean_header = header.rstrip('*')
-                                format_type = column_formats.get(clean_header, 'text')
-                                value = form_data.get(clean_header, '')
-                                if format_type == 'date':
-                                    if value is None:
-                                        st.error(f"Trường {clean_header} không được để trống.")
-                                        missing_required.append(clean_header)
-                                    else:
-                                        validated_data[clean_header] = value.strftime("%d/%m/%Y")
-                                elif format_type == 'number':
-                                    if not value:
-                                        st.error(f"Trường {clean_header} không được để trống.")
-                                        missing_required.append(clean_header)
-                                    elif not re.match(r'^\d+$', str(value)):
-                                        st.error(f"Trường {clean_header} chỉ được nhập số.")
-                                        missing_required.append(clean_header)
-                                    else:
-                                        validated_data[clean_header] = str(value)
-                                else:
-                                    is_valid, result = validate_input(value, clean_header)
-                                    if not is_valid:
-                                        st.error(result)
-                                        missing_required.append(clean_header)
-                                    else:
-                                        validated_data[clean_header] = result
-                            # Nếu có trường bắt buộc bị thiếu, dừng lại và không lưu
-                            if missing_required:
-                                st.error(f"Vui lòng nhập các trường bắt buộc: {', '.join(missing_required)}")
-                                return  # Dừng xử lý, không lưu dữ liệu
-                            # Không validate các trường không bắt buộc, chỉ lấy giá trị
-                            for header in optional_columns:
-                                clean_header = header.rstrip('*')
-                                format_type = column_formats.get(clean_header, 'text')
-                                value = form_data.get(clean_header, '')
-                                if format_type == 'date':
-                                    validated_data[clean_header] = value.strftime("%d/%m/%Y") if value else ''
-                                elif format_type == 'number':
-                                    if value and not re.match(r'^\d+$', str(value)):
-                                        st.error(f"Trường {clean_header} chỉ được nhập số.")
-                                        return
-                                    validated_data[clean_header] = str(value) if value else ''
-                                else:
-                                    validated_data[clean_header] = value if value else ''
-                            # Lưu dữ liệu nếu không có lỗi
-                            if add_data_to_sheet(sh, selected_sheet, validated_data, st.session_state.username):
-                                st.success("🎉 Dữ liệu đã được nhập thành công!")
-                            else:
-                                st.error("Lỗi khi nhập dữ liệu. Vui lòng kiểm tra log và thử lại.")
+            input_section(sh)
 
         if st.session_state.selected_function in ["all", "Xem và sửa dữ liệu"] and not st.session_state.force_change_password:
-            st.subheader("📊 Xem và sửa dữ liệu đã nhập")
-            view_sheets = get_view_sheets(sh)
-            if not view_sheets:
-                st.error("Không tìm thấy sheet xem dữ liệu hợp lệ.")
-            else:
-                selected_view_sheet = st.selectbox("Chọn sheet để xem", view_sheets, key="view_sheet")
-                col1, col2 = st.columns(2)
-                with col1:
-                    start_date = st.date_input("Từ ngày", value=datetime.now().date() - timedelta(days=90), key="start_date")
-                with col2:
-                    end_date = st.date_input("Đến ngày", value=datetime.now().date(), key="end_date")
-                search_keyword = st.text_input("Tìm kiếm bản ghi", key="view_search_keyword")
-                
-                col1, col2 = st.columns(2)
-                with col1:
-                    if st.button("Áp dụng bộ lọc", key="apply_filter"):
-                        st.session_state.filter_applied = True
-                with col2:
-                    if st.button("Làm mới", key="refresh_data"):
-                        for key in list(st.session_state.keys()):
-                            if key.startswith(f"{selected_view_sheet}_"):
-                                del st.session_state[key]
-                        st.session_state.filter_applied = True
-
-                if 'filter_applied' in st.session_state and st.session_state.filter_applied:
-                    headers, user_data = get_user_data(
-                        sh, selected_view_sheet, st.session_state.username, st.session_state.role, start_date, end_date, search_keyword
-                    )
-                    if headers and user_data:
-                        df = pd.DataFrame([row for _, row in user_data], dtype=str)
-                        df.insert(0, 'row_idx', [row_idx for row_idx, _ in user_data])
-                        df['sheet'] = selected_view_sheet
-
-                        df = clean_dataframe(df)
-
-                        # Tạo grid với inline editing
-                        gb = GridOptionsBuilder.from_dataframe(df)
-                        for col in df.columns:
-                            if col not in ['row_idx', 'sheet']:
-                                gb.configure_column(
-                                    col,
-                                    minWidth=200,
-                                    autoSize=True,
-                                    wrapText=True,
-                                    autoHeight=True,
-                                    editable=True  # Bật chỉnh sửa trực tiếp
-                                )
-                            else:
-                                gb.configure_column(col, hide=True)
-                        gb.configure_grid_options(
-                            domLayout='autoHeight',
-                            suppressHorizontalScroll=False,
-                            suppressColumnVirtualisation=False,
-                            autoSizeColumnsMode='fitCellContents',
-                            enableRangeSelection=True,
-                            rowSelection='multiple',
-                            enableCellTextSelection=True
-                        )
-                        grid_response = AgGrid(
-                            df,
-                            gridOptions=gb.build(),
-                            update_mode=GridUpdateMode.VALUE_CHANGED,
-                            data_return_mode=DataReturnMode.AS_INPUT,
-                            height=400 if len(df) < 10 else 600,
-                            fit_columns_on_grid_load=True,
-                            allow_unsafe_jscode=True,
-                            custom_css={"#gridToolBar": {"display": "none"}},
-                        )
+            view_section(sh)
 
-                        # Lấy dữ liệu đã chỉnh sửa
-                        updated_df = pd.DataFrame(grid_response['data'])
-                        if not updated_df.empty and not updated_df.equals(df):
-                            for idx, row in updated_df.iterrows():
-                                row_idx = row['row_idx']
-                                if pd.isna(row_idx) or not str(row_idx).isdigit():
-                                    continue  # Bỏ qua hàng không hợp lệ
-                                original_row = df[df['row_idx'] == row_idx].iloc[0] if row_idx in df['row_idx'].values else None
-                                if original_row is not None and not row.drop(['row_idx', 'sheet']).equals(original_row.drop(['row_idx', 'sheet'])):
-                                    sheet_name = row['sheet']
-                                    updated_data = row.drop(['row_idx', 'sheet']).to_dict()
-                                    # Validate dữ liệu trước khi cập nhật
-                                    missing_required = []
-                                    validated_data = {}
-                                    required_columns, _ = get_columns(sh, sheet_name)
-                                    for header in required_columns:
-                                        clean_header = header.rstrip('*')
-                                        is_valid, result = validate_input(updated_data.get(clean_header, ''), clean_header)
-                                        if not is_valid:
-                                            st.error(result)
-                                            return
-                                        validated_data[clean_header] = result
-                                        if not updated_data.get(clean_header):
-                                            missing_required.append(clean_header)
-                                    for header in updated_data:
-                                        if header not in validated_data:
-                                            _, result = validate_input(updated_data.get(header, ''), header)
-                                            validated_data[header] = result
-                                    if missing_required:
-                                        st.error(f"Vui lòng nhập các trường bắt buộc: {', '.join(missing_required)}")
-                                        return
-                                    else:
-                                        if update_data_in_sheet(sh, sheet_name, int(row_idx), validated_data, st.session_state.username):
-                                            st.success(f"🎉 Bản ghi #{int(row_idx) + 2} đã được cập nhật thành công!", icon="✅")
-                                        else:
-                                            st.error("Lỗi khi cập nhật dữ liệu. Vui lòng kiểm tra log và thử lại.")
-                                            return
-                    else:
-                        st.info("Không có dữ liệu nào được nhập trong khoảng thời gian hoặc từ khóa này.")
+        if st.session_state.role.lower() == 'admin' and not st.session_state.force_change_password:
+            run_scheduled_rollover(sh)
+            if st.session_state.selected_function == "Lưu trữ dữ liệu":
+                st.subheader("🗄️ Lưu trữ dữ liệu cũ")
+                input_sheets = get_input_sheets(sh)
+                if not input_sheets:
+                    st.error("Không tìm thấy sheet nhập liệu hợp lệ.")
+                else:
+                    archive_sheet = st.selectbox("Chọn sheet để lưu trữ", input_sheets, key="archive_sheet")
+                    cutoff_date = st.date_input(
+                        "Lưu trữ các bản ghi nhập trước ngày",
+                        value=quarter_start(datetime.now().date() - timedelta(days=90)),
+                        key="archive_cutoff",
+                        format="DD/MM/YYYY"
+                    )
+                    st.caption("Ngày được làm tròn về đầu quý; mỗi quý được chuyển sang một sheet lưu trữ riêng và đăng ký trong Config.")
+                    if st.button("Chuyển sang lưu trữ", key="run_archive"):
+                        results = [rollover_sheet(sh, sheet_ref, cutoff_date) for sheet_ref in get_sheet_shards(sh, archive_sheet)]
+                        moved = sum(result or 0 for result in results)
+                        if None not in results:
+                            st.success(f"Đã chuyển {moved} bản ghi sang sheet lưu trữ.")
+            if st.session_state.selected_function == "Thống kê nhập liệu":
+                stats_section(sh)
 
         if st.session_state.selected_function in ["all", "Tìm kiếm"] and not st.session_state.force_change_password:
-            st.subheader("🔍 Tìm kiếm")
-            lookup_sheets = get_lookup_sheets(sh)
-            if not lookup_sheets:
-                st.error("Không tìm thấy sheet tra cứu hợp lệ.")
-            else:
-                selected_lookup_sheet = st.selectbox("Chọn sheet để tìm kiếm", lookup_sheets, key="lookup_sheet")
-                headers = [h.rstrip('*') for h in get_columns(sh, selected_lookup_sheet)[0]] + get_columns(sh, selected_lookup_sheet)[1]
-                search_column = st.selectbox("Chọn cột để tìm kiếm", ["Tất cả"] + headers, key="search_column")
-                keyword = st.text_input("Nhập từ khóa tìm kiếm", key="search_keyword")
-                if st.button("Tìm kiếm", key="search_button"):
-                    headers, search_results = search_in_sheet(sh, selected_lookup_sheet, keyword, search_column)
-                    if headers and search_results:
-                        df = pd.DataFrame(search_results, dtype=str)
-                        df = clean_dataframe(df)
-                        st.dataframe(df)
-                    else:
-                        st.info("Không tìm thấy kết quả nào khớp với từ khóa.")
+            search_section(sh)
 
 if __name__ == "__main__":
     main()
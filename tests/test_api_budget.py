@@ -0,0 +1,7 @@
+import api_budget
+
+
+def test_every_action_within_api_budget():
+    rows = api_budget.measure()
+    failed = [(row["action"], row["round"], row["reads"], row["writes"], row["exceptions"]) for row in rows if not row["ok"]]
+    assert rows and failed == []
@@ -0,0 +1,58 @@
+from cache_store import BackgroundRefresher, LRUCache
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(300)
+    cache.set("a", "a", size=100)
+    cache.set("b", "b", size=100)
+    cache.set("c", "c", size=100)
+    cache.get("a")
+    cache.set("d", "d", size=100)
+    assert "b" not in cache and {"a", "c", "d"} <= set(cache._entries)
+    assert cache.current_bytes == 300 and cache.evictions == 1
+    hits = cache.hits
+    assert cache.peek("c") == "c" and cache.peek("b") is None and cache.hits == hits
+    # Mục lớn hơn cả ngân sách không được lưu
+    cache.set("big", "x", size=1000)
+    assert "big" not in cache and cache.rejected == 1
+
+
+def make_refresher(cache, **options):
+    # Chu kỳ dài: luồng nền không tự chạy trong lúc kiểm tra, gọi refresh_due() trực tiếp
+    return BackgroundRefresher(cache, interval=3600, **options)
+
+
+def test_refresher_serves_stale_value_then_reloads():
+    cache = LRUCache(10_000)
+    refresher = make_refresher(cache, max_staleness=60)
+    revision = {"value": 1}
+    refresher.store("k", "old", 1, lambda previous: "new", lambda: revision["value"])
+    assert refresher.lookup("k", 1) == "old"
+    revision["value"] = 2
+    assert refresher.lookup("k", 2) == "old" and refresher.is_stale("k")
+    hits, misses = cache.hits, cache.misses
+    refresher.refresh_due()
+    # Làm mới nền không được tính vào số liệu hit/miss của bộ nhớ đệm
+    assert (cache.hits, cache.misses) == (hits, misses)
+    assert refresher.lookup("k", 2) == "new" and not refresher.is_stale("k")
+
+
+def test_refresher_stops_serving_after_max_staleness():
+    cache = LRUCache(10_000)
+    refresher = make_refresher(cache, max_staleness=0)
+    refresher.store("k", "old", 1, lambda previous: "new", lambda: 1)
+    refresher.lookup("k", 2)
+    assert refresher.lookup("k", 2) is None
+    # Khi không tải được bản mới vẫn lấy được bản cũ
+    assert refresher.fallback("k") == "old"
+
+
+def test_refresher_drops_entries_evicted_from_cache():
+    cache = LRUCache(1000)
+    refresher = make_refresher(cache)
+    loads = []
+    refresher.store("a", "a", 1, lambda previous: loads.append("a") or "a", lambda: 2)
+    cache.set("b", "b", size=1000)  # đẩy "a" ra khỏi bộ nhớ đệm
+    refresher.refresh_due()
+    assert loads == [] and "a" not in cache
+    assert refresher.stats()["entries"] == 0 and refresher.stats()["dropped"] == 1
@@ -0,0 +1,162 @@
+import threading
+
+import pytest
+
+import resilience
+from resilience import CircuitBreaker, CircuitOpenError, WriteQueue, endpoint_of, is_unavailable
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(resilience.time, "time", clock.time)
+    monkeypatch.setattr(resilience.random, "uniform", lambda a, b: 0.0)
+    return clock
+
+
+def test_endpoint_of():
+    assert endpoint_of("GET", "https://sheets.googleapis.com/v4/spreadsheets/x/values/A1") == resilience.READ_ENDPOINT
+    assert endpoint_of("POST", "https://sheets.googleapis.com/v4/spreadsheets/x:batchUpdate") == resilience.WRITE_ENDPOINT
+    assert endpoint_of("GET", "https://www.googleapis.com/drive/v3/files/x") == resilience.DRIVE_ENDPOINT
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("sheets.read", failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        breaker.record(429, breaker.before_call())
+    breaker.record(200, breaker.before_call())
+    assert breaker.state == "closed" and breaker.failures == 0
+    for _ in range(3):
+        breaker.record(503, breaker.before_call())
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.before_call()
+    assert is_unavailable(error.value) and error.value.response.status_code == 429
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_breaker_half_open_probe_closes_on_success(clock):
+    breaker = CircuitBreaker("sheets.read", failure_threshold=1, reset_timeout=30)
+    breaker.record(429, breaker.before_call())
+    clock.now += 31
+    probe = breaker.before_call()
+    assert probe and breaker.state == "half_open"
+    # Chỉ một request thăm dò tại một thời điểm
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record(200, probe)
+    assert breaker.state == "closed"
+    assert breaker.before_call() is False
+
+
+def test_breaker_failed_probe_doubles_timeout(clock):
+    breaker = CircuitBreaker("drive", failure_threshold=1, reset_timeout=30, max_reset_timeout=50)
+    breaker.record(429, breaker.before_call())
+    clock.now += 31
+    breaker.record(500, breaker.before_call())
+    assert breaker.state == "open"
+    clock.now += 31
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    clock.now += 20  # thời gian chờ gấp đôi nhưng không quá max_reset_timeout
+    assert breaker.before_call() is True
+
+
+def test_breaker_release_frees_probe(clock):
+    breaker = CircuitBreaker("sheets.write", failure_threshold=1, reset_timeout=30)
+    breaker.record(429, breaker.before_call())
+    clock.now += 31
+    assert breaker.before_call() is True
+    breaker.release(True)
+    assert breaker.before_call() is True
+
+
+def test_session_releases_probe_when_rate_limiter_fails(clock):
+    from sheets_client import PooledAuthorizedSession
+
+    class BrokenLimiter:
+        def acquire(self):
+            raise RuntimeError("kho dùng chung hỏng")
+
+    registry = resilience.BreakerRegistry(failure_threshold=1, reset_timeout=30)
+    breaker = registry.get(resilience.READ_ENDPOINT)
+    breaker.record(429, breaker.before_call())
+    clock.now += 31
+    session = PooledAuthorizedSession.__new__(PooledAuthorizedSession)
+    session.breakers, session.rate_limiter = registry, BrokenLimiter()
+    with pytest.raises(RuntimeError):
+        session.request("GET", "https://sheets.googleapis.com/v4/spreadsheets/x/values/A1")
+    assert breaker.state == "half_open" and breaker.before_call() is True
+
+
+def unavailable():
+    return CircuitOpenError("sheets.write", 1)
+
+
+def make_queue():
+    queue = WriteQueue(base_delay=3600, max_delay=3600, jitter=0)
+    # Luồng nền vẫn chờ trên Event cũ nên không chạy song song với drain() gọi trực tiếp trong test
+    queue._wake = threading.Event()
+    return queue
+
+
+def test_write_queue_keeps_order_and_retries_unavailable():
+    queue = make_queue()
+    done, attempts = [], {"first": 0}
+
+    def first():
+        attempts["first"] += 1
+        if attempts["first"] == 1:
+            raise unavailable()
+        done.append("first")
+
+    queue.submit("first", first)
+    queue.submit("second", lambda: done.append("second"))
+    for job in queue._jobs:
+        job["next_at"] = 0
+    queue.drain()
+    # Job đầu còn quá tải: job sau không được gửi vượt lên
+    assert done == [] and queue.stats()["pending"] == 2 and queue.stats()["retries"] == 1
+    for job in queue._jobs:
+        job["next_at"] = 0
+    queue.drain()
+    assert done == ["first", "second"] and queue.stats()["completed"] == 2
+
+
+def test_write_queue_sends_in_submission_order_despite_jitter(monkeypatch):
+    # Đồng hồ giả nhưng jitter thật (random không bị thay)
+    now = {"value": 1000.0}
+    monkeypatch.setattr(resilience.time, "time", lambda: now["value"])
+    for _ in range(50):
+        queue = WriteQueue(base_delay=1, max_delay=1, jitter=1.0)
+        queue._wake = threading.Event()
+        sent = []
+        queue.submit("append", lambda: sent.append("append"))
+        queue.submit("edit", lambda: sent.append("edit"))
+        while len(sent) < 2:
+            now["value"] += 0.05
+            queue.drain()
+            # Job sau không bao giờ được gửi khi job trước chưa gửi
+            assert sent in ([], ["append"], ["append", "edit"])
+        assert sent == ["append", "edit"]
+
+
+def test_write_queue_drops_job_on_other_errors():
+    queue = make_queue()
+
+    def broken():
+        raise ValueError("hàng không còn")
+
+    queue.submit("broken", broken)
+    queue._jobs[0]["next_at"] = 0
+    queue.drain()
+    stats = queue.stats()
+    assert stats["pending"] == 0 and stats["failed"][0]["description"] == "broken"
@@ -0,0 +1,54 @@
+import pytest
+
+import shared_store
+from resilience import CircuitOpenError, is_unavailable
+from shared_store import RateLimiter, SharedStore
+
+
+def test_rate_limiter_shares_budget_between_instances(tmp_path, monkeypatch):
+    path = str(tmp_path / "shared.db")
+    now = {"value": 1000.0}
+    slept = []
+
+    def sleep(seconds):
+        slept.append(seconds)
+        now["value"] += seconds
+
+    monkeypatch.setattr(shared_store.time, "time", lambda: now["value"])
+    monkeypatch.setattr(shared_store.time, "sleep", sleep)
+    # Hai "tiến trình" dùng chung một file: 60 request/phút, tối đa 2 request liền nhau
+    first = RateLimiter(SharedStore(path), per_minute=60, burst=2)
+    second = RateLimiter(SharedStore(path), per_minute=60, burst=2)
+    first.acquire()
+    second.acquire()
+    assert slept == []
+    first.acquire()
+    assert slept == [1.0]
+    assert first.stats()["acquired"] == 2 and second.stats()["acquired"] == 1
+
+
+def test_rate_limiter_fails_fast_instead_of_long_wait(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared_store.time, "sleep", lambda seconds: pytest.fail("không được ngủ chờ"))
+    limiter = RateLimiter(SharedStore(str(tmp_path / "shared.db")), per_minute=1, burst=1)
+    limiter.acquire()
+    with pytest.raises(CircuitOpenError) as error:
+        limiter.acquire()
+    assert is_unavailable(error.value) and error.value.retry_after > 1
+    assert limiter.stats()["timeouts"] == 1
+
+
+def test_get_or_fetch_rechecks_after_acquiring_lease(tmp_path, monkeypatch):
+    path = str(tmp_path / "shared.db")
+    store, other = SharedStore(path), SharedStore(path)
+    acquire = store.acquire
+
+    def acquire_after_other_process_stored(name, owner):
+        # Tiến trình khác tải xong và nhả quyền ngay trước khi tiến trình này giành được quyền
+        other.put(name, "v1", "từ tiến trình khác")
+        return acquire(name, owner)
+
+    monkeypatch.setattr(store, "acquire", acquire_after_other_process_stored)
+    fetched = []
+    value = store.get_or_fetch("key", "v1", lambda: fetched.append(1) or "tự tải")
+    assert value == "từ tiến trình khác" and fetched == []
+    assert store.acquire("key", "someone-else")
@@ -0,0 +1,115 @@
+from datetime import date, datetime
+
+import sheet_index
+from sheet_index import ID_COLUMN, SheetDataset, SuggestionIndex, TimestampIndex
+
+HEADERS = ["Ho_ten*", "So_CMT", "Nguoi_nhap", "Thoi_gian_nhap", ID_COLUMN]
+
+
+def make_row(name, cmt, user, day, record_id):
+    return [name, cmt, user, f"{day:02d}/01/2024 08:00:00", record_id]
+
+
+def make_dataset():
+    return SheetDataset(HEADERS, [
+        make_row("Nguyễn Văn An", "001", "user1", 1, "id1"),
+        make_row("Trần Thị Bình", "002", "user2", 2, "id2"),
+        make_row("Lê Văn Cường", "003", "user1", 3, "id3"),
+    ])
+
+
+def test_append_updates_indexes():
+    dataset = make_dataset()
+    pos = dataset.append(make_row("Phạm Văn Dũng", "004", "user2", 4, "id4"))
+    assert pos == 3 and len(dataset) == 4
+    assert dataset.position_of("id4") == 3
+    assert dataset.select(username="user2") == [1, 3]
+    assert dataset.select(start_date=date(2024, 1, 3), end_date=date(2024, 1, 4)) == [2, 3]
+    assert dataset.rows[3][0] == "Phạm Văn Dũng"
+
+
+def test_update_moves_row_between_indexes():
+    dataset = make_dataset()
+    version = dataset.version
+    dataset.update(0, make_row("Nguyễn Văn An", "009", "user2", 5, "id1"))
+    assert dataset.version > version
+    assert dataset.select(username="user1") == [2]
+    assert dataset.select(username="user2") == [0, 1]
+    assert dataset.select(start_date=date(2024, 1, 5), end_date=date(2024, 1, 5)) == [0]
+    assert dataset.find_key(["So_CMT"], ["009"]) == [0]
+    assert dataset.find_key(["So_CMT"], ["001"]) == []
+
+
+def test_malformed_timestamps_kept_when_filtering_by_date():
+    dataset = make_dataset()
+    dataset.append(["Không ngày", "005", "user1", "sai", "id5"])
+    assert dataset.select(start_date=date(2024, 1, 1), end_date=date(2024, 1, 1)) == [0, 3]
+    assert dataset.select(username="user1", start_date=date(2024, 1, 3), end_date=date(2024, 1, 3)) == [2, 3]
+
+
+def test_compaction_keeps_rows(monkeypatch):
+    monkeypatch.setattr(sheet_index, "COMPACT_MIN_ROWS", 4)
+    dataset = make_dataset()
+    for i in range(10):
+        dataset.append(make_row(f"Khách {i}", f"1{i:02d}", "user1", 6, f"n{i}"))
+    dataset.update(1, make_row("Trần Thị Bình", "222", "user2", 2, "id2"))
+    store = dataset.rows
+    # Sau khi gộp, phần tạm chỉ còn ít hơn ngưỡng
+    assert len(store._tail) + len(store._patches) < 4
+    assert len(dataset) == 13
+    assert dataset.rows[1][1] == "222"
+    assert [dataset.rows[pos][0] for pos in range(3, 13)] == [f"Khách {i}" for i in range(10)]
+    frame = dataset.frame([12, 1])
+    assert frame["Ho_ten*"].tolist() == ["Khách 9", "Trần Thị Bình"]
+
+
+def test_filter_keyword_ignores_accents_and_case():
+    dataset = make_dataset()
+    everything = range(len(dataset))
+    assert dataset.filter_keyword(everything, "van") == [0, 2]
+    assert dataset.filter_keyword(everything, "BÌNH") == [1]
+    assert dataset.filter_keyword(everything, "00", column="So_CMT") == [0, 1, 2]
+    assert dataset.filter_keyword(everything, "an", column="Khong_co") == []
+    # Thu hẹp từ kết quả trước cho kết quả như lọc lại từ đầu
+    narrowed = dataset.filter_keyword(dataset.filter_keyword(everything, "v"), "van c")
+    assert narrowed == dataset.filter_keyword(everything, "van c") == [2]
+    # Hàng thêm sau khi đã tạo chỉ mục tìm kiếm cũng tìm được
+    dataset.append(make_row("Vân Anh", "006", "user2", 7, "id6"))
+    assert dataset.filter_keyword(range(len(dataset)), "van") == [0, 2, 3]
+
+
+def test_match_scores_rank_exact_then_prefix():
+    dataset = SheetDataset(["Ten"], [["an"], ["an binh"], ["binh an"], ["hoan"]])
+    assert dataset.match_scores(range(4), "an").tolist() == [3, 2, 1, 0]
+
+
+def test_sync_appends_only_new_rows():
+    dataset = make_dataset()
+    values = [HEADERS] + [dataset.rows[pos] for pos in range(3)] + [make_row("Mới", "007", "user1", 8, "id7")]
+    assert dataset.sync(values)
+    assert len(dataset) == 4 and dataset.position_of("id7") == 3
+    assert not dataset.sync([["Cot_khac"]])
+
+
+def test_timestamp_index_range_and_remove():
+    index = TimestampIndex()
+    for pos, day in enumerate([3, 1, 2]):
+        index.add(pos, datetime(2024, 1, day, 9))
+    index.add(3, None)
+    assert index.positions_between(date(2024, 1, 1), date(2024, 1, 2)) == [1, 2]
+    assert index.count_between(date(2024, 1, 1), date(2024, 1, 3)) == 3
+    index.remove(2, datetime(2024, 1, 2, 9))
+    assert index.positions_between(date(2024, 1, 1), date(2024, 1, 3)) == [1, 0]
+    assert index.malformed == {3}
+
+
+def test_suggestion_index_prefix_and_frequency():
+    index = SuggestionIndex(["Hà Nội", "ha  noi", "Hải Phòng", "Huế", "Hà Nội"])
+    assert index.top("ha") == [("Hà Nội", 3), ("Hải Phòng", 1)]
+    assert index.top("", limit=1) == [("Hà Nội", 3)]
+    index.add("Huế")
+    index.add("Huế")
+    index.add("Huế")
+    assert index.top("", limit=1) == [("Huế", 4)]
+    index.remove("Hải Phòng")
+    assert index.top("hai") == []